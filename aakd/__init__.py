@@ -4,5 +4,35 @@ from .record import *
 from .akd_command_list import akd_command_list
 from .akd_flags import *
 from .akd_move import *
+from .akd_file import AkdFile
+from .clock import SystemClock, VirtualClock, system_clock
+from .setpoints import SetpointProfile, SetpointStreamer
+from .motion_program import MotionTask, MotionProgram
+from .governor import CommandGovernor, SAFETY, SETPOINT, RECORDER, TELEMETRY, ADHOC
+from .fleet import FleetScheduler, ConnectionPool, CancelToken, Cancelled, subnet_of
+from .session import CaptureTransport, ReplayTransport, load_session, format_session
+from .trace import TraceBuffer, load_trace, format_trace, dump_all, install_dump_signal
 
-from .plot_recording import main as plot_recording
+
+# Loaded on first use, to keep the startup (and completion) of the `aakd` command fast.
+# plot_recording needs pandas and matplotlib.
+_lazy_attributes = {
+    "AKDEmulator": (".emulator", "AKDEmulator"),
+    "EmulatorServer": (".emulator_server", "EmulatorServer"),
+    "AkdIndex": (".akd_file", "AkdIndex"),
+    "FleetConfig": (".fleet_config", "FleetConfig"),
+    "Inventory": (".inventory", "Inventory"),
+    "plot_recording": (".plot_recording", "main"),
+    "SegmentStore": (".segments", "SegmentStore"),
+    "ProcessRecorder": (".record_processes", "ProcessRecorder"),
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        import importlib
+        (module, attribute) = _lazy_attributes[name]
+        value = getattr(importlib.import_module(module, __name__), attribute)
+        globals()[name] = value
+        return value
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
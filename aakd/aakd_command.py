@@ -6,8 +6,10 @@ from aakd import nice_name
 
 import argcomplete
 import argparse
+from bisect import bisect_left
+from contextlib import redirect_stderr, redirect_stdout
+import os
 from pathlib import Path
-import yaml
 import sys
 
 
@@ -18,44 +20,43 @@ def date_to_filename(d):
 
 # Helper functions
 
+_config = None
+
+
+def fleet_config(args):
+    """ The drives and parameters files configuration, loaded once. """
+    global _config
+    if _config is None:
+        if not args.drives_file:
+            raise Exception("Please provide and drive file")
+        _config = aakd.FleetConfig.load(args.drives_file, args.params_file)
+    return _config
+
+
 def drives(args):
     """ Return a list of (name, ip) of drives to act on. """
     ips = args.ip
     names = args.name
-    drives_file = args.drives_file
     groups = args.groups
     if ips:
         return [(i, i) for i in ips]
     else:
-        if not drives_file:
-            raise Exception("Please provide and drive file")
-        with open(drives_file) as f:
-            yy = yaml.load(f, Loader=yaml.Loader)
-            drives = []
-            if names:
-                available_names = yy.keys()
-                for n in names:
-                    if n in available_names:
-                        drives.append((n, yy[n]['ip']))
-                    else:
-                        raise Exception("Name {} is not in the drive file".format(n))
-            else:
-                for (name, p) in yy.items():
-                    drive_groups = p.get("groups", [])
-                    keep = True
-                    for g in groups:
-                        if g not in drive_groups:
-                            keep = False
-                    if keep:
-                        drives.append((name, p['ip']))
-
-            return drives
+        config = fleet_config(args)
+        if names:
+            for n in names:
+                if n not in config.drives:
+                    raise Exception("Name {} is not in the drive file".format(n))
+        elif args.select:
+            names = config.inventory.select(args.select)
+        else:
+            names = config.inventory.sorted(config.inventory.groups(groups))
+        return [(n, config.ip(n)) for n in names]
 
 def folder_path(args):
     if args.folder:
         return Path(args.folder)
     if args.drives_file:
-        return Path(args.drives_file).parent
+        return Path(args.drives_file[0]).parent
     return Path.cwd()
 
 
@@ -67,149 +68,164 @@ def akd_filename(name, ip, args):
     return folder_path(args) / filename
 
 
-def deep_update_dict(d1, d2):
-    for k, v in d2.items():
-        if k in d1 and isinstance(d1[k], dict) and isinstance(v, dict):
-            deep_update_dict(d1[k], v)
-        else:
-            d1[k] = v
-
-
-def load_param_files(args):
-    params = {}
-    for param_file in args.params_file:
-        with open(param_file) as f:
-            new_params = yaml.load(f, Loader=yaml.Loader)
-            if not set(new_params.keys()).issubset({'drives', 'groups'}):
-                raise Exception("Paramter file top level keys should be drives or group, see " + param_file)
-            deep_update_dict(params, new_params)
-    return params
-
-
-
-def create_AKD(ip, args):
-    trace = args.trace
+def create_AKD(ip, args, cancel=None):
+    kwargs = {'trace': args.trace, 'cancel': cancel}
+    if getattr(args, 'command_rate', None):
+        kwargs['governor'] = aakd.CommandGovernor(args.command_rate, args.command_burst)
+    if getattr(args, 'capture', None):
+        kwargs['capture'] = aakd.session.session_filename(args.capture, ip)
+    if getattr(args, 'replay', None):
+        kwargs['transport'] = aakd.ReplayTransport(aakd.session.session_filename(args.replay, ip),
+                                                   speed=args.replay_speed)
 
     lip = ip.split(':')
     if len(lip) == 1:
-        return aakd.AKD(ip, trace=trace)
+        return aakd.AKD(ip, **kwargs)
     elif len(lip) == 2:
-        return aakd.AKD(lip[0], port=lip[1], trace=trace)
+        return aakd.AKD(lip[0], port=lip[1], **kwargs)
     else:
         raise Exception("Ip '{}' is invalid".format(ip))
 
 
-def parallel_create_AKD(function, function_extra_args, args, long_running=False):
-    stop_var = False
+def fleet_scheduler(args, long_running=False):
+    return aakd.FleetScheduler(
+        max_workers=args.threads,
+        per_group=args.subnet_threads,
+        timeout=None if long_running else args.timeout,
+        retries=args.retries,
+        stop_on_error=args.stop_on_error,
+        progress=args.progress and not long_running)
 
-    def stop():
-        nonlocal stop_var
-        return stop_var
 
-    def thread_fun(name, ip, function_extra_args, args):
-        nonlocal stop, long_running
-        a = create_AKD(ip, args)
-        if long_running:
-            function(a, name, ip, stop, *function_extra_args)
-        else:
-            function(a, name, ip, *function_extra_args)
+_pool = None
+
+
+def connection_pool(args):
+    """ Connections kept open for the whole command (eg `home` then saving reuses them). """
+    global _pool
+    if _pool is None:
+        _pool = aakd.ConnectionPool(lambda name, ip: create_AKD(ip, args))
+    return _pool
 
-    import concurrent.futures as futures
-    dd = drives(args)
-    workers = args.threads if args.threads else len(dd) + 1
-    with futures.ThreadPoolExecutor(max_workers=workers) as pool:
-        fs = {}
-        for (name, ip) in dd:
-            nname = nice_name(name, ip)
-            f = pool.submit(thread_fun, name, ip, function_extra_args, args)
-            fs[f] = nname
-        try:
-            for f in futures.as_completed(fs.keys()):
-                nname = fs[f]
-                try:
-                    f.result()
-                except Exception as e:
-                    print(nname, "<Error> ", str(e), file=sys.stderr)
-                    if args.stop_on_error and not stop_var:
-                        stop_var = True
-                        for f in fs.keys():
-                            f.cancel()
-        except KeyboardInterrupt:
-            if not stop_var:
-                stop_var = True
-                for f in fs.keys():
-                    f.cancel()
 
+def parallel_create_AKD(function, function_extra_args, args, long_running=False, on_done=None):
+    """ Run `function(akd, name, ip, *function_extra_args)` on all the selected drives.
+    Long running functions are given a `stop()` function after ip, telling them to return.
+    Return the list of `FleetTask`.
+    """
+    def run(a, name, ip, token):
+        if long_running:
+            return function(a, name, ip, token.is_set, *function_extra_args)
+        else:
+            return function(a, name, ip, *function_extra_args)
+
+    def connect(name, ip, token):
+        # long running functions are stopped through stop() so that they can clean up
+        return connection_pool(args).get(name, ip, None if long_running else token)
+
+    scheduler = fleet_scheduler(args, long_running)
+    tasks = scheduler.run(drives(args), run, connect, connection_pool(args).release, on_done)
+    if on_done is None:
+        scheduler.report_errors(nice_name)
+    return tasks
+
+
+def parallel_output(function, args):
+    """ Run `function(akd, name, ip, out)` on all the selected drives concurrently.
+    Each drive prints to its own buffer `out`, printed in the drives order.
+    With --json, instead print one JSON line per drive with the value returned by `function`,
+    as soon as the drive is done.
+    """
+    import io
+    import json
+
+    outputs = {}
+    done = {}
+    next_index = 0
+
+    def run(a, name, ip):
+        out = io.StringIO()
+        outputs[(name, ip)] = out
+        return function(a, name, ip, out)
+
+    def on_done(task):
+        nonlocal next_index
+        if args.json:
+            print(json.dumps({'name': task.name, 'ip': task.ip, 'result': task.result,
+                              'error': str(task.error) if task.error is not None else None}), flush=True)
+            return
+        done[task.index] = task
+        while next_index in done:
+            t = done.pop(next_index)
+            next_index += 1
+            out = outputs.get((t.name, t.ip))
+            if out is not None:
+                print(out.getvalue(), end='', flush=True)
+            if t.error is not None:
+                print(nice_name(t.name, t.ip), " Error: ", str(t.error), file=sys.stderr, flush=True)
+
+    return parallel_create_AKD(run, [], args, on_done=on_done)
 
 
 def list_params(drive_name, args):
     """ Return a list of the parameters for drive_name according to drives_file and params_file"""
-    paramtree = load_param_files(args)
+    return fleet_config(args).drive_params(drive_name)
+
 
-    with open(args.drives_file) as f:
-        yy = yaml.load(f, Loader=yaml.Loader)
-        gs = yy[drive_name]["groups"]
+_akd_indexes = {}
 
-    drive_params = {'DRV.NAME': drive_name}
 
-    # do groups first
-    def apply_group_parameters(subtree):
-        for p, v in subtree.get("parameters", {}).items():
-            drive_params[p] = v
-        for (group, subsubtree) in subtree.items():
-            if group in gs:
-                apply_group_parameters(subsubtree)
-    apply_group_parameters(paramtree.get("groups", {}))
+def akd_index(args):
+    """ The index of the .akd files of the folder (saved when the command exits). """
+    folder = folder_path(args)
+    if folder not in _akd_indexes:
+        import atexit
+        _akd_indexes[folder] = aakd.AkdIndex(folder)
+        atexit.register(_akd_indexes[folder].save)
+    return _akd_indexes[folder]
 
-    # do specific to the drive
-    for p, v in paramtree.get("drives", {}).get(drive_name, {}).items():
-        drive_params[p] = v
 
-    return drive_params
+def akd_file(name, ip, args):
+    return akd_index(args).get(akd_filename(name, ip, args))
 
 
 def list_params_from_akdfiles(name, ip, args):
-    import re
-    with open(akd_filename(name, ip, args)) as f:
-        param_dict = {}
-        for l in f:
-            l = l.rstrip('\r\n')
-            if l and l[0] != '#':
-                g = re.match("^([^ ]+) ([^ \n]+).*", l)
-                if not g:
-                    raise Exception('Unexpected line in akd file: ' + repr(l))
-                param_dict[g.group(1)] = g.group(2)
-        return param_dict
+    return dict(akd_file(name, ip, args).params)
 
 
 # Subcommands function
 
 
 def akd_cmd(args):
-    for (name, ip) in drives(args):
-        try:
-            a = create_AKD(ip, args)
-            print(nice_name(name, ip), ": ", a.commandS(' '.join(args.cmd)))
-        except Exception as e:
-            print(nice_name(name, ip), " Error: ", str(e), file=sys.stderr)
+    def cmd(a, name, ip, out):
+        r = a.commandS(' '.join(args.cmd))
+        print(nice_name(name, ip), ": ", r, file=out)
+        return r
+    parallel_output(cmd, args)
 
 
 def akd_info(args):
-    for (name, ip) in drives(args):
-        try:
-            a = create_AKD(ip, args)
-            print(nice_name(name, ip), ": ")
-            print(a.drv_infos())
-        except Exception as e:
-            print(nice_name(name, ip), " Error: ", str(e), file=sys.stderr)
+    def info(a, name, ip, out):
+        infos = a.drv_infos()
+        print(nice_name(name, ip), ": ", file=out)
+        print(infos, file=out)
+        return infos
+    parallel_output(info, args)
 
 
 def restore_params(args):
+    # parsed beforehand, the index is not shared between threads
+    akd_files = {(name, ip): a for ((name, ip), a) in zip(
+        drives(args), akd_index(args).get_many([akd_filename(name, ip, args) for (name, ip) in drives(args)]))}
+
     def restore(a, name, ip):
         nonlocal args
         a.disable()
-        filename = akd_filename(name, ip, args)
-        a.load_params(filename, flash_afterward=True, factory_reset=args.factory, trust_drv_nvcheck=not args.force)
+        akd_file = akd_files[(name, ip)]
+        if isinstance(akd_file, Exception):
+            raise akd_file
+        a.load_params(akd_file, flash_afterward=True, factory_reset=args.factory, trust_drv_nvcheck=not args.force,
+                      verify=not args.no_verify, window=args.window)
     parallel_create_AKD(restore, [], args)
 
 
@@ -223,6 +239,38 @@ def save_params(args):
     parallel_create_AKD(save, [], args)
 
 
+def auto_rate(akds, fields, args):
+    """ The fastest recording frequency all the drives sustain, from their (possibly new) calibration. """
+    from aakd import rate_calibration
+    frequencies = []
+    for a in akds:
+        calibration = None
+        if not args.recalibrate:
+            calibration = rate_calibration.load_calibration(a.name, fields, args.retrievesize)
+        if calibration is None:
+            print(a.nice_name(), "Calibrating the recording rate...")
+            calibration = rate_calibration.calibrate(a, fields, args.retrievesize)
+            rate_calibration.save_calibration(a.name, calibration)
+        print(a.nice_name(), calibration.summary())
+        if calibration.frequency is None:
+            raise Exception("No recording rate without sample loss for " + a.nice_name())
+        frequencies.append(calibration.frequency)
+    return int(min(frequencies))
+
+
+def record_transform(args):
+    """ The `Transform` of the recorded data from the --derived and --decimate options (or None). """
+    if not args.derived and args.decimate <= 1:
+        return None
+    from aakd.transforms import Transform, DerivedChannel
+    channel_stats = {}
+    for c in args.channel_stats:
+        (channel, sep, stats) = c.partition('=')
+        channel_stats[channel] = stats.split(',')
+    return Transform([DerivedChannel.parse(d) for d in args.derived], args.decimate, args.stats.split(','),
+                     channel_stats)
+
+
 def record(args):
     from datetime import datetime
     filename = date_to_filename(datetime.now()) + '_' + args.filename + '_'
@@ -232,19 +280,113 @@ def record(args):
         print("Error: Frequency needs to be 16kHz/2^n.")
         exit(-1)
 
+    if args.processes:
+        return record_processes(args, filename, frequency)
+
     files = []
+    store = None
     try:
         akds = [create_AKD(ip, args) for (name, ip) in drives(args)]
-        files = [
-            open(filename + a.name + '.csv', mode='w')
-            for a in akds
-        ]
+        if args.auto_rate:
+            frequency = auto_rate(akds, args.fields.split(','), args)
+            print("Recording at {}Hz".format(frequency))
+        if args.segments:
+            from aakd.segments import SegmentStore
+            store = SegmentStore(args.segments, args.rotate_seconds,
+                                 args.rotate_mb * 1e6 if args.rotate_mb else None, args.compression,
+                                 args.budget_mb * 1e6 if args.budget_mb else None)
+            files = [store.writer(a.name + (('_' + args.filename) if args.filename else '')) for a in akds]
+        else:
+            files = [
+                open(filename + a.name + '.csv', mode='w')
+                for a in akds
+            ]
         to_record = [args.fields.split(',')] * len(akds)
         print(to_record)
-        aakd.record(akds, files, frequency, to_record)
+        aakd.record(akds, files, frequency, to_record, retrievesize=args.retrievesize,
+                    transforms=[record_transform(args) for a in akds], reconnect_timeout=reconnect_timeout(args))
+        for a in akds:
+            if a.governor is not None:
+                print("{} commands:\n{}".format(a.nice_name(), a.governor.summary()))
     finally:
         for f in files:
             f.close()
+        if store is not None:
+            store.close()
+
+
+def reconnect_timeout(args):
+    return args.reconnect_timeout if args.reconnect_timeout > 0 else None
+
+
+def open_record_file(filename, a):
+    return open(filename + a.name + '.csv', mode='w')
+
+
+def record_processes(args, filename, frequency):
+    """ `record` with the drives sharded across worker processes (see aakd.record_processes). """
+    import functools
+    from aakd.record_processes import ProcessRecorder
+    if args.segments:
+        raise Exception("--segments is not supported with --processes")
+    ips = [ip for (name, ip) in drives(args)]
+    if args.auto_rate:
+        akds = [create_AKD(ip, args) for ip in ips]
+        frequency = auto_rate(akds, args.fields.split(','), args)
+        for a in akds:
+            a.disconnect()  # the workers connect again
+        print("Recording at {}Hz".format(frequency))
+    recorder = ProcessRecorder(ips, functools.partial(create_AKD, args=args),
+                               functools.partial(open_record_file, filename), frequency, args.fields.split(','),
+                               args.processes, functools.partial(record_transform, args), args.retrievesize,
+                               reconnect_timeout(args))
+    recorder.run()
+
+
+def scan(args):
+    from aakd.fleet_config import yaml_load
+    from aakd.scan import scan, parse_ports, merge_drives, dump_drives
+    results = scan(args.cidr, parse_ports(args.ports), args.parallel, args.probe_timeout)
+    for r in results:
+        print("{:<22} {:<20} {:<24} {}".format(r.address, r.name, r.type or "", r.firmware or ""))
+    output = args.output or (args.drives_file[0] if args.drives_file else None)
+    drives = {}
+    if output and Path(output).exists():
+        with open(output) as f:
+            drives = yaml_load(f) or {}
+    (drives, messages) = merge_drives(drives, results, args.group)
+    for m in messages:
+        print(m)
+    if output is None:
+        print(dump_drives(drives), end='')
+    elif not args.dry_run:
+        tmp = Path(str(output) + ".tmp")
+        tmp.write_text(dump_drives(drives))
+        tmp.replace(output)
+        print("{} drives found, {} written".format(len(results), output))
+
+
+def segments_list(args):
+    from aakd.segments import SegmentStore
+    from datetime import datetime
+    for s in SegmentStore.load_index(args.folder):
+        if args.recording and s['name'] != args.recording:
+            continue
+        print("{:<24} {} {} {:>10} {}".format(
+            s['name'], datetime.fromtimestamp(s['start']).isoformat(timespec='seconds'),
+            datetime.fromtimestamp(s['end']).isoformat(timespec='seconds') if s['end'] else "(recording)",
+            s['bytes'], s['file']))
+
+
+def segments_cat(args):
+    from aakd.segments import SegmentStore
+    from datetime import datetime
+    store = SegmentStore(args.folder, read_only=True)
+    start = datetime.fromisoformat(args.start).timestamp() if args.start else None
+    end = datetime.fromisoformat(args.end).timestamp() if args.end else None
+    for l in store.read(args.recording, start, end):
+        print(l)
+
 
 def monitor_faults(args):
     def rec(a, name, ip, stop):
@@ -270,39 +412,41 @@ def monitor_faults(args):
 
 
 def home_here(args):
-    for (name, ip) in drives(args):
-        try:
-            a = create_AKD(ip, args)
-            a.disable()
-            current_pos = a.commandF("pl.fb")
-            (current_off, unit) = a.commandF("fb1.offset", unit=True)
-            new_off = -(current_pos - current_off)
-            a.cset("fb1.offset", new_off)
-            new_off = a.commandF("fb1.offset")
-            print(nice_name(name, ip), "Offset old: {1}[{0}]  new: {2}[{0}]".format(unit, current_off, new_off))
-            a.disconnect()
-        except Exception as e:
-            print(nice_name(name, ip), " Error: ", str(e), file=sys.stderr)
+    def home(a, name, ip, out):
+        a.disable()
+        current_pos = a.commandF("pl.fb")
+        (current_off, unit) = a.commandF("fb1.offset", unit=True)
+        new_off = -(current_pos - current_off)
+        a.cset("fb1.offset", new_off)
+        new_off = a.commandF("fb1.offset")
+        print(nice_name(name, ip), "Offset old: {1}[{0}]  new: {2}[{0}]".format(unit, current_off, new_off), file=out)
+        return {'unit': unit, 'old': current_off, 'new': new_off}
+    parallel_output(home, args)
     if not args.no_save:
         save_params(args)
 
 
 def run_script(args):
-    for (name, ip) in drives(args):
-        try:
-            a = create_AKD(ip, args)
-            with open(args.script_file) as s:
-                for c in s:
-                    if c[0] == ' ':  # we do not print the ouput
-                        a.commandS(c.rstrip('\r\n').lstrip(' '))
-                    else:
-                        print(a.commandS(c.rstrip('\r\n')), end=args.separator)
-        except Exception as e:
-            print(nice_name(name, ip), " Error: ", str(e), file=sys.stderr)
-    print()
+    with open(args.script_file) as s:
+        script = s.readlines()
+
+    def script_run(a, name, ip, out):
+        outputs = []
+        for c in script:
+            if c[0] == ' ':  # we do not print the ouput
+                a.commandS(c.rstrip('\r\n').lstrip(' '))
+            else:
+                r = a.commandS(c.rstrip('\r\n'))
+                outputs.append(r)
+                print(r, end=args.separator, file=out)
+        return outputs
+    parallel_output(script_run, args)
+    if not args.json:
+        print()
 
 
 def list_parameters(args):
+    import yaml
     drives_params = {'drives': {}}
     for (name, ip) in drives(args):
         drives_params['drives'][name] = list_params(name, args)
@@ -354,6 +498,8 @@ def apply_parameters(args):
 
 
 def compare_parameters(args):
+    import yaml
+
     def compare(name, ip):
         nonlocal args
         extra = {}
@@ -435,38 +581,116 @@ def compare_parameters(args):
         compare(name, ip)
 
 
+def trace_show(args):
+    for filename in args.trace_files:
+        (name, events) = aakd.load_trace(filename)
+        for l in aakd.format_trace(name, events):
+            print(l)
+
+
+def session_show(args):
+    for filename in args.session_files:
+        print("#", filename)
+        for l in aakd.format_session(aakd.load_session(filename)):
+            print(l)
+
+
+def drift_parameters(args):
+    from aakd import drift
+    dd = drives(args)
+    parsed = akd_index(args).get_many([akd_filename(name, ip, args) for (name, ip) in dd], args.threads or None)
+    drives_params = {}
+    for ((name, ip), a) in zip(dd, parsed):
+        if isinstance(a, Exception):
+            print(nice_name(name, ip), " Error: ", str(a), file=sys.stderr)
+        else:
+            drives_params[name] = a.upper_params()
+    expected = {name: list_params(name, args) for name in drives_params} if args.params_file else {}
+    report = drift.DriftReport(drives_params, expected, drift.DEFAULT_IGNORED + tuple(args.ignore))
+    if args.json:
+        import json
+        print(json.dumps(report.to_dict(), indent=1))
+    else:
+        report.print_table(details=args.details)
+
+
 def drive_troubleshoot(args):
-    for (name, ip) in drives(args):
-        try:
-            a = create_AKD(ip, args)
-            print(nice_name(name, ip))
-            dissources = a.disable_sources()
-            if dissources:
-                print("  Drive disable sources")
-                for d in dissources:
-                    print("    ", d)
-
-            faults = a.faults(warnings=True)
-            if faults:
-                print("  Faults")
-                for f in faults:
-                    print("    ", f)
-        except Exception as e:
-            print(nice_name(name, ip), " Error: ", str(e), file=sys.stderr)
+    def troubleshoot(a, name, ip, out):
+        print(nice_name(name, ip), file=out)
+        dissources = a.disable_sources()
+        if dissources:
+            print("  Drive disable sources", file=out)
+            for d in dissources:
+                print("    ", d, file=out)
+
+        faults = a.faults(warnings=True)
+        if faults:
+            print("  Faults", file=out)
+            for f in faults:
+                print("    ", f, file=out)
+        return {'dissources': dissources, 'faults': faults}
+    parallel_output(troubleshoot, args)
 
 
 def move(args):
     d = drives(args)
-    if len(d) > 1:
-        raise Exception("Multi-drive move not supported")
-    try:
-        (name, ip) = d[0]
-        a = create_AKD(ip, args)
+
+    def prepare(a, name, ip):
+        nonlocal args
         aakd.motiontask_setup(a, args.mtnum, args.position, args.velocity,
                               args.accel, args.decel, absolute=not args.relative)
-        aakd.motiontask_run(a, args.mtnum)
+        a.service_mode()
+        a.enable()
+
+    tasks = parallel_create_AKD(prepare, [], args)
+    pool = connection_pool(args)
+    if any(t.error is not None for t in tasks):
+        # Don't leave the prepared drives enabled
+        for t in tasks:
+            if t.error is None:
+                a = pool.get(t.name, t.ip)
+                try:
+                    a.disable()
+                finally:
+                    pool.release(a)
+        return
+    akds = {name: pool.get(name, ip) for (name, ip) in d}
+    ok = False
+    try:
+        report = aakd.motiontasks_run(akds, args.mtnum, timeout=args.move_timeout)
+        if len(akds) > 1:
+            print(report.summary())
+        ok = True
     except Exception as e:
-        print(nice_name(name, ip), " Error: ", str(e), file=sys.stderr)
+        print("Move Error: ", str(e), file=sys.stderr)
+        for a in akds.values():
+            try:
+                a.disable()
+            except Exception as e:
+                print(a.nice_name(), " Error: ", str(e), file=sys.stderr)
+    finally:
+        for a in akds.values():
+            pool.release(a, ok)
+
+
+def motion_check(args):
+    program = aakd.MotionProgram.load(args.program)
+    for t in program.tasks.values():
+        print("{:>4}: {}".format(t.num, "  ".join(t.commands()[1:])))
+
+
+def motion_upload(args):
+    program = aakd.MotionProgram.load(args.program)
+
+    def upload(a, name, ip, out):
+        written = program.upload(a, force=args.force)
+        if written and args.flash:
+            a.flash_params()
+        print(nice_name(name, ip), "{} tasks written, {} unchanged".format(
+            len(written), len(program.tasks) - len(written)), file=out)
+        return {'written': written}
+
+    parallel_output(upload, args)
 
 
 def enable(args):
@@ -489,39 +713,83 @@ def disable(args):
 
 def completion_names(prefix, parsed_args, **kwargs):
     if parsed_args.drives_file:
-        with open(parsed_args.drives_file) as f:
-            yy = yaml.load(f, Loader=yaml.Loader)
-            return set(yy.keys())
+        return set(aakd.FleetConfig.load(parsed_args.drives_file).drives.keys())
     return []
 
 
 def completion_groups(prefix, parsed_args, **kwargs):
     if parsed_args.drives_file:
-        with open(parsed_args.drives_file) as f:
-            yy = yaml.load(f, Loader=yaml.Loader)
-            return set(g for (n, p) in yy.items() for g in p.get("groups", []))
+        return set(aakd.FleetConfig.load(parsed_args.drives_file).groups)
     return []
 
 
+def complete_command(prefix):
+    """ Return the command names starting with prefix whatever its case, in the case of the prefix,
+    using the prebuilt sorted index. """
+    from aakd.akd_command_index import akd_command_names
+    lower = prefix.lower()
+    i = bisect_left(akd_command_names, lower)
+    j = bisect_left(akd_command_names, lower + '\U0010ffff', i)
+    if prefix.isupper():
+        return [name.upper() for name in akd_command_names[i:j]]
+    return [prefix + name[len(prefix):] for name in akd_command_names[i:j]]
+
+
 def completion_cmd(prefix, parsed_args, **kwargs):
-    if parsed_args.cmd and parsed_args.cmd[0] in aakd.akd_command_list:
-        (t, h) = aakd.akd_command_list[parsed_args.cmd[0]]
+    if parsed_args.cmd and parsed_args.cmd[0].lower() in aakd.akd_command_list:
+        (t, h) = aakd.akd_command_list[parsed_args.cmd[0].lower()]
         argcomplete.warn(h + ' (' + t + ')')
         return []
-    return (key for key in aakd.akd_command_list.keys() if key.startswith(prefix))
-
+    return complete_command(prefix)
+
+
+def completing_cmd(parser):
+    """ True when TAB completing the arguments of the `cmd` subcommand, `parser` having the global
+    options only: the subcommand is the first positional word, not an option value.
+    """
+    if "_ARGCOMPLETE" not in os.environ:
+        return False
+    line = os.environ.get("COMP_LINE", "")
+    line = line[:int(os.environ.get("COMP_POINT", len(line)))]
+    words = line.split()
+    if words and not line[-1].isspace():
+        words.pop()  # the word being completed
+    try:
+        with open(os.devnull, 'w') as null, redirect_stdout(null), redirect_stderr(null):
+            (_, positionals) = parser.parse_known_args(words[1:])
+    except SystemExit:  # invalid options, left to argcomplete
+        return False
+    return positionals[:1] == ['cmd']
 
 
 def main():
     # Parser definition
 
     parser = argparse.ArgumentParser(description="Run a command on an AKD drive or a list of them.")
-    parser.add_argument('--drives_file', '-d', type=str,
-                        help="A yaml file with drive descriptions with field 'ip'")
+    parser.add_argument('--drives_file', '-d', type=str, action='append', default=[],
+                        help="A yaml file with drive descriptions with field 'ip', can be given multiple times")
     parser.add_argument('--folder', type=str,
                         help="Where to save and restore from, default to the DRIVES_FILE folder if any or cwd")
-    parser.add_argument('--trace', action='store_true', help='Trace all commands and drive answers, heavy debug')
+    parser.add_argument('--trace', nargs='?', const='.', default=None, metavar='FOLDER',
+                        help="Dump the trace of the commands and drive answers to FOLDER (default cwd) "
+                        "on errors and on SIGUSR1, see `trace show`")
+    parser.add_argument('--capture', type=str, metavar='FOLDER',
+                        help="Capture the sessions with the drives in FOLDER (one .akdsession file per drive)")
+    parser.add_argument('--replay', type=str, metavar='FOLDER',
+                        help="Replay the sessions captured in FOLDER instead of connecting to the drives")
+    parser.add_argument('--replay_speed', type=float, default=1.0,
+                        help="Replay speed factor, 0 to answer as fast as possible")
+    parser.add_argument('--command_rate', type=float, default=None, metavar='RATE',
+                        help="Limit the commands sent to each drive to RATE per second, shared by priority"
+                             " (safety, setpoints, recorder, telemetry then others)")
+    parser.add_argument('--command_burst', type=float, default=None,
+                        help="Commands which can be sent at once above --command_rate (default a tenth of it)")
     parser.add_argument('--threads', '-j', type=int, default=0, help="Limit the number of parallel workers. Default is 0 and it means as many as drives. 1 will execute each drives sequentially")
+    parser.add_argument('--subnet_threads', type=int, default=0, help="Limit the number of parallel workers per /24 subnet, 0 for no limit")
+    parser.add_argument('--timeout', type=float, default=None, help="Deadline [s] of the operation on each drive, it is cancelled afterward")
+    parser.add_argument('--retries', type=int, default=2, help="Number of connection retries per drive")
+    parser.add_argument('--progress', action='store_true', help="Display the progress of multi drives operations")
+    parser.add_argument('--json', action='store_true', help="Output one JSON line per drive (cmd, info, home, script and troubleshoot)")
     parser.add_argument('--stop_on_error', action='store_true', help='If running on multiple drives, try to stop all when one fails')
     parser.add_argument('--params_file', '-p', type=str, action='append', default=[], help="Parameter yaml files")
 
@@ -533,7 +801,11 @@ def main():
     pg = drive_selection.add_argument('--groups', '-g', type=str, action='append', default=[],
                                       help="A list of groups the drive need to match, like \"-g arm akdn\"")
     pg.completer = completion_groups
+    drive_selection.add_argument('--select', '-s', type=str,
+                                 help="A drive selector expression, like \"arm and not (akdn or name:arm_2*)\", "
+                                 "keys: name, group, ip, subnet, type, firmware")
 
+    complete_cmd = completing_cmd(parser)
     subparsers = parser.add_subparsers()
 
     # `cmd` subcommand
@@ -544,6 +816,10 @@ def main():
     cmd_arg.completer = completion_cmd
     cmd_parser.set_defaults(func=akd_cmd)
 
+    if complete_cmd:
+        # the other subcommands are not needed to complete a drive command, don't build them
+        argcomplete.autocomplete(parser)
+
     # `info` subcommand
 
     info_parser = subparsers.add_parser('info', help="Generic informations about drive and motor")
@@ -553,7 +829,8 @@ def main():
 
     restore_parser = subparsers.add_parser(
         'restore',
-        description="Restore a drive parameters from a file (20sec per drive).")
+        description="Restore a drive parameters from a file, the writes are pipelined and verified"
+        " with a read back of all the parameters before flashing.")
     restore_parser.add_argument('--akd_file', '-a', type=str,
                                 help="Filename of the drive parameters,"
                                 " default to drive internal name.")
@@ -561,6 +838,10 @@ def main():
                                 help="Factory reset before writing the parameters")
     restore_parser.add_argument('--force', action="store_true",
                                 help="Force restoring even when drv.nvcheck matches")
+    restore_parser.add_argument('--no_verify', action="store_true",
+                                help="Don't read back the parameters before flashing")
+    restore_parser.add_argument('--window', type=int, default=16,
+                                help="Maximum number of writes waiting for an answer (default 16)")
     restore_parser.set_defaults(func=restore_params)
 
     # `save` subcommand
@@ -581,6 +862,32 @@ def main():
     record_parser.add_argument('--fields', help='Fields to record', default="il.fb,pl.cmd,pl.err,vl.cmd,vl.fb,il.mi2t")
     record_parser.add_argument('--frequency', type=int, help='Frequency [Hz]', default=1000)
     record_parser.add_argument('--filename', help='Filename postfix (annotation)', default="")
+    record_parser.add_argument('--retrievesize', type=int, default=4800, help='rec.retrievesize [samples]')
+    record_parser.add_argument('--reconnect_timeout', type=float, default=60,
+                               help='Time [s] to reconnect a lost drive and resume its recording, 0 to stop instead')
+    record_parser.add_argument('--auto_rate', '--auto-rate', action='store_true',
+                               help='Record at the fastest rate without sample loss, from the drive calibration'
+                               ' (made and stored in the user cache when missing)')
+    record_parser.add_argument('--recalibrate', action='store_true', help='With --auto_rate, calibrate again')
+    record_parser.add_argument('--derived', action='append', default=[], metavar="NAME=EXPRESSION",
+                               help='Add a channel computed from the recorded ones, named like il_fb, eg'
+                               ' power=il_fb*vl_fb (see aakd.transforms)')
+    record_parser.add_argument('--decimate', type=int, default=1, metavar="N",
+                               help='Write the statistics of blocks of N samples instead of all the samples')
+    record_parser.add_argument('--stats', default="mean,min,max", help='Statistics of the decimated channels')
+    record_parser.add_argument('--processes', type=int, default=0, metavar="N",
+                               help='Record in N worker processes (drives sharded across them), for high rates'
+                               ' with many drives')
+    record_parser.add_argument('--segments', metavar="FOLDER",
+                               help='Long term recording: write rotating compressed segments in FOLDER'
+                               ' (see aakd.segments and the segments command)')
+    record_parser.add_argument('--rotate_seconds', type=float, default=3600, help='Segment duration [s]')
+    record_parser.add_argument('--rotate_mb', type=float, help='Maximum segment size [MB] (before compression)')
+    record_parser.add_argument('--compression', default="gzip", help='Segments compression: gzip, xz, zstd or none')
+    record_parser.add_argument('--budget_mb', type=float,
+                               help='Disk budget of the segments folder [MB], the oldest segments are deleted')
+    record_parser.add_argument('--channel_stats', action='append', default=[], metavar="CHANNEL=STATS",
+                               help='Statistics of a decimated channel, eg il.fb=max,min')
     record_parser.set_defaults(func=record)
 
     # `monitor_faults` subcommand
@@ -615,6 +922,52 @@ def main():
     script_parser.set_defaults(func=drive_troubleshoot)
 
 
+    # `trace` subparser
+
+    trace_parser = subparsers.add_parser('trace', help="Trace dumps tools")
+    sub_trace_parsers = trace_parser.add_subparsers()
+    trace_show_parser = sub_trace_parsers.add_parser('show', help="Decode and print trace dumps")
+    trace_show_parser.add_argument('trace_files', nargs='+', help="Trace dump files (.akdtrace)")
+    trace_show_parser.set_defaults(func=trace_show)
+
+    # `scan` subcommand
+
+    scan_parser = subparsers.add_parser('scan', help="Find the drives of networks and write or update a drives file")
+    scan_parser.add_argument('cidr', nargs='+', help="Networks to scan, like 192.168.1.0/24 (or addresses)")
+    scan_parser.add_argument('--ports', default="23", help="Telnet ports to probe, like 23 or 23000-23009")
+    scan_parser.add_argument('--parallel', type=int, default=64, help="Number of addresses probed at the same time")
+    scan_parser.add_argument('--probe_timeout', type=float, default=0.5,
+                             help="Connection timeout [s] of each address")
+    scan_parser.add_argument('--group', action='append', default=[], help="Group to add to the drives found")
+    scan_parser.add_argument('--output', '-o', type=str,
+                             help="Drives file to write or update (default the first --drives_file, "
+                             "printed if none). Comments are not kept")
+    scan_parser.add_argument('--dry_run', action='store_true', help="Only show the changes to the drives file")
+    scan_parser.set_defaults(func=scan)
+
+    # `segments` subparser
+
+    segments_parser = subparsers.add_parser('segments', help="Long term recordings tools, see record --segments")
+    sub_segments_parsers = segments_parser.add_subparsers()
+    segments_list_parser = sub_segments_parsers.add_parser('list', help="List the segments")
+    segments_list_parser.add_argument('folder', help="Segments folder")
+    segments_list_parser.add_argument('recording', nargs='?', help="Recording name (drive name)")
+    segments_list_parser.set_defaults(func=segments_list)
+    segments_cat_parser = sub_segments_parsers.add_parser('cat', help="Print a recording (csv) for a time range")
+    segments_cat_parser.add_argument('folder', help="Segments folder")
+    segments_cat_parser.add_argument('recording', help="Recording name (drive name)")
+    segments_cat_parser.add_argument('--start', help="Start time (ISO format, eg 2024-01-31T12:00)")
+    segments_cat_parser.add_argument('--end', help="End time (ISO format)")
+    segments_cat_parser.set_defaults(func=segments_cat)
+
+    # `session` subparser
+
+    session_parser = subparsers.add_parser('session', help="Captured sessions tools, see --capture and --replay")
+    sub_session_parsers = session_parser.add_subparsers()
+    session_show_parser = sub_session_parsers.add_parser('show', help="Print captured sessions")
+    session_show_parser.add_argument('session_files', nargs='+', help="Session files (.akdsession)")
+    session_show_parser.set_defaults(func=session_show)
+
     # `params` subparser
 
     params_parser = subparsers.add_parser('params', help="Parameter file management for selected drives")
@@ -642,6 +995,13 @@ def main():
     params_compare.set_defaults(merge=False)
     params_compare.set_defaults(func=compare_parameters)
 
+    params_drift = sub_params_parsers.add_parser(
+        'drift', help="Fleet-wide drift report of the drive files, against the parameter files and each other")
+    params_drift.add_argument('--ignore', type=str, action='append', default=[],
+                              help="Parameter to ignore (in addition to per drive ones like DRV.NAME or FB1.OFFSET)")
+    params_drift.add_argument('--details', action='store_true', help="List the differences with the parameter files")
+    params_drift.set_defaults(func=drift_parameters)
+
     params_merge = sub_params_parsers.add_parser('merge', help="Merge parameter file in the drive file")
     params_merge.add_argument('--akd_file', '-a', type=str,
                               help="Filename of the drive parameters, default to drive internal name.")
@@ -653,9 +1013,10 @@ def main():
 
     # `move` subparser
 
-    move_parser = subparsers.add_parser('move', description="Move commands running in service mode")
+    move_parser = subparsers.add_parser('move', description="Move commands running in service mode, all the selected drives start the same move together")
 
     move_parser.add_argument("--relative", '--jog', '-r', action='store_true', help="Do a relative move instead of absolute")
+    move_parser.add_argument("--move_timeout", type=float, help="Stop all the drives if the move takes longer [s]")
     move_parser.add_argument("--mtnum", default=100, type=int, help="[Advanced] Motion task number to use to execute the command")
     move_parser.add_argument("position", type=float, help="Absolute position of position increment of the move")
     move_parser.add_argument("velocity", type=float, help="Velocity of the move")
@@ -663,6 +1024,20 @@ def main():
     move_parser.add_argument("decel", type=float, help="Deceleration of the move")
     move_parser.set_defaults(func=move)
     
+    # `motion` subparser
+
+    motion_parser = subparsers.add_parser('motion', help="Motion programs (tables of motion tasks, see aakd.motion_program)")
+    sub_motion_parsers = motion_parser.add_subparsers()
+    motion_check_parser = sub_motion_parsers.add_parser('check', help="Validate a motion program and print its tasks")
+    motion_check_parser.add_argument('program', help="Motion program file (yaml)")
+    motion_check_parser.set_defaults(func=motion_check)
+    motion_upload_parser = sub_motion_parsers.add_parser(
+        'upload', help="Upload a motion program to the drives, only the tasks which differ are written")
+    motion_upload_parser.add_argument('program', help="Motion program file (yaml)")
+    motion_upload_parser.add_argument('--force', action="store_true", help="Write all the tasks")
+    motion_upload_parser.add_argument('--flash', action="store_true", help="Save to flash after writing tasks")
+    motion_upload_parser.set_defaults(func=motion_upload)
+
     # `enable` subparser
 
     enable_parser = subparsers.add_parser('enable', description="Enable the drive, clearing faults if needed, see also disable")
@@ -677,8 +1052,15 @@ def main():
     argcomplete.autocomplete(parser)
     args = parser.parse_args()
 
+    if args.trace:
+        aakd.install_dump_signal(args.trace)
+
     if 'func' in args.__dict__:
-        return args.func(args)
+        try:
+            return args.func(args)
+        except Exception as e:
+            aakd.dump_failure_trace(e)
+            raise
     else:
         return parser.print_usage()
 
@@ -1,4 +1,6 @@
 
+import collections
+import contextlib
 import re
 import telnetlib
 import time
@@ -6,9 +8,16 @@ import math
 import atexit
 import struct
 import socket
+import threading
 
 
 from .akd_flags import MTCntl, MotionStat
+from .akd_command_list import akd_command_list
+from .restore import restore_params, same_value
+from .trace import TraceBuffer, TRACE_SEND, TRACE_RECV, TRACE_ERROR
+from .session import CaptureTransport
+from .clock import system_clock
+from .governor import command_priority, TELEMETRY, ADHOC
 
 
 def nice_name(name, ip):
@@ -22,6 +31,123 @@ def akd_parse_internal(s):
     return int(s, 16)
 
 
+def akd_parse_int(r, unit=False):
+    """ Parse an int answer (and its unit if `unit` and there is one). """
+    g = re.match(b"\s*([^ ]+)( \[(.*)\])?", r)
+    if g:
+        if unit and g.group(2):
+            return (int(g.group(1)), g.group(3).decode('latin-1'))
+        else:
+            return int(g.group(1))
+    else:
+        raise Exception("Expecting an int, got {}".format(r))
+
+
+# reads with a side effect, the retrieval moves on
+RETRY_UNSAFE_READS = {"rec.retrievedata"}
+
+
+def retry_safe(cmd):
+    """ Whether `cmd` can be sent again after a transport error (it may have been executed already):
+    reads and sets (the same value again) of the parameters of `akd_command_list`.
+    Never the actions ("Command" and "W/O" classes) nor unknown commands.
+    """
+    parts = cmd.split(None, 1)
+    if not parts:
+        return False
+    name = parts[0].lower()
+    kind = akd_command_list.get(name, ("",))[0]
+    if len(parts) == 1:
+        return kind in ("R/O", "R/W", "NV", "N/V") and name not in RETRY_UNSAFE_READS
+    return kind in ("R/W", "NV", "N/V")
+
+
+DRV_DISSOURCES = [
+    "Software disable",
+    "Fault exists",
+    "Hardware disable",
+    "In-rush disable (no high power)",
+    "Initialization disable (the drive did not finish the initialization)",
+    "Controlled stop disable from a digital input",
+    "Field Bus requested disable (SynqNet and EtherNet / IP only)",
+    "AKD-C requested disable (AKD-N only)",
+    "AKD pre-charge disable (AKD-C only)",
+    "Unknown",
+    "AKD-C in download mode"
+]
+
+
+def dissources_descriptions(drvdisss):
+    """ Return the list of disable sources descriptions of a drv.dissources value. """
+    dissources = []
+    for source in DRV_DISSOURCES:
+        if drvdisss & 1:
+            dissources.append(source)
+        drvdisss = drvdisss >> 1
+    return dissources
+
+
+REC_MAX_NUMPOINTS = 10000  # recorder buffer size
+REC_OVERLAP = 8  # samples retrieved again to check a retrieval from an index, see `AKD.rec_get_from`
+
+# Result of `AKD.status`, dissources is the drv.dissources bitmask and fault drv.fault1 (0 if no fault)
+DriveStatus = collections.namedtuple("DriveStatus", ["active", "dissources", "fault"])
+
+
+class PollPolicy:
+    """ When to poll the drive while waiting for something (see `AKD.wait_for`).
+    Delays start at `initial` and are multiplied by `factor` up to `maximum` [s],
+    so quick transitions are seen quickly and slow ones don't flood the drive with commands.
+    """
+
+    def __init__(self, initial=0.005, factor=2, maximum=0.1):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def delays(self):
+        delay = self.initial
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.maximum)
+
+
+class ConnectionLost(Exception):
+    """ The drive link is dead: no answer in time, closed, or can't be (re)connected (see `AKD.reconnect`). """
+    pass
+
+
+class DriveError(Exception):
+    """ The drive answered a command with an error (`akd` is the drive, see `dump_failure_trace`). """
+
+    def __init__(self, message, akd):
+        super().__init__(message)
+        self.akd = akd
+
+
+def dump_failure_trace(e):
+    """ Dump the trace of the drive the exception `e` comes from, when it ends an operation
+    (errors which are expected by the callers are not dumped). Return the file name or None.
+    """
+    a = getattr(e, 'akd', None)
+    if a is None or getattr(e, 'trace_dumped', False):
+        return None
+    e.trace_dumped = True
+    return a.trace_dump("error")
+
+
+def set_keepalive(sock, idle=2, interval=1, count=3):
+    """ Enable TCP keepalive so that a dead link is noticed after about `idle` + `interval` * `count` [s]
+    even while waiting (options set where the platform has them).
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    options = [("TCP_KEEPIDLE", idle), ("TCP_KEEPINTVL", interval), ("TCP_KEEPCNT", count),
+               ("TCP_USER_TIMEOUT", (idle + interval * count) * 1000)]  # unacknowledged writes [ms]
+    for (option, value) in options:
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
 def set_max_window_size(tsocket, command, option):
     """
     Set Window size to resolve line width issue
@@ -57,29 +183,64 @@ class AKD:
     Can be used simply as an object
     (in which case it will release the telnet port only when program exits)
     or can be used in a contextmanager (`with`)
+
+    All the commands and answers are kept in a ring buffer (`tracebuf`),
+    `trace` can be given a folder (or True for the current one) where it is dumped on errors
+    (when the link is lost, and for drive errors ending an operation, see `dump_failure_trace`).
+
+    `transport` replaces the telnet connection (see `ReplayTransport`),
+    `capture` is a filename where to save the whole session (see `CaptureTransport`).
+
+    `clock` is used for all the waits and timestamps (see `VirtualClock` for emulations).
+
+    `cancel` (see `CancelToken`) is checked before sending each command, to stop an operation.
+
+    `governor` (see `CommandGovernor`) limits the rate of the commands sent to the drive, by priority
+    class (see `priority`), and serializes the round trips of the threads using the `AKD`.
+    Without a governor, an `AKD` must be used by one thread at a time (eg a recording worker and
+    the callbacks it calls), commands of other threads would get the answers of its commands.
+
+    A dead link raises `ConnectionLost`, see `reconnect` (and `rec_resume` for the recordings).
     """
 
-    def __init__(self, ip, port=23, trace=False):
+    def __init__(self, ip, port=23, trace=False, transport=None, capture=None, clock=None, cancel=None,
+                 governor=None):
         self.ip = ip
+        self.name = ip  # until drv.name is read
+        self.reconnections = 0
+        self.cancel = cancel
+        self.governor = governor
+        self.priority_context = threading.local()
+        self.clock = clock if clock is not None else system_clock
         self.port = port
         self.trace = trace
+        self.transport = transport
+        self.capture = capture
+        self.tracebuf = TraceBuffer(ip)
         self.connect()
         self.name = self.commandS("drv.name")
+        self.tracebuf.name = self.name
         atexit.register(AKD.disconnect, self)
 
     def nice_name(self):
         return nice_name(self.name, self.ip)
 
     def connect(self):
-        try:
-            t = telnetlib.Telnet(self.ip, port=self.port, timeout=1)
-        except socket.timeout:
-            t = None
-        if not t:
-            raise Exception("Could not connect to " + self.ip +
-                            ", verify that nothing is already connected to it.")
+        if self.transport is not None:
+            t = self.transport
+        else:
+            try:
+                t = telnetlib.Telnet(self.ip, port=self.port, timeout=1)
+            except OSError:  # including socket.timeout
+                t = None
+            if not t:
+                raise ConnectionLost("Could not connect to " + self.ip +
+                                     ", verify that nothing is already connected to it.")
+            t.set_option_negotiation_callback(set_max_window_size)
+            set_keepalive(t.get_socket())
+        if self.capture:
+            t = CaptureTransport(t, self.capture)
         self.t = t
-        self.t.set_option_negotiation_callback(set_max_window_size)
         self.t.read_very_eager()  # safety for random garbage
 
     def disconnect(self):
@@ -87,6 +248,37 @@ class AKD:
             if self.t:
                 self.t.close()
 
+    def discard_connection(self):
+        """ Close the connection after a `ConnectionLost`: answers may still be pending, which would be
+        taken for the answers of the next commands. Commands then fail until `reconnect`.
+        """
+        self.disconnect()
+        self.t = None
+        if self.governor is not None:
+            self.governor.abandon()
+
+    def reconnect(self, timeout=60, backoff=None):
+        """ Connect again after a `ConnectionLost`, retrying with the increasing delays of `backoff`
+        (a `PollPolicy`) for up to `timeout` [s]. Check that the same drive answers.
+        """
+        backoff = backoff or PollPolicy(0.2, 2, 5)
+        deadline = self.clock.monotonic() + timeout
+        for delay in backoff.delays():
+            if self.cancel is not None:
+                self.cancel.check()
+            self.disconnect()
+            try:
+                self.connect()
+                name = self.command("drv.name", retries=0).decode('latin-1')
+                break
+            except ConnectionLost as e:
+                if self.clock.monotonic() + delay > deadline:
+                    raise ConnectionLost("AKD {} could not reconnect in {}s: {}".format(self.name, timeout, e))
+                self.clock.sleep(delay)
+        if name != self.name:
+            raise Exception("AKD {} reconnected to a different drive: {}".format(self.nice_name(), name))
+        self.reconnections += 1
+
     def __enter__(self):
         return self
 
@@ -97,53 +289,205 @@ class AKD:
         self.disconnect()
         return False
 
+    @contextlib.contextmanager
+    def priority(self, priority):
+        """ Send the commands of this thread in the `with` block with the `governor` priority class `priority`
+        (or the one of the command when higher, eg for safety commands).
+        """
+        previous = getattr(self.priority_context, 'value', ADHOC)
+        self.priority_context.value = priority
+        try:
+            yield
+        finally:
+            self.priority_context.value = previous
+
+    def priority_of(self, cmd):
+        return min(command_priority(cmd), getattr(self.priority_context, 'value', ADHOC))
+
     def remove_comment(self, cmd):
         m = re.match("(.*?)\s*#.*", cmd)
         if m:
             cmd = m.group(1)
         return cmd
 
-    def command(self, cmd, timeout=5):
-        cmd = self.remove_comment(cmd)
-        if not cmd:
-            return b""
-        sending = cmd.encode('ascii') + b'\r\n'
-        if self.trace:
-            print(time.time(), repr(sending), flush=True)
-        self.t.write(sending)
+    def trace_dump(self, reason):
+        """ Dump the trace buffer if tracing was requested, return the file name or None. """
+        if not self.trace:
+            return None
+        folder = self.trace if isinstance(self.trace, str) else "."
+        return self.tracebuf.dump_to_folder(folder, reason)
 
+    def send(self, cmd):
+        """ Write a command without waiting for the answer, see `read_answer`.
+        Return the send timestamp.
+        """
+        sending = cmd.encode('ascii') + b'\r\n'
+        if self.cancel is not None:
+            self.cancel.check()
+        if self.governor is not None:
+            self.governor.acquire(self.priority_of(cmd))
+        if self.t is None:
+            if self.governor is not None:
+                self.governor.release()
+            raise ConnectionLost("AKD {} (cmd: {}) not connected, see reconnect".format(self.name, repr(cmd)))
+        start = self.tracebuf.record(TRACE_SEND, sending)
+        try:
+            self.t.write(sending)
+        except OSError as e:
+            self.discard_connection()
+            raise ConnectionLost("AKD {} (cmd: {}) connection lost: {}".format(self.name, repr(cmd), e))
+        except:
+            if self.governor is not None:
+                self.governor.release()  # not sent, no answer to wait for
+            raise
+        return start
+
+    def answer_deadline(self, timeout, deadline=None):
+        """ `clock.monotonic()` time until which to wait for an answer: in `timeout` [s],
+        at the latest at `deadline` and at the deadline of the `cancel` token.
+        """
+        end = self.clock.monotonic() + timeout
+        if deadline is not None:
+            end = min(end, deadline)
+        remaining = self.cancel.remaining() if self.cancel is not None else None
+        if remaining is not None:
+            end = min(end, self.clock.monotonic() + max(remaining, 0))
+        return end
+
+    def read_answer(self, cmd, start, timeout=5, deadline=None):
+        """ Read the answer of the command `cmd` sent at `start`.
+        Without complete answer in `timeout` [s] (or by the `deadline`, see `answer_deadline`), even if
+        it is being received, the link is considered lost (a late answer would be taken for the one of
+        the next command).
+        """
+        try:
+            return self._read_answer(cmd, start, timeout, deadline)
+        finally:
+            if self.governor is not None:
+                self.governor.release()
+
+    def _read_answer(self, cmd, start, timeout, deadline):
+        if self.t is None:
+            raise ConnectionLost("AKD {} (cmd: {}) not connected, see reconnect".format(self.name, repr(cmd)))
+        end = self.answer_deadline(timeout, deadline)
         answer = b""
         while True:
-            answer += self.t.read_until(b"-->", timeout)
-            if not answer:
-                if self.trace:
-                    print(time.time(), repr(answer), flush=True)
-                raise Exception("AKD {} (cmd: {}) doesn't respond".format(self.name, repr(cmd)))
+            remaining = end - self.clock.monotonic()
+            if remaining <= 0:
+                self._check_deadline()
+            if answer and remaining <= 0:
+                self.tracebuf.record(TRACE_ERROR, answer, time.monotonic_ns() - start)
+                self.trace_dump("noanswer")
+                self.discard_connection()
+                raise ConnectionLost("AKD {} (cmd: {}) incomplete answer by the deadline".format(
+                    self.name, repr(cmd)))
+            if answer and self.cancel is not None and self.cancel.is_set():
+                self.discard_connection()  # in the middle of an answer
+                self.cancel.check()
+            try:
+                chunk = self.t.read_until(b"-->", max(remaining, 0))
+            except (EOFError, OSError) as e:
+                self.tracebuf.record(TRACE_ERROR, answer, time.monotonic_ns() - start)
+                self.discard_connection()
+                raise ConnectionLost("AKD {} (cmd: {}) connection lost: {}".format(self.name, repr(cmd), e))
+            if not chunk and not answer:
+                self._check_deadline()
+                self.tracebuf.record(TRACE_ERROR, answer, time.monotonic_ns() - start)
+                self.trace_dump("noanswer")
+                self.discard_connection()
+                raise ConnectionLost("AKD {} (cmd: {}) doesn't respond".format(self.name, repr(cmd)))
+            answer += chunk
+            if not answer.endswith(b"-->"):
+                continue
             g = re.match(b"Error:(.*)", answer, re.MULTILINE | re.DOTALL)
             if g:
-                if self.trace:
-                    print(time.time(), repr(answer), flush=True)
-                raise Exception("AKD {} (cmd: {}) Error: {}".format(self.name, repr(cmd), g.group(1)))
+                self.tracebuf.record(TRACE_ERROR, answer, time.monotonic_ns() - start)
+                raise DriveError("AKD {} (cmd: {}) Error: {}".format(self.name, repr(cmd), g.group(1)), self)
             r = re.match(b"(.*)\r\n-->", answer, re.MULTILINE | re.DOTALL)
             if not r:
                 continue
-            if self.trace:
-                print(time.time(), repr(answer), flush=True)
+            self.tracebuf.record(TRACE_RECV, answer, time.monotonic_ns() - start)
+            if self.governor is not None:
+                self.governor.answered(self.priority_of(cmd), (time.monotonic_ns() - start) / 1e9)
             return r.group(1)
 
+    def _check_deadline(self):
+        """ A wait for an answer ended by the deadline of the `cancel` token cancels the operation
+        (`Cancelled`), the link is not lost.
+        """
+        if self.cancel is not None and self.cancel.expired():
+            self.discard_connection()  # the answer may still come
+            self.cancel.check()
+
+    def command(self, cmd, timeout=5, deadline=None, retries=1):
+        """ Send `cmd` and return its answer, waiting up to `timeout` [s] and until `deadline` at the latest
+        (a `clock.monotonic()` time, see `answer_deadline`).
+        After a transport error (`ConnectionLost`), commands which are safe to send again (see `retry_safe`)
+        are retried up to `retries` times, reconnecting first.
+        """
+        cmd = self.remove_comment(cmd)
+        if not cmd:
+            return b""
+        attempts = retries + 1 if retry_safe(cmd) else 1
+        for attempt in range(attempts):
+            try:
+                start = self.send(cmd)
+                return self.read_answer(cmd, start, timeout, deadline)
+            except ConnectionLost:
+                if self.cancel is not None:
+                    self.cancel.check()  # no reconnection in a cancelled operation
+                left = self.answer_deadline(timeout, deadline) - self.clock.monotonic()
+                if attempt + 1 >= attempts or left <= 0:
+                    raise
+            self.reconnect(left)
+
+    def command_batch(self, cmds, timeout=5, return_exceptions=False, window=None, deadline=None):
+        """ Send all the commands at once and then read all the answers.
+        This saves a round trip per command compared to calling `command` for each
+        (without its retries, a `ConnectionLost` is raised).
+        `window` limits the number of commands sent and not yet answered (flow control
+        for long lists, the drive input buffer is small), None for no limit.
+        If `return_exceptions`, failed commands have their exception in the list of answers,
+        otherwise the first failure is raised (after all answers are read).
+        A batch aborted while sending (`Cancelled`, `ConnectionLost`) with answers left unread discards
+        the connection (see `discard_connection`).
+        """
+        cmds = [self.remove_comment(c) for c in cmds]
+        pending = collections.deque()
+        answers = [b""] * len(cmds)
+        try:
+            for (i, c) in enumerate(cmds):
+                if not c:
+                    continue
+                if window is not None and len(pending) >= window:
+                    self._read_batch_answer(cmds, pending, answers, timeout, deadline)
+                pending.append((i, self.send(c)))
+        except:
+            if pending:  # aborted (e.g. cancelled) with answers left, they would be taken for the next ones
+                self.discard_connection()
+            raise
+        while pending:
+            self._read_batch_answer(cmds, pending, answers, timeout, deadline)
+        if not return_exceptions:
+            for a in answers:
+                if isinstance(a, Exception):
+                    raise a
+        return answers
+
+    def _read_batch_answer(self, cmds, pending, answers, timeout, deadline=None):
+        (i, start) = pending.popleft()
+        try:
+            answers[i] = self.read_answer(cmds[i], start, timeout, deadline)
+        except ConnectionLost:
+            raise  # the connection is discarded, with the answers still pending
+        except Exception as e:
+            answers[i] = e
+
     def commandI(self, cmd, unit=False):
         """ Execute command and return the result as am int.
             If unit is given also return the unit.
         """
-        r = self.command(cmd)
-        g = re.match(b"\s*([^ ]+)( \[(.*)\])?", r)
-        if g:
-            if unit and g.group(2):
-                return (int(g.group(1)), g.group(3).decode('latin-1'))
-            else:
-                return int(g.group(1))
-        else:
-            raise Exception("Expecting an int, got {}".format(r))
+        return akd_parse_int(self.command(cmd), unit)
 
     def commandF(self, cmd, unit=False):
         """ Execute command and return the result as a float.
@@ -224,28 +568,13 @@ class AKD:
             print(self.drv_infos(), file=f)
 
 
-    def load_params(self, filename, flash_afterward=True, factory_reset=False, trust_drv_nvcheck=True):
-        with open(filename) as f:
-            needs_update = True
-
-            if trust_drv_nvcheck:
-                for line in f:
-                    g = re.match("^# DRV.NVCHECK ([^ ]+)\n$", line)
-                    if g:
-                        if g.group(1) == self.commandS("DRV.NVCHECK"):
-                            needs_update = False
-                            print("{}\tMatching nvcheck found, no need to restore".format(self.nice_name()))
-
-            if needs_update:
-                print("{}\tRestoring parameters from {}".format(self.nice_name(), filename))
-                if factory_reset:
-                    self.factory_params()
-                f.seek(0)
-                for l in f:
-                    if l[0] != '#':
-                        self.command(l.rstrip('\r\n'))
-                if flash_afterward:
-                    self.flash_params()
+    def load_params(self, filename, flash_afterward=True, factory_reset=False, trust_drv_nvcheck=True,
+                    verify=True, window=16):
+        """ Restore the parameters of an .akd file (`filename` can also be an already parsed `AkdFile`).
+        See `restore.restore_params`, return its `RestoreReport`.
+        """
+        return restore_params(self, filename, flash_afterward=flash_afterward, factory_reset=factory_reset,
+                              trust_drv_nvcheck=trust_drv_nvcheck, verify=verify, window=window)
 
 
     def diff_params(self):
@@ -262,21 +591,23 @@ class AKD:
     def factory_params(self):
         return self.command("drv.rstvar", 20)  # long to do that
 
-    def flash_params(self):
+    def flash_params(self, delay=1):
         r = self.command("drv.nvsave", 10)
-        time.sleep(1)  # After saving, the falsh is written a bit after (background job)
+        # After saving, the flash is written a bit after (background job), the drive gives no signal of its end
+        self.clock.sleep(delay)
         return r
 
     def rec_columns(self):
         """ Returns the list of the fields setup to be recorded. """
         return self.commandS("rec.retrievehdr").splitlines()[2].split(',')
 
-    def rec_setup(self, frequency, to_record, numpoints=10000):
+    def rec_setup(self, frequency, to_record, numpoints=10000, retrievesize=4800):
         """ Frequency [hz] parameter
         Note that recording one channel, we can go up to gap 5 (less than 4khz)
         three channels we go to gap 6 (3khz) etc.
         With normal format, instead of the internal,
         that is even worse, degrade by 2x almost
+        (see `rate_calibration` to find the rate for a drive and channels)
         """
         if (len(to_record) > 6):
             raise Exception("Cannot record more than 6 channels")
@@ -286,11 +617,11 @@ class AKD:
 
         self.command("rec.off")
         self.cset("rec.gap", gap)
-        self.cset("rec.numpoints", min(int(numpoints), 10000))  # max buffer size for recording
+        self.cset("rec.numpoints", min(int(numpoints), REC_MAX_NUMPOINTS))
         self.cset("rec.stoptype", 1)  # 0 for one shot, 1 for continuous
         self.cset("rec.trigtype", 0)
         self.cset("rec.retrievefrmt", 1)  # 0 for readable, 1 for internal
-        self.cset("rec.retrievesize", 4800)
+        self.cset("rec.retrievesize", retrievesize)
 
         j = 1
         for c in to_record:
@@ -300,6 +631,11 @@ class AKD:
             self.cset("rec.ch" + str(j), "clear")
             j += 1
         self.frequency = frequency
+        # to check the recorder after a reconnection (see `rec_resume`)
+        self.rec_settings = {"rec.gap": str(gap), "rec.numpoints": str(min(int(numpoints), REC_MAX_NUMPOINTS)),
+                             "rec.stoptype": "1", "rec.retrievefrmt": "1", "rec.retrievesize": str(retrievesize),
+                             **{"rec.ch" + str(i + 1): c for (i, c) in enumerate(to_record)}}
+        self.rec_channels = list(to_record)
         return frequency
 
     def rec_setup_bitmask_trigger(self, trig_parameter, trig_bitmask, trig_value, trig_percent=90):
@@ -312,23 +648,83 @@ class AKD:
 
     def rec_start(self):
         self.command("rec.trig")
+        self.rec_started = self.clock.monotonic()
         self.rec_time = 0
         self.rec_time_incr = 1 / self.frequency
+        self.rec_index = 0  # recorder index of the next sample to retrieve
+        self.rec_tail = collections.deque(maxlen=REC_OVERLAP)  # the last samples retrieved (raw lines)
+        self.rec_gaps = []  # (time [s], number of lost samples) see `rec_resume`
 
-    def rec_get(self, data, index=None):
+    def rec_get(self, data, index=None, timeout=5):
         if index is None:
-            lines = self.command("rec.retrievedata").splitlines()
+            lines = self.command("rec.retrievedata", timeout).splitlines()
         else:
-            lines = self.cset("rec.retrievedata", index).splitlines()
-        gotdata = False
-        for l in lines[1:]:
+            lines = self.command("rec.retrievedata {}".format(index), timeout).splitlines()
+            self.rec_index = index
+        return self._rec_append(data, lines[1:])
+
+    def rec_get_from(self, data, index, oldest=None, timeout=5):
+        """ `rec_get` from the recorder `index`, checked with the data of the drive: the samples retrieved
+        last (`rec_tail`, the ones just before `index`) are requested again and must be identical, showing
+        that the ring buffer still holds them at the indexes assumed. `oldest` is a host estimated index
+        before which the samples are overwritten for sure (a lower bound), also checked.
+        Return None when a check fails (nothing is added to `data`), otherwise whether samples were added.
+        """
+        tail = list(self.rec_tail)
+        start = index - len(tail)
+        if oldest is not None and start < oldest:
+            return None
+        lines = self.command("rec.retrievedata {}".format(start), timeout).splitlines()[1:]
+        if lines[:len(tail)] != tail:
+            return None
+        self.rec_index = start + len(tail)
+        return self._rec_append(data, lines[len(tail):])
+
+    def _rec_append(self, data, lines):
+        self.rec_index += len(lines)
+        self.rec_tail.extend(lines)
+        for l in lines:
             data.append([
                 self.rec_time,
                 *(akd_parse_internal(v) for v in l.split(b','))
             ])
             self.rec_time = self.rec_time + self.rec_time_incr
-            gotdata = True
-        return gotdata
+        return bool(lines)
+
+    def rec_verify(self):
+        """ Whether the recorder is still recording with the configuration of `rec_setup`
+        (it is not after a drive reboot).
+        """
+        names = list(self.rec_settings)
+        answers = self.command_batch(names + ["rec.active"], return_exceptions=True)
+        if isinstance(answers[-1], Exception) or not answers[-1].strip().startswith(b"1"):
+            return False
+        return all(not isinstance(r, Exception) and same_value(self.rec_settings[n], r.decode('latin-1'))
+                   for (n, r) in zip(names, answers))
+
+    def rec_resume(self, data):
+        """ Continue a continuous recording (`rec_setup`, `rec_start`) after a reconnection.
+
+        If the recorder still runs with the configuration of `rec_setup` and still holds the last retrieved
+        samples at their index (see `rec_get_from`), the retrieval resumes right after them. The samples
+        produced since `rec_start`, estimated with the host clock (never more than the drive's), also bound
+        that: once more than `rec.numpoints` followed them they are overwritten, whatever the drive serves
+        (stationary channels would pass the check on a wrapped buffer).
+        Otherwise (samples overwritten, drive reset) it is set up and started again: the time column
+        continues from the time since the start and the samples lost meanwhile, estimated with the host
+        clock since the drive doesn't tell, are added to `rec_gaps`.
+        """
+        produced = int((self.clock.monotonic() - self.rec_started) / self.rec_time_incr)
+        oldest = produced - int(self.rec_settings["rec.numpoints"])
+        if self.rec_verify() and self.rec_get_from(data, self.rec_index, oldest) is not None:
+            return
+        lost = max(produced - self.rec_index, 0)
+        self.rec_setup(self.frequency, self.rec_channels, int(self.rec_settings["rec.numpoints"]),
+                       int(self.rec_settings["rec.retrievesize"]))
+        (rec_time, gaps) = (self.rec_time, self.rec_gaps)
+        self.rec_start()
+        (self.rec_time, self.rec_gaps) = (rec_time + lost * self.rec_time_incr, gaps)
+        self.rec_gaps.append((rec_time, lost))
 
     def rec_stop(self, data):
         self.command("rec.off")
@@ -346,7 +742,8 @@ class AKD:
         self.cset("unit.pout", 1)
 
     def temperature(self):
-        return self.commandI("motor.tempc")
+        with self.priority(TELEMETRY):
+            return self.commandI("motor.tempc")
 
     def faults(self, warnings=False):
         faults = []
@@ -380,30 +777,42 @@ class AKD:
         return fault_string
 
     def disable_sources(self):
-        drv_dissources_table = [
-            "Software disable",
-            "Fault exists",
-            "Hardware disable",
-            "In-rush disable (no high power)",
-            "Initialization disable (the drive did not finish the initialization)",
-            "Controlled stop disable from a digital input",
-            "Field Bus requested disable (SynqNet and EtherNet / IP only)",
-            "AKD-C requested disable (AKD-N only)",
-            "AKD pre-charge disable (AKD-C only)",
-            "Unknown",
-            "AKD-C in download mode"
-        ]
-        dissources = []
-        drvdisss = self.commandI("drv.dissources")
-        for source in drv_dissources_table:
-            if drvdisss & 1:
-                dissources.append(source)
-            drvdisss = drvdisss >> 1
-        return dissources
-
+        return dissources_descriptions(self.commandI("drv.dissources"))
+
+    def status(self):
+        """ Read drv.active, drv.dissources and drv.fault1 in one round trip, return a `DriveStatus`. """
+        with self.priority(TELEMETRY):
+            (active, dissources, fault) = self.command_batch(["drv.active", "drv.dissources", "drv.fault1"],
+                                                             return_exceptions=True)
+        for r in (active, dissources, fault):
+            if isinstance(r, Exception) and "Command was not found" not in str(r):
+                raise r
+        # drv.active is 3 in dynamic braking state, which is disabled
+        return DriveStatus(active=not isinstance(active, Exception) and akd_parse_int(active) == 1,
+                           dissources=0 if isinstance(dissources, Exception) else akd_parse_int(dissources),
+                           fault=0 if isinstance(fault, Exception) else akd_parse_int(fault))
+
+    def wait_for(self, condition, deadline=None, poll_policy=None, what="condition"):
+        """ Poll `condition()` until it returns a true value, which is returned.
+        `deadline` is a `clock.monotonic()` time after which an exception is raised.
+        The condition can raise itself to stop waiting (eg on faults).
+        """
+        delays = (poll_policy or PollPolicy()).delays()
+        while True:
+            r = condition()
+            if r:
+                return r
+            now = self.clock.monotonic()
+            if deadline is not None and now >= deadline:
+                raise Exception("AKD {} timeout waiting for {}".format(self.name, what))
+            delay = next(delays)
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+            self.clock.sleep(delay)
 
     def motion_status(self):
-        return MotionStat(self.commandI("drv.motionstat"))
+        with self.priority(TELEMETRY):
+            return MotionStat(self.commandI("drv.motionstat"))
 
 
     def clear_faults(self):
@@ -426,34 +835,36 @@ class AKD:
             else:
                 raise
 
-    def enable(self):
+    def enable(self, timeout=10):
         if self.is_active():
             return
         self.clear_faults()
         self.command("drv.en")
-        while not self.is_active():
-            f = self.faults()
-            if f:
-                raise Exception("Drive Faults: " + f)
-            diss = self.disable_sources()
-            if diss:
-                raise Exception("Cannot enable because: " + ", ".join(diss))
-            time.sleep(0.01)
-            self.command("drv.en")
+
+        def enabled():
+            st = self.status()
+            if st.active:
+                return True
+            if st.fault:
+                raise Exception("Drive Faults: " + ", ".join(self.faults()))
+            if st.dissources == 1:  # Only software disable, drv.en was not taken into account yet
+                self.command("drv.en")
+            elif st.dissources:
+                raise Exception("Cannot enable because: " + ", ".join(dissources_descriptions(st.dissources)))
+            return False
+
+        self.wait_for(enabled, self.clock.monotonic() + timeout, what="enable")
         print("Drive enabled")
 
-    def disable(self):
+    def disable(self, timeout=10):
         try:
+            self.command("drv.dis")  # To ensure SW enable is off even if the drive is not active
             if not self.is_active():
-                self.command("drv.dis")  # To ensure SW enable is off even if the drive is not active
                 return
-            while self.is_active():
-                self.command("drv.dis")
-                time.sleep(0.1)
+            self.wait_for(lambda: not self.is_active(), self.clock.monotonic() + timeout, what="disable")
             print("Drive disabled")
         except Exception as e:
             if "Command was not found" in str(e):
                 pass
             else:
                 raise
-
@@ -0,0 +1,591 @@
+""" Sorted names of `akd_command_list`, generated by `python -m aakd.akd_command_list`. """
+
+akd_command_names = (
+    'ain.cutoff',
+    'ain.deadband',
+    'ain.deadbandmode',
+    'ain.iscale',
+    'ain.mode',
+    'ain.offset',
+    'ain.ovfthresh',
+    'ain.ovwthresh',
+    'ain.pscale',
+    'ain.uvfthresh',
+    'ain.uvwthresh',
+    'ain.value',
+    'ain.vscale',
+    'ain2.cutoff',
+    'ain2.deadband',
+    'ain2.deadbandmode',
+    'ain2.mode',
+    'ain2.offset',
+    'ain2.value',
+    'ain2.zero',
+    'aout.cutoff',
+    'aout.iscale',
+    'aout.mode',
+    'aout.offset',
+    'aout.pscale',
+    'aout.value',
+    'aout.valueu',
+    'aout.vscale',
+    'aout2.cutoff',
+    'aout2.mode',
+    'aout2.offset',
+    'aout2.value',
+    'aout2.valueu',
+    'bode.excitegap',
+    'bode.freq',
+    'bode.iamp',
+    'bode.iflimit',
+    'bode.ifthresh',
+    'bode.injectpoint',
+    'bode.mode',
+    'bode.modetimer',
+    'bode.prbdepth',
+    'bode.vamp',
+    'bode.vflimit',
+    'bode.vfthresh',
+    'cap0.edge',
+    'cap0.en',
+    'cap0.event',
+    'cap0.fbsource',
+    'cap0.mode',
+    'cap0.plfb',
+    'cap0.preedge',
+    'cap0.prefilter',
+    'cap0.preselect',
+    'cap0.state',
+    'cap0.t',
+    'cap0.trigger',
+    'cap1.edge',
+    'cap1.en',
+    'cap1.event',
+    'cap1.fbsource',
+    'cap1.mode',
+    'cap1.plfb',
+    'cap1.preedge',
+    'cap1.prefilter',
+    'cap1.preselect',
+    'cap1.state',
+    'cap1.t',
+    'cap1.trigger',
+    'cogcomp.correctiontable',
+    'cogcomp.correctionvalue',
+    'cogcomp.en',
+    'cogcomp.load',
+    'cogcomp.rangehigh',
+    'cogcomp.rangelow',
+    'cogcomp.save',
+    'cogcomp.teach',
+    'cogcomp.v',
+    'cps.active',
+    'cs.dec',
+    'cs.state',
+    'cs.to',
+    'cs.vthresh',
+    'din.rotary',
+    'din.states',
+    'din1.filter',
+    'din1.mode',
+    'din1.param',
+    'din1.state',
+    'dout.ctrl',
+    'dout.relaymode',
+    'dout.states',
+    'dout1.mode',
+    'dout1.param',
+    'dout1.state',
+    'dout1.stateu',
+    'dout2.mode',
+    'dout2.param',
+    'dout2.state',
+    'dout2.stateu',
+    'drv.acc',
+    'drv.active',
+    'drv.blinkdisplay',
+    'drv.boottime',
+    'drv.clrfaulthist',
+    'drv.clrfaults',
+    'drv.cmddelay',
+    'drv.cmdsource',
+    'drv.crashdump',
+    'drv.dbilimit',
+    'drv.dec',
+    'drv.difvar',
+    'drv.dir',
+    'drv.dis',
+    'drv.dismode',
+    'drv.dissources',
+    'drv.dissourcesmask',
+    'drv.disto',
+    'drv.downloadallowed',
+    'drv.emuedir',
+    'drv.emuemode',
+    'drv.emuemturn',
+    'drv.emueres',
+    'drv.emuestepcmd',
+    'drv.emuestepcmdpin',
+    'drv.emuestepcmdpout',
+    'drv.emuezoffset',
+    'drv.en',
+    'drv.endefault',
+    'drv.errorlist',
+    'drv.fault1',
+    'drv.faultdisplaymode',
+    'drv.faulthist',
+    'drv.faults',
+    'drv.handwheel',
+    'drv.handwheelsrc',
+    'drv.help',
+    'drv.helpall',
+    'drv.hwenable',
+    'drv.hwendelay',
+    'drv.hwenmode',
+    'drv.icont',
+    'drv.info',
+    'drv.ipeak',
+    'drv.izero',
+    'drv.list',
+    'drv.logicvolts',
+    'drv.motiondissources',
+    'drv.name',
+    'drv.nvcheck',
+    'drv.nvlist',
+    'drv.nvload',
+    'drv.nvsave',
+    'drv.ontime',
+    'drv.opmode',
+    'drv.powerboardid',
+    'drv.readformat',
+    'drv.reboot',
+    'drv.rstvar',
+    'drv.runtime',
+    'drv.setupreqbits',
+    'drv.setupreqlist',
+    'drv.stop',
+    'drv.temperatures',
+    'drv.time',
+    'drv.type',
+    'drv.ver',
+    'drv.verimage',
+    'drv.warning1',
+    'drv.warnings',
+    'drv.zero',
+    'ds402.1addposfcfeed',
+    'ds402.1addposfcshaftrev',
+    'ds402.1addposgearmotorrev',
+    'ds402.1addposgearshaftrev',
+    'ds402.2addposfcfeed',
+    'ds402.2addposfcshaftrev',
+    'ds402.2addposgearmotorrev',
+    'ds402.2addposgearshaftrev',
+    'ds402.3addposfcfeed',
+    'ds402.3addposfcshaftrev',
+    'ds402.3addposgearmotorrev',
+    'ds402.3addposgearshaftrev',
+    'ds402.controlword',
+    'ds402.statusword',
+    'ecat.legacyrev',
+    'eip.acc',
+    'eip.cmdmap',
+    'eip.connected',
+    'eip.dec',
+    'eip.objectlist',
+    'eip.posunit',
+    'eip.profunit',
+    'eip.rspmap',
+    'fb1.bissbits',
+    'fb1.calthresh',
+    'fb1.diag',
+    'fb1.encres',
+    'fb1.encressource',
+    'fb1.encsign',
+    'fb1.faults',
+    'fb1.hallstate',
+    'fb1.hallstateu',
+    'fb1.hallstatev',
+    'fb1.hallstatew',
+    'fb1.identified',
+    'fb1.initpsaved',
+    'fb1.initpstatus',
+    'fb1.initpwindow',
+    'fb1.initsigned',
+    'fb1.lastidentified',
+    'fb1.mechpos',
+    'fb1.memver',
+    'fb1.motorphase',
+    'fb1.motorpoles',
+    'fb1.offset',
+    'fb1.origin',
+    'fb1.p',
+    'fb1.pdir',
+    'fb1.pfind',
+    'fb1.pfindcmdu',
+    'fb1.pin',
+    'fb1.poffset',
+    'fb1.poles',
+    'fb1.pout',
+    'fb1.pscale',
+    'fb1.punit',
+    'fb1.resktr',
+    'fb1.resrefphase',
+    'fb1.select',
+    'fb1.trackingcal',
+    'fb1.userbyte0',
+    'fb1.userdword0',
+    'fb1.userword0',
+    'fb2.dir',
+    'fb2.encres',
+    'fb2.mode',
+    'fb2.motorphase',
+    'fb2.motorpoles',
+    'fb2.p',
+    'fb2.pin',
+    'fb2.poffset',
+    'fb2.pout',
+    'fb2.punit',
+    'fb2.source',
+    'fb3.dir',
+    'fb3.encres',
+    'fb3.mode',
+    'fb3.motorphase',
+    'fb3.motorpoles',
+    'fb3.p',
+    'fb3.pdir',
+    'fb3.pin',
+    'fb3.poffset',
+    'fb3.pout',
+    'fb3.punit',
+    'fbus.blocking',
+    'fbus.interpolatemode',
+    'fbus.param1',
+    'fbus.pllstate',
+    'fbus.pllthresh',
+    'fbus.protection',
+    'fbus.sampleperiod',
+    'fbus.state',
+    'fbus.syncacquirewnd',
+    'fbus.syncact',
+    'fbus.syncdist',
+    'fbus.synclockwnd',
+    'fbus.syncwnd',
+    'fbus.type',
+    'gear.accmax',
+    'gear.decmax',
+    'gear.in',
+    'gear.mode',
+    'gear.move',
+    'gear.out',
+    'gear.syncwnd',
+    'gear.vmax',
+    'gui.display',
+    'gui.displays',
+    'gui.param01',
+    'gui.param02',
+    'gui.param03',
+    'gui.param04',
+    'gui.param05',
+    'gui.param06',
+    'gui.param07',
+    'gui.param08',
+    'gui.param09',
+    'gui.param10',
+    'home.acc',
+    'home.automove',
+    'home.dec',
+    'home.dir',
+    'home.dist',
+    'home.feedrate',
+    'home.ipeak',
+    'home.ipeakactive',
+    'home.maxdist',
+    'home.mode',
+    'home.move',
+    'home.moverequired',
+    'home.p',
+    'home.perrthresh',
+    'home.set',
+    'home.tposwnd',
+    'home.v',
+    'hwls.negstate',
+    'hwls.posstate',
+    'il.busff',
+    'il.cmd',
+    'il.cmdacc',
+    'il.cmdu',
+    'il.dcmd',
+    'il.dfb',
+    'il.difold',
+    'il.fb',
+    'il.fbsource',
+    'il.ff',
+    'il.foldfthresh',
+    'il.foldfthreshu',
+    'il.foldwthresh',
+    'il.ifold',
+    'il.iufb',
+    'il.kaccff',
+    'il.kbusff',
+    'il.kp',
+    'il.kpdratio',
+    'il.kplookupindex',
+    'il.kplookupvalue',
+    'il.kplookupvalues',
+    'il.kpsource',
+    'il.kvff',
+    'il.limitn',
+    'il.limitp',
+    'il.mfoldd',
+    'il.mfoldr',
+    'il.mfoldt',
+    'il.mi2t',
+    'il.mi2twthresh',
+    'il.mifold',
+    'il.mimode',
+    'il.offset',
+    'il.vcmd',
+    'il.vlimit',
+    'il.vufb',
+    'il.vvfb',
+    'ip.address',
+    'ip.gateway',
+    'ip.mode',
+    'ip.reset',
+    'ip.subnet',
+    'load.inertia',
+    'modbus.clrdynmap',
+    'modbus.clrerrors',
+    'modbus.dio',
+    'modbus.drv',
+    'modbus.drvstat',
+    'modbus.dynmap',
+    'modbus.errormode',
+    'modbus.errors',
+    'modbus.home',
+    'modbus.motor',
+    'modbus.msgdump',
+    'modbus.msglog',
+    'modbus.mt',
+    'modbus.pin',
+    'modbus.pout',
+    'modbus.pscale',
+    'modbus.scaling',
+    'modbus.sm',
+    'motor.autoset',
+    'motor.brake',
+    'motor.brakeimm',
+    'motor.brakerls',
+    'motor.brakestate',
+    'motor.ctf0',
+    'motor.fieldweakening',
+    'motor.icont',
+    'motor.iddatavalid',
+    'motor.idmax',
+    'motor.imid',
+    'motor.imtr',
+    'motor.inertia',
+    'motor.info',
+    'motor.ipeak',
+    'motor.ke',
+    'motor.kt',
+    'motor.ldll',
+    'motor.lisat',
+    'motor.lqll',
+    'motor.name',
+    'motor.phase',
+    'motor.phsadvk1',
+    'motor.phsadvk2',
+    'motor.pitch',
+    'motor.poles',
+    'motor.r',
+    'motor.rtype',
+    'motor.supportedparams',
+    'motor.tbrakeapp',
+    'motor.tbrakerls',
+    'motor.tbraketo',
+    'motor.temp',
+    'motor.tempc',
+    'motor.tempfault',
+    'motor.tempwarn',
+    'motor.type',
+    'motor.vmax',
+    'motor.voltmax',
+    'motor.voltmin',
+    'motor.voltrated',
+    'motor.vrated',
+    'mt.acc',
+    'mt.clear',
+    'mt.cntl',
+    'mt.continue',
+    'mt.dec',
+    'mt.emergmt',
+    'mt.feedrate',
+    'mt.list',
+    'mt.load',
+    'mt.move',
+    'mt.mtnext',
+    'mt.num',
+    'mt.p',
+    'mt.params',
+    'mt.set',
+    'mt.tnext',
+    'mt.tnum',
+    'mt.tnvsave',
+    'mt.tposwnd',
+    'mt.tvelwnd',
+    'mt.v',
+    'mt.vcmd',
+    'pl.cmd',
+    'pl.err',
+    'pl.errfactor',
+    'pl.errfthresh',
+    'pl.errmode',
+    'pl.errtime',
+    'pl.errwthresh',
+    'pl.fb',
+    'pl.fbsource',
+    'pl.filtertime',
+    'pl.gearin',
+    'pl.gearout',
+    'pl.intinmax',
+    'pl.intoutmax',
+    'pl.ki',
+    'pl.kithresh',
+    'pl.kp',
+    'pl.modp1',
+    'pl.modp2',
+    'pl.modpdir',
+    'pl.modpen',
+    'pl.pdelay',
+    'pls.en',
+    'pls.mode',
+    'pls.p1',
+    'pls.reset',
+    'pls.state',
+    'pls.t1',
+    'pls.units',
+    'pls.width1',
+    'pn.accscaling',
+    'pn.posscale',
+    'pn.stw1',
+    'pn.timeoutfthresh',
+    'pn.velscaling',
+    'pn.zsw1',
+    'rec.active',
+    'rec.ch1',
+    'rec.done',
+    'rec.gap',
+    'rec.numpoints',
+    'rec.off',
+    'rec.recprmlist',
+    'rec.retrieve',
+    'rec.retrievedata',
+    'rec.retrievefrmt',
+    'rec.retrievehdr',
+    'rec.retrievesize',
+    'rec.stoptype',
+    'rec.trig',
+    'rec.trigparam',
+    'rec.trigpos',
+    'rec.trigprmlist',
+    'rec.trigslope',
+    'rec.trigtype',
+    'rec.trigval',
+    'regen.power',
+    'regen.powerfiltered',
+    'regen.rext',
+    'regen.text',
+    'regen.type',
+    'regen.wattext',
+    's3.address',
+    'sd.load',
+    'sd.save',
+    'sd.status',
+    'sm.acc',
+    'sm.dec',
+    'sm.i1',
+    'sm.i2',
+    'sm.mode',
+    'sm.move',
+    'sm.t1',
+    'sm.t2',
+    'sm.v1',
+    'sm.v2',
+    'sto.state',
+    'swls.en',
+    'swls.limit0',
+    'swls.limit1',
+    'swls.state',
+    'temp.control',
+    'temp.power1',
+    'unit.acclinear',
+    'unit.accrotary',
+    'unit.label',
+    'unit.pin',
+    'unit.plinear',
+    'unit.pout',
+    'unit.protary',
+    'unit.vlinear',
+    'unit.vrotary',
+    'user.int1',
+    'vbus.halfvolt',
+    'vbus.ovfthresh',
+    'vbus.ovwthresh',
+    'vbus.rmslimit',
+    'vbus.uvfthresh',
+    'vbus.uvmode',
+    'vbus.uvwthresh',
+    'vbus.value',
+    'vl.arpf1',
+    'vl.arpq1',
+    'vl.artype1',
+    'vl.arzf1',
+    'vl.arzq1',
+    'vl.busff',
+    'vl.cmd',
+    'vl.cmdu',
+    'vl.err',
+    'vl.fb',
+    'vl.fbfilter',
+    'vl.fbsource',
+    'vl.fbunfiltered',
+    'vl.ff',
+    'vl.ffdelay',
+    'vl.genmode',
+    'vl.kbusff',
+    'vl.ki',
+    'vl.kimode',
+    'vl.kp',
+    'vl.kvff',
+    'vl.limitn',
+    'vl.limitp',
+    'vl.lmjr',
+    'vl.model',
+    'vl.obsbw',
+    'vl.obsmode',
+    'vl.thresh',
+    'vl.threshcutoff',
+    'vl.vfthresh',
+    'ws.arm',
+    'ws.checkmode',
+    'ws.checkt',
+    'ws.checkv',
+    'ws.disarm',
+    'ws.distmax',
+    'ws.distmin',
+    'ws.forceoff',
+    'ws.freq',
+    'ws.imax',
+    'ws.mode',
+    'ws.numloops',
+    'ws.state',
+    'ws.t',
+    'ws.tdelay1',
+    'ws.tdelay2',
+    'ws.tdelay3',
+    'ws.tdelay4',
+    'ws.tiramp',
+    'ws.tstandstill',
+    'ws.vthresh',
+)
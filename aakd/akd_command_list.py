@@ -589,3 +589,20 @@ akd_command_list = {
     "ws.tstandstill": ( "R/W", "Sets the calming time of the motor for Wake & Shake mode 1."),
     "ws.vthresh": ( "NV", "Defines the maximum allowed velocity for Wake & Shake."),
 }
+
+
+def write_command_index(filename=None):
+    """ Regenerate akd_command_index.py, the sorted command names used for completion. """
+    from pathlib import Path
+    filename = filename or Path(__file__).parent / "akd_command_index.py"
+    with open(filename, 'w') as f:
+        print('""" Sorted names of `akd_command_list`, generated by `python -m aakd.akd_command_list`. """', file=f)
+        print(file=f)
+        print("akd_command_names = (", file=f)
+        for name in sorted(akd_command_list):
+            print("    {},".format(repr(name)), file=f)
+        print(")", file=f)
+
+
+if __name__ == "__main__":
+    write_command_index()
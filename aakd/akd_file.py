@@ -0,0 +1,175 @@
+""" Model of the .akd parameter files (see `AKD.save_params`) and an index of a folder of them.
+
+An .akd file is a list of `PARAMETER value   # comment` lines, followed by an `### Infos` section
+of `# KEY value` comment lines (drive and motor informations and DRV.NVCHECK).
+"""
+
+import hashlib
+import os
+import pickle
+import re
+from pathlib import Path
+
+
+class AkdFile:
+    """ A parsed .akd file.
+
+    `lines`: [(parameter, value)] in file order, repeated parameters included, it is what a restore replays,
+    `params`: {parameter: value} for lookups, the last value of a repeated parameter,
+    values are strings without the comments,
+    `comments`: {parameter: end of line comment},
+    `header_comments`: comment lines before the Infos section,
+    `infos`: {key: value} of the Infos section, `info_text`: the DRV.INFO block,
+    `nvcheck`: the DRV.NVCHECK of the drive when saved (or None).
+    """
+
+    def __init__(self, filename=None):
+        self.filename = str(filename) if filename is not None else None
+        self.lines = []
+        self.params = {}
+        self.comments = {}
+        self.header_comments = []
+        self.infos = {}
+        self.info_text = []
+        self.nvcheck = None
+
+    @classmethod
+    def parse(cls, filename):
+        with open(filename) as f:
+            return cls.parse_lines(f, filename)
+
+    @classmethod
+    def parse_lines(cls, lines, filename=None):
+        a = cls(filename)
+        in_infos = False
+        in_info_block = False
+        for l in lines:
+            l = l.rstrip('\r\n')
+            if not l.strip():
+                continue
+            if l[0] == '#':
+                if l.startswith("### Infos"):
+                    in_infos = True
+                elif not in_infos:
+                    a.header_comments.append(l)
+                elif l.startswith("# DRV.INFO"):
+                    in_info_block = True
+                elif in_info_block and l.startswith("#   "):
+                    a.info_text.append(l[4:])
+                else:
+                    in_info_block = False
+                    g = re.match(r"^#\s*([^ ]+) ?(.*)$", l)
+                    if g:
+                        a.infos[g.group(1)] = g.group(2)
+                continue
+            g = re.match(r"^([^ \t#]+)(?:[ \t]+([^#]*?))?\s*(#\s*(.*))?$", l)
+            if not g:
+                raise Exception('Unexpected line in akd file {}: {}'.format(filename, repr(l)))
+            a.lines.append((g.group(1), g.group(2) or ""))
+            a.params[g.group(1)] = g.group(2) or ""
+            if g.group(4) is not None:
+                a.comments[g.group(1)] = g.group(4)
+        a.nvcheck = a.infos.get("DRV.NVCHECK")
+        return a
+
+    def commands(self):
+        """ The commands setting the parameters of the file, line by line as written. """
+        return ["{} {}".format(p, v) if v else p for (p, v) in self.lines]
+
+    def upper_params(self):
+        """ The parameters with upper case names (the drive is case insensitive). """
+        return {p.upper(): v for (p, v) in self.params.items()}
+
+
+def _parse_or_error(filename):
+    try:
+        return AkdFile.parse(filename)
+    except Exception as e:
+        return e
+
+
+def parse_akd_files(filenames, workers=None):
+    """ Parse .akd files in parallel (processes), return a list of `AkdFile` or exceptions. """
+    filenames = [str(f) for f in filenames]
+    if len(filenames) < 8:  # Not worth starting processes
+        return [_parse_or_error(f) for f in filenames]
+    import concurrent.futures as futures
+    with futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_parse_or_error, filenames, chunksize=16))
+
+
+class AkdIndex:
+    """ Parsed .akd files of a folder, persisted in the user cache and keyed by file mtime and size,
+    so only modified files are parsed again.
+    """
+
+    VERSION = 2
+
+    def __init__(self, folder):
+        from .fleet_config import cache_folder
+        self.folder = Path(folder).resolve()
+        self.cache_file = cache_folder() / ("akd-index-" + hashlib.sha1(str(self.folder).encode()).hexdigest()
+                                            + ".pickle")
+        self.entries = {}  # filename -> (mtime_ns, size, AkdFile)
+        self.dirty = False
+        try:
+            with open(self.cache_file, 'rb') as f:
+                (version, entries) = pickle.load(f)
+            if version == self.VERSION:
+                self.entries = entries
+        except Exception:
+            pass  # No or bad index
+
+    def _key(self, filename):
+        st = os.stat(filename)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get_many(self, filenames, workers=None):
+        """ Return the `AkdFile` (or the exception) of each file, parsing only the modified ones. """
+        filenames = [str(Path(f).resolve()) for f in filenames]
+        results = [None] * len(filenames)
+        stale = []
+        for i, f in enumerate(filenames):
+            try:
+                key = self._key(f)
+            except OSError as e:
+                results[i] = e
+                continue
+            entry = self.entries.get(f)
+            if entry is not None and entry[:2] == key:
+                results[i] = entry[2]
+            else:
+                stale.append((i, f, key))
+        parsed = parse_akd_files([f for (i, f, key) in stale], workers)
+        for ((i, f, key), a) in zip(stale, parsed):
+            results[i] = a
+            if not isinstance(a, Exception):
+                self.entries[f] = (*key, a)
+                self.dirty = True
+        return results
+
+    def get(self, filename):
+        a = self.get_many([filename])[0]
+        if isinstance(a, Exception):
+            raise a
+        return a
+
+    def all(self, workers=None):
+        """ Return {filename: AkdFile} of all the .akd files of the folder. """
+        filenames = sorted(str(f) for f in self.folder.glob("*.akd"))
+        return {f: a for (f, a) in zip(filenames, self.get_many(filenames, workers)) if not isinstance(a, Exception)}
+
+    def save(self):
+        if not self.dirty:
+            return
+        # forget deleted files
+        self.entries = {f: e for (f, e) in self.entries.items() if os.path.exists(f)}
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_file.with_suffix(".tmp" + str(os.getpid()))
+            with open(tmp, 'wb') as f:
+                pickle.dump((self.VERSION, self.entries), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.cache_file)
+            self.dirty = False
+        except OSError:
+            pass  # The index is only an optimization
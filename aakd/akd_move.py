@@ -1,36 +1,17 @@
-import time
-from .akd_flags import MTCntl, MotionStat
+from .akd import akd_parse_int, DriveError
+from .akd_flags import MotionStat
+from .motion_program import MotionTask
 
 
 def motiontask_setup(akd, mt_num, pos, vel, acc, dec, absolute=True, next_task=None, dwell_time=0):
-    """ This function sets up a motion task """
-    akd.cset("mt.num", mt_num)
-    akd.cset("mt.p", pos)
-    # We currently handle only trapezoidal motion tasks
-    mtcntl = MTCntl.MTAccelTrapezoidal
-    akd.cset("mt.v", vel)
-    akd.cset("mt.acc", acc)
-    akd.cset("mt.dec", dec)
-
-    mtcntl |= MTCntl.MTTypeAbsolute if absolute else MTCntl.MTTypeRelative
-
-    if next_task is not None:
-        akd.cset("mt.mtnext", next_task)
-        mtcntl |= MTCntl.MTExecuteNext
-        if dwell_time:
-            akd.cset("mt.tnext", dwell_time)
-            mtcntl |= MTCntl.MTNextDwell
-        else:
-            mtcntl |= MTCntl.MTNextDefault
-    akd.cset("mt.cntl", mtcntl.value)
-    akd.command("mt.set")
+    """ This function sets up a (trapezoidal) motion task, see also `MotionProgram` for tables of tasks """
+    task = MotionTask(mt_num, pos, vel, acc, dec, type="absolute" if absolute else "relative",
+                      next=next_task, dwell=dwell_time)
+    task.write(akd)
 
 
-def motiontask_completed(akd):
-    """ Return whether the current task (indicated by mt.num) is completed.
-    Note that task chaining others will complete, then change task and be non completed again.
-    """
-    ms = akd.motion_status()
+def motionstat_completed(ms):
+    """ Return whether the motion status `ms` (a `MotionStat`) is completed, raise on motion task errors. """
     done = (ms & MotionStat.MTCompleted) and not (ms & MotionStat.MotionActive)
     if not done:  # It seems that tiny motion task updates will set MTFault but complete fine.
         mserr = ms.is_error()
@@ -39,20 +20,163 @@ def motiontask_completed(akd):
     return done
 
 
+def motiontask_completed(akd):
+    """ Return whether the current task (indicated by mt.num) is completed.
+    Note that task chaining others will complete, then change task and be non completed again.
+    """
+    return motionstat_completed(akd.motion_status())
+
+
 def motiontask_run(akd, mt_num):
     """ Run the motion task mt_num until completion or error.
     Note, the drive will be enabled and put in position service mode.
     """
     akd.service_mode()
     akd.enable()
-    akd.cset("mt.move", mt_num)
-    start_time = time.time()
-    while not motiontask_completed(akd):
-        f = akd.faults(warnings=True)
-        if f:
-            raise Exception("Drive Faults: " + f)
-        if time.time() - start_time > 2:
-            print("Position:", akd.commandS("pl.fb"))
-            start_time = time.time()
-        time.sleep(0.01)
-    print("Position:", akd.commandS("pl.fb"))
+    motiontasks_run({akd.name: akd}, mt_num)
+
+
+def multiplexed_commands(akds, cmds):
+    """ Send the commands `cmds` ({name: [command]}) to all the drives `akds` ({name: AKD}) before reading
+    any answer, so that polling many drives costs one round trip. Return {name: [answer]}.
+    """
+    return read_multiplexed_answers(akds, cmds, send_multiplexed(akds, cmds))
+
+
+def send_multiplexed(akds, cmds, times=None):
+    """ Send the commands `cmds` ({name: [command]}) without reading the answers, return the start of
+    each command for `read_multiplexed_answers`. If `times` is a dict, it is filled with {name: send time}.
+    On a failure, the connections which were sent commands are discarded (see `AKD.discard_connection`).
+    """
+    starts = {}
+    try:
+        for (name, c_list) in cmds.items():
+            starts[name] = []
+            if times is not None:
+                times[name] = akds[name].clock.monotonic()
+            for c in c_list:
+                starts[name].append(akds[name].send(c))
+    except BaseException:
+        for name in starts:
+            akds[name].discard_connection()
+        raise
+    return starts
+
+
+def read_multiplexed_answers(akds, cmds, starts, times=None):
+    """ Read the answers of the commands sent by `send_multiplexed`, return {name: [answer]}.
+    If `times` is a dict, it is filled with {name: time its answers were read}.
+    All the answers are read before raising the first drive error, so that the connections stay in sync.
+    On any other failure, the connections with answers left unread are discarded.
+    """
+    answers = {}
+    error = None
+    unread = list(cmds)
+    try:
+        for name in cmds:
+            answers[name] = []
+            for (c, start) in zip(cmds[name], starts[name]):
+                try:
+                    answers[name].append(akds[name].read_answer(c, start))
+                except DriveError as e:
+                    error = error or e
+                    answers[name].append(e)
+            unread.remove(name)
+            if times is not None:
+                times[name] = akds[name].clock.monotonic()
+    except BaseException:
+        for name in unread:
+            akds[name].discard_connection()
+        raise
+    if error is not None:
+        raise error
+    return answers
+
+
+class GroupMoveReport:
+    """ Timings of a coordinated move:
+    `start_skew`: time between sending the first and the last mt.move,
+    `ack_skew`: time between the first and the last mt.move answer,
+    `durations`: {name: time from the start to the completion}, `positions`: {name: final pl.fb}.
+    """
+
+    def __init__(self):
+        self.start_skew = None
+        self.ack_skew = None
+        self.durations = {}
+        self.positions = {}
+
+    def summary(self):
+        return "start skew {:.1f}ms (acknowledged within {:.1f}ms), {}".format(
+            self.start_skew * 1000, self.ack_skew * 1000,
+            ", ".join("{} done in {:.2f}s".format(n, d) for (n, d) in self.durations.items()))
+
+
+STATUS_POLL = ["drv.motionstat", "drv.fault1"]
+
+
+def motiontasks_run(akds, mt_num, timeout=None, poll_period=0.01, report_period=2):
+    """ Run motion tasks on several drives ({name: AKD}) at once, until all are completed.
+    `mt_num` is the motion task number, or {name: motion task number}.
+    The drives must be enabled in position service mode (see `motiontask_run`).
+
+    All the mt.move are written before reading their answers for a synchronized start, then every
+    `poll_period` the motion status and first fault of all the running drives are read in a single
+    round trip. A fault, a motion task error or the `timeout` on any drive stops all of them (drv.stop).
+    Return a `GroupMoveReport`.
+    """
+    names = list(akds)
+    nums = mt_num if isinstance(mt_num, dict) else {name: mt_num for name in names}
+    clock = akds[names[0]].clock
+    report = GroupMoveReport()
+    try:
+        moves = {name: ["mt.move {}".format(nums[name])] for name in names}
+        sent = {}
+        acks = {}
+        read_multiplexed_answers(akds, moves, send_multiplexed(akds, moves, sent), acks)
+        start = min(sent.values())
+        report.start_skew = max(sent.values()) - start
+        report.ack_skew = max(acks.values()) - min(acks.values())
+
+        running = list(names)
+        last_report = start
+        while running:
+            answers = multiplexed_commands(akds, {name: STATUS_POLL for name in running})
+            now = clock.monotonic()
+            for (name, (ms, fault)) in answers.items():
+                if akd_parse_int(fault):
+                    raise Exception("{}: Drive Faults: {}".format(name, ", ".join(akds[name].faults(warnings=True))))
+                try:
+                    if motionstat_completed(MotionStat(akd_parse_int(ms))):
+                        running.remove(name)
+                        report.durations[name] = now - start
+                except Exception as e:
+                    raise Exception("{}: {}".format(name, e))
+            if report_period and running and now - last_report > report_period:
+                print_positions(akds, running)
+                last_report = now
+            if timeout is not None and running and now - start > timeout:
+                raise Exception("Timeout waiting for the motion tasks of {}".format(", ".join(running)))
+            if running:
+                clock.sleep(poll_period)
+    except BaseException:
+        for a in akds.values():
+            try:
+                if a.t is None:  # discarded, out of sync
+                    a.reconnect(timeout=5)
+                a.command("drv.stop")
+            except Exception:
+                pass  # The original error is more interesting
+        raise
+    report.positions = print_positions(akds, names)
+    return report
+
+
+def print_positions(akds, names):
+    positions = {name: answers[0].decode('latin-1')
+                 for (name, answers) in multiplexed_commands(akds, {name: ["pl.fb"] for name in names}).items()}
+    if len(positions) == 1:
+        print("Position:", *positions.values())
+    else:
+        print("Positions:", ", ".join("{} {}".format(name, p) for (name, p) in positions.items()))
+    return positions
@@ -0,0 +1,55 @@
+""" Startup and completion latency benchmark of the `aakd` command.
+
+Run with `python -m aakd.bench_startup [-n RUNS]`.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_times(cmd, runs, env=None):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(title, times):
+    print("{:<32} median {:7.1f}ms  min {:7.1f}ms".format(
+        title, statistics.median(times) * 1000, min(times) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure aakd startup and completion latency")
+    parser.add_argument('-n', '--runs', type=int, default=10, help="Number of runs of each measure")
+    args = parser.parse_args()
+
+    python = [sys.executable, "-W", "ignore"]
+
+    report("python startup (reference)", run_times(python + ["-c", "pass"], args.runs))
+    report("import aakd.aakd_command", run_times(python + ["-c", "import aakd.aakd_command"], args.runs))
+    report("aakd --help", run_times(python + ["-m", "aakd.aakd_command", "--help"], args.runs))
+
+    with tempfile.NamedTemporaryFile() as out:
+        comp_line = "aakd cmd drv.n"
+        env = dict(os.environ, _ARGCOMPLETE="1", _ARGCOMPLETE_SHELL="bash", COMP_LINE=comp_line,
+                   COMP_POINT=str(len(comp_line)), _ARGCOMPLETE_STDOUT_FILENAME=out.name)
+        report("TAB completion (process)", run_times(python + ["-m", "aakd.aakd_command"], args.runs, env))
+
+    from .aakd_command import complete_command
+    n = 10000
+    start = time.perf_counter()
+    for _ in range(n):
+        complete_command("drv.n")
+    print("{:<32} {:10.2f}us".format("complete_command (in process)", (time.perf_counter() - start) / n * 1e6))
+
+
+if __name__ == "__main__":
+    main()
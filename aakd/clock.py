@@ -0,0 +1,55 @@
+""" Clocks used for all the timing (sleeps, timeouts and timestamps) of the library.
+
+Everything takes its time from `AKD.clock`, so that drive emulations can run with a `VirtualClock`,
+much faster than real time.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    """ The real clock. """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, duration):
+        time.sleep(duration)
+
+    def now(self):
+        return datetime.now()
+
+
+class VirtualClock:
+    """ A clock which only advances when slept on (or with `advance`).
+    Sleeping returns immediately, a simulated workflow takes as long as its computations.
+    """
+
+    def __init__(self, start_time=None):
+        self.epoch = time.time() if start_time is None else start_time
+        self.t = 0.0
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.epoch + self.t
+
+    def monotonic(self):
+        return self.t
+
+    def advance(self, duration):
+        with self.lock:
+            self.t += max(duration, 0)
+
+    def sleep(self, duration):
+        self.advance(duration)
+
+    def now(self):
+        return datetime.fromtimestamp(self.time())
+
+
+system_clock = SystemClock()
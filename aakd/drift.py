@@ -0,0 +1,110 @@
+""" Fleet-wide parameter drift analysis of the drives .akd files.
+
+The .akd files are parsed in parallel (see `AkdIndex`), each drive is compared with its parameters resolved from
+the parameter files, and the drives are clustered by the fingerprint of their parameters
+to find the ones that differ from the rest of the fleet.
+"""
+
+import collections
+import hashlib
+
+
+# Parameters expected to be different on every drive
+DEFAULT_IGNORED = ("DRV.NAME", "FB1.OFFSET", "IP.ADDRESS", "DRV.NVCHECK")
+
+
+def normalize_value(v):
+    """ Normalized string of a value, floats are compared with a 0.001 resolution (drive storage). """
+    try:
+        return "{:.3f}".format(float(v))
+    except (TypeError, ValueError):
+        return str(v)
+
+
+def values_differ(expected, actual):
+    if isinstance(expected, str):
+        return expected != actual
+    try:
+        return abs(expected - float(actual)) > 0.003  # storage of float seems 0.003 accurate
+    except (TypeError, ValueError):
+        return True
+
+
+def fingerprint(params, ignored=DEFAULT_IGNORED):
+    items = sorted((p, normalize_value(v)) for p, v in params.items() if p not in ignored)
+    return hashlib.sha1(repr(items).encode()).hexdigest()[:10]
+
+
+class DriftReport:
+    """ Drift of the drives parameters (`drives_params`: name -> {PARAMETER: value} of the .akd file)
+    against the expected parameters (`expected`: name -> {parameter: value}) and against each other.
+    """
+
+    def __init__(self, drives_params, expected, ignored=DEFAULT_IGNORED):
+        self.drives_params = drives_params
+        self.ignored = set(p.upper() for p in ignored)
+
+        self.clusters = collections.defaultdict(list)
+        self.fingerprints = {}
+        for (name, params) in drives_params.items():
+            fp = fingerprint(params, self.ignored)
+            self.fingerprints[name] = fp
+            self.clusters[fp].append(name)
+
+        # Differences with the parameter files
+        self.tree_diffs = {}
+        for (name, params) in drives_params.items():
+            diffs = {}
+            for (p, v) in expected.get(name, {}).items():
+                p = p.upper()
+                if p in self.ignored:
+                    continue
+                if p not in params:
+                    diffs[p] = (v, None)
+                elif values_differ(v, params[p]):
+                    diffs[p] = (v, params[p])
+            self.tree_diffs[name] = diffs
+
+        # Parameters where some drives differ from the majority
+        all_params = set(p for params in drives_params.values() for p in params) - self.ignored
+        self.outliers = {}
+        for p in sorted(all_params):
+            values = {name: normalize_value(params[p]) if p in params else None
+                      for (name, params) in drives_params.items()}
+            counts = collections.Counter(values.values())
+            if len(counts) < 2:
+                continue
+            (majority, count) = counts.most_common(1)[0]
+            self.outliers[p] = (majority, count, {n: v for (n, v) in values.items() if v != majority})
+
+    def drive_outliers(self, name):
+        return {p: (v[name], majority) for (p, (majority, count, v)) in self.outliers.items() if name in v}
+
+    def print_table(self, out=None, details=False):
+        cluster_ids = {fp: i for i, (fp, names) in
+                       enumerate(sorted(self.clusters.items(), key=lambda c: -len(c[1])))}
+        print("{} drives, {} parameter clusters, {} varying parameters".format(
+            len(self.drives_params), len(self.clusters), len(self.outliers)), file=out)
+        print("{:<24} {:>7} {:>6} {:>9}  {}".format(
+            "drive", "cluster", "tree", "outliers", "outlier parameters (majority)"), file=out)
+        for name in self.drives_params:
+            fp = self.fingerprints[name]
+            outliers = self.drive_outliers(name)
+            print("{:<24} {:>7} {:>6} {:>9}  {}".format(
+                name, "{}({})".format(cluster_ids[fp], len(self.clusters[fp])), len(self.tree_diffs[name]),
+                len(outliers),
+                ", ".join("{}={} ({})".format(p, v, m) for (p, (v, m)) in sorted(outliers.items()))),
+                file=out)
+            if details:
+                for (p, (expected, actual)) in sorted(self.tree_diffs[name].items()):
+                    print("{:<26}{} is {} expected {}".format("", p, actual, expected), file=out)
+
+    def to_dict(self):
+        return {
+            name: {
+                'cluster': self.fingerprints[name],
+                'tree': {p: {'expected': e, 'actual': a} for (p, (e, a)) in self.tree_diffs[name].items()},
+                'outliers': {p: {'value': v, 'majority': m} for (p, (v, m)) in self.drive_outliers(name).items()},
+            }
+            for name in self.drives_params
+        }
@@ -0,0 +1,361 @@
+""" A (very) simplified AKD drive emulator.
+
+`AKDEmulator` is a transport that can be given to `AKD(..., transport=...)`.
+It answers commands like the telnet interface of a drive and emulates the parts of the drive
+the library relies on: parameters, enable/disable, faults, motion tasks and the recorder.
+All its timing comes from a clock, with a `VirtualClock` long workflows run in milliseconds.
+"""
+
+import math
+import re
+import zlib
+
+from .akd_command_list import akd_command_list
+from .akd_flags import MTCntl, MotionStat
+from .clock import VirtualClock
+
+
+def emulator_format_internal(value):
+    """ Format a value like the recorder internal format (see `akd_parse_internal`). """
+    return "F3" + format(int(round(value * 1000)), 'x')
+
+
+class AKDEmulator:
+    """ Emulated drive transport.
+
+    `latency` [s] is added (on the clock) to every answer to emulate the link round trip.
+    """
+
+    def __init__(self, name="emulated", clock=None, latency=0.0005, enable_delay=0.02, disable_delay=0.02,
+                 parameters=None):
+        self.clock = clock if clock is not None else VirtualClock()
+        self.latency = latency
+        self.enable_delay = enable_delay
+        self.disable_delay = disable_delay
+        self.params = {
+            "drv.name": name,
+            "drv.ver": "Danaher Motion - Digital Servo Amplifier AKD\n-------------- Emulated ---------------",
+            "drv.info": "Emulated AKD drive\nDrive model          : AKD-P00306-NBEC-0000\n"
+                        "Firmware Version     : M_01-20-00-000",
+            "drv.type": "0",
+            "drv.opmode": "0",
+            "drv.cmdsource": "0",
+            "pl.fb": "0.000",
+            "il.fb": "0.000",
+            "vl.fb": "0.000",
+            "motor.tempc": "25",
+            "fb1.offset": "0.000",
+            "rec.gap": "1",
+            "rec.numpoints": "10000",
+            "rec.retrievesize": "4800",
+            "rec.stoptype": "0",
+            "rec.trigtype": "0",
+            "rec.trigpos": "0",
+            **{"rec.ch" + str(i): "clear" for i in range(1, 7)},
+            "mt.num": "0",
+            "mt.tnext": "0",
+            "mt.mtnext": "0",
+            "mt.tnum": "0",
+        }
+        if parameters:
+            self.params.update({k.lower(): str(v) for k, v in parameters.items()})
+        self.units = {"fb1.offset": "deg", "pl.fb": "deg", "vl.fb": "rps", "il.fb": "A"}
+        self.defaults = dict(self.params)
+        self.nv = {}
+        self.nvsave()
+        self.output = b""
+        self.sw_enable = False
+        self.active_change = None  # (time, active) of the pending transition
+        self.active = False
+        self.faults = []  # list of (code, time) of the fault
+        self.motion_tasks = {}
+        self.motion = None  # list of (start_time, end_time, start_pos, end_pos, mt_num) of the running chain
+        self.motion_error = False
+        self.recorder = None
+
+    # Transport interface
+
+    def write(self, data):
+        for line in data.decode('ascii').split('\r\n'):
+            if line.strip():
+                answer = self.answer(line.strip()).replace('\n', '\r\n')
+                self.output += answer.encode('latin-1') + b"\r\n-->"
+
+    def read_until(self, match, timeout=None):
+        self.clock.sleep(self.latency)
+        i = self.output.find(match)
+        if i < 0:
+            (r, self.output) = (self.output, b"")
+        else:
+            (r, self.output) = (self.output[:i + len(match)], self.output[i + len(match):])
+        return r
+
+    def read_very_eager(self):
+        (r, self.output) = (self.output, b"")
+        return r
+
+    def close(self):
+        pass
+
+    # Emulated drive
+
+    def inject_fault(self, code=502, delay=0):
+        """ The drive will fault with `code` in `delay` [s]. """
+        self.faults.append((code, self.clock.monotonic() + delay))
+
+    def active_faults(self):
+        now = self.clock.monotonic()
+        return [code for (code, t) in self.faults if t <= now]
+
+    def nvsave(self):
+        self.nv = dict(self.params)
+        self.params["drv.nvcheck"] = "0x{:08X}".format(
+            zlib.crc32(repr(sorted(self.nv.items())).encode()))
+
+    def is_active(self):
+        now = self.clock.monotonic()
+        if self.active_faults():
+            self.active = False
+            self.active_change = None
+        if self.active_change and self.active_change[0] <= now:
+            self.active = self.active_change[1]
+            self.active_change = None
+        return self.active
+
+    def value(self, name):
+        try:
+            return float(self.params.get(name, 0))
+        except ValueError:
+            return 0.0
+
+    def answer(self, line):
+        m = re.match(r"([^ ]+)\s*(.*)", line)
+        (cmd, arg) = (m.group(1).lower(), m.group(2))
+        handler = getattr(self, "cmd_" + cmd.replace('.', '_'), None)
+        if handler:
+            return handler(arg)
+        g = re.match(r"drv\.(fault|warning)(\d+)$", cmd)
+        if g:
+            faults = self.active_faults() if g.group(1) == "fault" else []
+            i = int(g.group(2)) - 1
+            return str(faults[i]) if i < len(faults) else "0"
+        if arg:  # the command list is not complete, accept setting anything
+            self.params[cmd] = arg
+            return ""
+        if cmd not in self.params and cmd not in akd_command_list:
+            return "Error: Command was not found."
+        if cmd in self.units:
+            return "{} [{}]".format(self.params.get(cmd, "0"), self.units[cmd])
+        return self.params.get(cmd, "0")
+
+    def cmd_drv_en(self, arg):
+        self.sw_enable = True
+        if not self.active_faults() and not self.is_active() and self.active_change is None:
+            self.active_change = (self.clock.monotonic() + self.enable_delay, True)
+        return ""
+
+    def cmd_drv_dis(self, arg):
+        self.sw_enable = False
+        if self.is_active() and self.active_change is None:
+            self.active_change = (self.clock.monotonic() + self.disable_delay, False)
+        return ""
+
+    def cmd_drv_active(self, arg):
+        return "1" if self.is_active() else "0"
+
+    def cmd_drv_dissources(self, arg):
+        sources = 0 if self.sw_enable else 1
+        if self.active_faults():
+            sources |= 2
+        return str(sources)
+
+    def cmd_drv_clrfaults(self, arg):
+        self.faults = [(code, t) for (code, t) in self.faults if t > self.clock.monotonic()]
+        self.motion_error = False
+        return ""
+
+    def cmd_drv_faults(self, arg):
+        faults = self.active_faults()
+        if not faults:
+            return "No faults active"
+        return "\n".join("{}: Emulated fault.".format(f) for f in faults)
+
+    def cmd_drv_warnings(self, arg):
+        return "No warnings active"
+
+    def cmd_ds402_statusword(self, arg):
+        return str(0x08 if self.active_faults() else 0x27 if self.is_active() else 0x40)
+
+    def cmd_drv_nvsave(self, arg):
+        self.nvsave()
+        return ""
+
+    def cmd_drv_rstvar(self, arg):
+        self.params = dict(self.defaults)
+        return ""
+
+    def cmd_drv_nvlist(self, arg):
+        return "\n".join("{} {}".format(k.upper(), v) for k, v in sorted(self.params.items())
+                         if k in akd_command_list and akd_command_list[k][0] == "NV")
+
+    def cmd_drv_difvar(self, arg):
+        return "\n".join("{} {} ({})".format(k.upper(), v, self.defaults.get(k, 0))
+                         for k, v in sorted(self.params.items())
+                         if self.defaults.get(k) != v and akd_command_list.get(k, ("NV",))[0] == "NV")
+
+    # Motion tasks
+
+    def cmd_mt_set(self, arg):
+        self.motion_tasks[int(self.value("mt.num"))] = {
+            k: self.value("mt." + k) for k in ("p", "v", "acc", "dec", "cntl", "mtnext", "tnext", "tnum")}
+        return ""
+
+    def cmd_mt_load(self, arg):
+        num = int(arg)
+        if num not in self.motion_tasks:
+            return "Error: Invalid motion task."
+        self.params["mt.num"] = str(num)
+        for (k, v) in self.motion_tasks[num].items():
+            self.params["mt." + k] = "{:.3f}".format(v) if k in ("p", "v", "acc", "dec") else str(int(v))
+        return ""
+
+    def cmd_mt_move(self, arg):
+        num = int(arg)
+        if num not in self.motion_tasks or not self.is_active():
+            self.motion_error = True
+            return "Error: Invalid motion task."
+        self.update_motion()
+        self.motion = []
+        t = self.clock.monotonic()
+        pos = self.value("pl.fb")
+        while num is not None:
+            task = self.motion_tasks[num]
+            cntl = MTCntl(int(task["cntl"]))
+            target = task["p"] if (int(task["cntl"]) & 0b111) == 0 else pos + task["p"]
+            distance = abs(target - pos)
+            (v, acc, dec) = (max(task["v"], 1e-9), max(task["acc"], 1e-9), max(task["dec"], 1e-9))
+            # trapezoidal (or triangular) profile duration
+            d_ramps = v * v / 2 / acc + v * v / 2 / dec
+            if distance >= d_ramps:
+                duration = v / acc + v / dec + (distance - d_ramps) / v
+            else:
+                vpeak = math.sqrt(2 * distance * acc * dec / (acc + dec))
+                duration = vpeak / acc + vpeak / dec
+            self.motion.append((t, t + duration, pos, target, num))
+            t += duration
+            pos = target
+            if cntl & MTCntl.MTExecuteNext and len(self.motion) < 1000:
+                if int(task["cntl"]) & MTCntl.MTNextDwell.value:
+                    t += task["tnext"] / 1000
+                num = int(task["mtnext"])
+                if num not in self.motion_tasks:
+                    num = None
+            else:
+                num = None
+        return ""
+
+    def cmd_drv_stop(self, arg):
+        self.update_motion()
+        self.motion = None
+        return ""
+
+    def update_motion(self):
+        if not self.motion:
+            return
+        now = self.clock.monotonic()
+        for (start, end, p0, p1, num) in self.motion:
+            if start <= now < end:
+                self.params["pl.fb"] = "{:.3f}".format(p0 + (p1 - p0) * (now - start) / (end - start))
+                return
+        if now >= self.motion[-1][1]:
+            self.params["pl.fb"] = "{:.3f}".format(self.motion[-1][3])
+
+    def cmd_pl_fb(self, arg):
+        self.update_motion()
+        return "{} [{}]".format(self.params["pl.fb"], self.units["pl.fb"])
+
+    def cmd_drv_motionstat(self, arg):
+        self.update_motion()
+        ms = MotionStat(0)
+        if self.motion_error:
+            ms |= MotionStat.MTFault
+        if self.motion:
+            if self.clock.monotonic() < self.motion[-1][1] and self.is_active():
+                ms |= MotionStat.MotionActive
+            else:
+                ms |= MotionStat.MTCompleted | MotionStat.MTPositionReached
+        return str(ms.value)
+
+    # Recorder
+
+    def cmd_rec_trig(self, arg):
+        self.recorder = {
+            "start": self.clock.monotonic(),
+            "period": self.value("rec.gap") / 16000,
+            "channels": [self.params.get("rec.ch" + str(i), "clear") for i in range(1, 7)],
+            "retrieved": 0,
+            "trigger": None if self.params["rec.trigtype"] == "5" else self.clock.monotonic(),
+            "active": True,
+        }
+        self.recorder["channels"] = [c for c in self.recorder["channels"] if c.lower() != "clear"]
+        return ""
+
+    def cmd_rec_off(self, arg):
+        if self.recorder:
+            self.recorder["stop"] = self.clock.monotonic()
+            self.recorder["active"] = False
+        return ""
+
+    def recorder_trigger(self):
+        """ Return the trigger time of the recorder (or None), checking the trigger condition. """
+        r = self.recorder
+        if r["trigger"] is None and r["active"]:
+            param = self.params.get("rec.trigparam", "").lower()
+            current = int(self.answer(param) or 0) if param else 0
+            if (current & int(self.value("rec.trigmask"))) == int(self.value("rec.trigval")):
+                r["trigger"] = self.clock.monotonic()
+        return r["trigger"]
+
+    def recorder_window(self):
+        """ Return the (first, end) sample indexes available in the recorder. """
+        r = self.recorder
+        trigger = self.recorder_trigger()
+        numpoints = int(self.value("rec.numpoints"))
+        end_time = r.get("stop", self.clock.monotonic())
+        if trigger is None:
+            return (0, 0)
+        pre = int(numpoints * self.value("rec.trigpos") / 100)
+        end = int((end_time - trigger) / r["period"]) + pre
+        if self.params["rec.stoptype"] == "0":
+            end = min(end, numpoints)
+        return (max(0, end - numpoints), end)
+
+    def cmd_rec_done(self, arg):
+        if not self.recorder:
+            return "0"
+        (first, end) = self.recorder_window()
+        return "1" if self.params["rec.stoptype"] == "0" and end >= int(self.value("rec.numpoints")) else "0"
+
+    def cmd_rec_active(self, arg):
+        return "1" if self.recorder and self.recorder["active"] and self.cmd_rec_done("") == "0" else "0"
+
+    def cmd_rec_retrievehdr(self, arg):
+        channels = self.recorder["channels"] if self.recorder else []
+        return "Recording\n{},{}\n{}".format(self.params["rec.gap"], self.params["rec.numpoints"],
+                                              ",".join(channels))
+
+    def cmd_rec_retrievedata(self, arg):
+        if not self.recorder:
+            return "Recording"
+        r = self.recorder
+        (first, end) = self.recorder_window()
+        if arg:
+            r["retrieved"] = int(arg)
+        r["retrieved"] = max(r["retrieved"], first)
+        n = min(end - r["retrieved"], int(self.value("rec.retrievesize")))
+        lines = ["Recording"]
+        for i in range(r["retrieved"], r["retrieved"] + n):
+            lines.append(",".join(emulator_format_internal(self.value(c.lower()) + 0.001 * i)
+                                  for c in r["channels"]))
+        r["retrieved"] += n
+        return "\n".join(lines)
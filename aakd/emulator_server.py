@@ -0,0 +1,131 @@
+""" `AKDEmulator`s served on TCP ports, reachable like drives on the network (by `AKD`, `scan`, ...).
+
+Run with `python -m aakd.emulator_server [-n DRIVES] [--port FIRST]` to serve emulated drives on
+127.0.0.1, or with `--check` to check `scan.scan` and `scan.merge_drives` against emulated drives.
+"""
+
+import argparse
+import socketserver
+import threading
+
+from .clock import system_clock
+from .emulator import AKDEmulator
+from .scan import merge_drives, scan
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        emulator = self.server.emulator
+        received = b""
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            received += data
+            while b"\r\n" in received:
+                (line, received) = received.split(b"\r\n", 1)
+                with self.server.lock:
+                    try:
+                        emulator.write(line + b"\r\n")
+                    except UnicodeDecodeError:  # not a command (telnet negotiation)
+                        continue
+                    answer = emulator.read_very_eager()
+                self.request.sendall(answer)
+
+
+class EmulatorServer(socketserver.ThreadingTCPServer):
+    """ Serve `emulator` (an `AKDEmulator`, run on the system clock by default) at `host`:`port`
+    (0 for any free port, see `port`) in a background thread until `close`.
+    Connections share the emulated drive, like the telnet connections of a drive.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, emulator=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.emulator = emulator if emulator is not None else AKDEmulator(clock=system_clock)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+def serve(names, host="127.0.0.1", first_port=0):
+    """ Start an `EmulatorServer` per drive name, on consecutive ports from `first_port`
+    (free ports if 0). Return the servers.
+    """
+    return [EmulatorServer(AKDEmulator(name, clock=system_clock, latency=0), host,
+                           first_port + i if first_port else 0)
+            for (i, name) in enumerate(names)]
+
+
+def check():
+    """ Check `scan` and `merge_drives` with emulated drives: a drive which moved, drives with the
+    factory name and a drive named like another one still at its address. Raise on a failure.
+    """
+    servers = serve(["axis1", "axis2", "axis2", "AKD", "AKD"])
+    closed = EmulatorServer()  # a port without drive
+    closed.close()
+    try:
+        address = ["127.0.0.1:{}".format(s.port) for s in servers]
+        results = scan(["127.0.0.1"], [s.port for s in servers] + [closed.port], timeout=1)
+        found = {r.address: r for r in results}
+        assert sorted(found) == sorted(address), "found {}".format(results)
+        for (s, a) in zip(servers, address):
+            assert found[a].name == s.emulator.params["drv.name"], found[a]
+            assert (found[a].type, found[a].firmware) == ("AKD-P00306-NBEC-0000", "M_01-20-00-000"), found[a]
+
+        drives = {"axis1": {"ip": "10.0.0.1", "groups": ["line1"]}, "axis2": {"ip": address[1]}}
+        (merged, messages) = merge_drives(drives, results, groups=["lab"])
+        unique = ["{}_{}".format(name, a.replace('.', '_').replace(':', '_'))
+                  for (name, a) in zip(["axis2", "AKD"], [address[2], address[4]])]
+        assert sorted(merged) == sorted(["axis1", "axis2", "AKD"] + unique), merged
+        assert merged["axis1"] == {"ip": address[0], "groups": ["line1", "lab"],  # moved
+                                   "type": "AKD-P00306-NBEC-0000", "firmware": "M_01-20-00-000"}, merged
+        assert merged["axis2"]["ip"] == address[1], merged  # still at its address
+        assert merged[unique[0]]["ip"] == address[2], merged  # named like axis2
+        assert (merged["AKD"]["ip"], merged[unique[1]]["ip"]) == (address[3], address[4]), merged
+        assert "axis1 moved from 10.0.0.1 to {}".format(address[0]) in messages, messages
+        assert not any("not found" in m for m in messages), messages
+    finally:
+        for s in servers:
+            s.close()
+    for m in messages:
+        print(m)
+    print("scan and merge_drives OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve emulated AKD drives on TCP ports")
+    parser.add_argument('-n', '--drives', type=int, default=1, help="Number of drives")
+    parser.add_argument('--host', default="127.0.0.1", help="Address to listen on")
+    parser.add_argument('--port', type=int, default=2323, help="Port of the first drive, the next ones follow")
+    parser.add_argument('--check', action='store_true', help="Check scan and merge_drives instead")
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        return
+    servers = serve(["drive{}".format(i + 1) for i in range(args.drives)], args.host, args.port)
+    for s in servers:
+        print("{} at {}:{}".format(s.emulator.params["drv.name"], args.host, s.port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for s in servers:
+            s.close()
+
+
+if __name__ == "__main__":
+    main()
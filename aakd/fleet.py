@@ -0,0 +1,300 @@
+""" Execution of an operation on a fleet of drives.
+
+`FleetScheduler` runs one task per drive with bounded concurrency (global and per subnet),
+per task deadlines, retries of the connection and cancellation of the running tasks
+(through a `CancelToken` checked by `AKD` before each command).
+"""
+
+import ipaddress
+import sys
+import threading
+import time
+
+from .akd import dump_failure_trace
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelToken:
+    """ Cooperative cancellation, `AKD` checks it before sending each command.
+    A token is also cancelled when its parent is.
+    `deadline` (a `time.monotonic()` time) bounds the wait for each answer of `AKD`.
+    """
+
+    def __init__(self, parent=None, deadline=None):
+        self.parent = parent
+        self.event = threading.Event()
+        self.reason = None
+        self.deadline = deadline
+
+    def remaining(self):
+        """ Time left [s] before the deadline (of this token or its parents), None if there is none. """
+        remaining = None if self.deadline is None else self.deadline - time.monotonic()
+        if self.parent is not None:
+            r = self.parent.remaining()
+            if r is not None:
+                remaining = r if remaining is None else min(remaining, r)
+        return remaining
+
+    def cancel(self, reason="cancelled"):
+        if not self.event.is_set():
+            self.reason = reason
+            self.event.set()
+
+    def is_set(self):
+        return self.event.is_set() or (self.parent is not None and self.parent.is_set())
+
+    def expired(self):
+        """ Whether the deadline (of this token or its parents) is over. """
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self):
+        if self.is_set():
+            raise Cancelled(self.reason or self.parent.reason)
+        if self.expired():
+            raise Cancelled("deadline over")
+
+    def wait(self, timeout):
+        """ Sleep `timeout` [s] unless cancelled before, return whether it is cancelled. """
+        end = time.monotonic() + timeout
+        while not self.is_set():
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            self.event.wait(min(remaining, 0.1))
+        return self.is_set()
+
+
+def subnet_of(ip, prefix=24):
+    """ Return the subnet of `ip` (with an optional :port) as a string, or the hostname. """
+    host = ip.split(':')[0]
+    try:
+        return str(ipaddress.ip_network("{}/{}".format(host, prefix), strict=False))
+    except ValueError:
+        return host
+
+
+class ConnectionPool:
+    """ Keep the drive connections open to reuse them between operations.
+    `create(name, ip)` creates a new connection.
+    """
+
+    def __init__(self, create):
+        self.create = create
+        self.akds = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, ip, token=None):
+        with self.lock:
+            a = self.akds.pop(ip, None)
+        if a is None:
+            a = self.create(name, ip)
+            a.pool_ip = ip  # may include the port, unlike a.ip
+        a.cancel = token
+        return a
+
+    def release(self, a, ok=True):
+        """ Give back a connection, connections of failed operations are closed (state unknown). """
+        a.cancel = None
+        if not ok:
+            a.disconnect()
+            return
+        with self.lock:
+            ip = getattr(a, 'pool_ip', a.ip)
+            previous = self.akds.get(ip)
+            self.akds[ip] = a
+        if previous is not None and previous is not a:
+            previous.disconnect()
+
+    def close(self):
+        with self.lock:
+            (akds, self.akds) = (self.akds, {})
+        for a in akds.values():
+            a.disconnect()
+
+
+class FleetTask:
+    """ State of the operation on one drive. """
+
+    def __init__(self, index, name, ip, group):
+        self.index = index
+        self.name = name
+        self.ip = ip
+        self.group = group
+        self.state = "pending"  # pending, running, done, failed, cancelled
+        self.token = None
+        self.thread = None
+        self.attempts = 0
+        self.start = None
+        self.deadline = None
+        self.end = None
+        self.result = None
+        self.error = None
+
+
+class FleetScheduler:
+    """ Run an operation on many drives.
+
+    `max_workers` bounds the total number of drives handled at the same time (0 for no limit),
+    `per_group` the number per group (by default the /`subnet_prefix` subnet of the drive, see `group_of`).
+    `timeout` [s] is the deadline of each drive operation, after which it is cancelled.
+    Connections are retried `retries` times, waiting `backoff` [s] doubled at each attempt.
+    """
+
+    def __init__(self, max_workers=0, per_group=0, subnet_prefix=24, timeout=None, retries=2, backoff=0.5,
+                 stop_on_error=False, progress=False, group_of=None, out=sys.stderr):
+        self.max_workers = max_workers
+        self.per_group = per_group
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.stop_on_error = stop_on_error
+        self.progress = progress
+        self.group_of = group_of or (lambda name, ip: subnet_of(ip, subnet_prefix))
+        self.out = out
+        self.token = CancelToken()
+        self.lock = threading.Condition()
+        self.tasks = []
+
+    def cancel(self, reason="cancelled"):
+        self.token.cancel(reason)
+
+    def _connect(self, task, connect):
+        while True:
+            task.attempts += 1
+            try:
+                return connect(task.name, task.ip, task.token)
+            except Exception:
+                if task.attempts > self.retries or task.token.is_set():
+                    raise
+            if task.token.wait(self.backoff * 2 ** (task.attempts - 1)):
+                task.token.check()
+
+    def _worker(self, task, function, connect, release):
+        """ The final state is only set after `release`, the drive connection is closed or back in the pool
+        when the task is seen as ended (the drives accept only one connection).
+        """
+        a = None
+        (state, error, result) = ("failed", None, None)
+        try:
+            a = self._connect(task, connect)
+            result = function(a, task.name, task.ip, task.token)
+            state = "done"
+        except Cancelled as e:
+            (state, error) = ("cancelled", e)
+        except Exception as e:
+            (state, error) = ("cancelled" if task.token.is_set() else "failed", e)
+            dump_failure_trace(e)
+        finally:
+            try:
+                if a is not None:
+                    release(a, state == "done")
+            finally:
+                with self.lock:
+                    (task.state, task.error, task.result) = (state, error, result)
+                    task.end = time.monotonic()
+                    if task.state == "failed" and self.stop_on_error:
+                        self.cancel("stopped on error of " + task.name)
+                    self.lock.notify_all()
+
+    def _can_start(self, task, running):
+        if self.max_workers and len(running) >= self.max_workers:
+            return False
+        if self.per_group and sum(1 for t in running if t.group == task.group) >= self.per_group:
+            return False
+        return True
+
+    def _start(self, task, function, connect, release):
+        task.state = "running"
+        task.token = CancelToken(self.token)
+        task.start = time.monotonic()
+        if self.timeout:
+            task.deadline = task.start + self.timeout
+            task.token.deadline = task.deadline
+        task.thread = threading.Thread(target=self._worker, args=(task, function, connect, release), daemon=True)
+        task.thread.start()
+
+    def _display(self, start, final=False):
+        done = sum(1 for t in self.tasks if t.state in ("done", "failed", "cancelled"))
+        running = sum(1 for t in self.tasks if t.state == "running")
+        failed = sum(1 for t in self.tasks if t.state == "failed")
+        elapsed = time.monotonic() - start
+        print("\r[{}/{}] running: {} failed: {}  {:.1f} drives/s  {:.1f}s ".format(
+            done, len(self.tasks), running, failed, done / elapsed if elapsed else 0, elapsed),
+            end='\n' if final else '', file=self.out, flush=True)
+
+    def run(self, drives, function, connect, release=None, on_done=None):
+        """ Run `function(akd, name, ip, token)` for each (name, ip) of `drives`,
+        `connect(name, ip, token)` creating the akd object and `release(akd, ok)` called after
+        (disconnecting by default, see `ConnectionPool` to keep connections).
+        `on_done(task)` is called from the calling thread when a task ends.
+        Return the list of `FleetTask`, in the order of `drives`.
+        """
+        if release is None:
+            def release(a, ok):
+                a.disconnect()
+        self.tasks = [FleetTask(i, name, ip, self.group_of(name, ip)) for i, (name, ip) in enumerate(drives)]
+        start = time.monotonic()
+        last_display = 0
+        reported = set()
+
+        def report():
+            if on_done:
+                for t in self.tasks:
+                    if t.index not in reported and t.state not in ("pending", "running"):
+                        reported.add(t.index)
+                        on_done(t)
+
+        try:
+            with self.lock:
+                while True:
+                    report()
+                    now = time.monotonic()
+                    running = [t for t in self.tasks if t.state == "running"]
+                    for t in running:
+                        if t.deadline is not None and now > t.deadline:
+                            t.token.cancel("timeout after {}s".format(self.timeout))
+                    for t in self.tasks:
+                        if t.state != "pending":
+                            continue
+                        if self.token.is_set():
+                            t.state = "cancelled"
+                            t.error = Cancelled(self.token.reason)
+                        elif self._can_start(t, running):
+                            self._start(t, function, connect, release)
+                            running.append(t)
+                    if not running and all(t.state != "pending" for t in self.tasks):
+                        report()
+                        break
+                    if self.progress and now - last_display > 0.2:
+                        self._display(start)
+                        last_display = now
+                    self.lock.wait(0.1)
+        except KeyboardInterrupt:
+            print("Cancelling...", file=self.out)
+            self.cancel("interrupted")
+            for t in self.tasks:
+                if t.thread is not None:
+                    t.thread.join()
+                elif t.state == "pending":
+                    t.state = "cancelled"
+            report()
+        for t in self.tasks:
+            if t.thread is not None:
+                t.thread.join()
+        if self.progress:
+            self._display(start, final=True)
+        return self.tasks
+
+    def report_errors(self, nice_name):
+        """ Print the errors of the last run, in the drives order. Return whether there was any. """
+        errors = False
+        for t in self.tasks:
+            if t.error is not None:
+                errors = True
+                print(nice_name(t.name, t.ip), "<Error> ", t.state + ":" if t.state == "cancelled" else "",
+                      str(t.error), file=self.out)
+        return errors
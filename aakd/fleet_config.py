@@ -0,0 +1,136 @@
+""" Fleet configuration: the drives files and the parameter files.
+
+All the files are parsed once (with the C yaml loader when available), the parameters of every
+drive are resolved in one pass over the group tree, and the result is cached on disk,
+invalidated when the files change (mtime/size, then content hash).
+"""
+
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+from .inventory import Inventory
+
+
+CACHE_VERSION = 2
+
+def yaml_load(f):
+    import yaml  # Not imported at startup, a cached configuration doesn't need it
+    return yaml.load(f, Loader=getattr(yaml, 'CLoader', yaml.Loader))
+
+
+def cache_folder():
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "aakd"
+
+
+def deep_update_dict(d1, d2):
+    for k, v in d2.items():
+        if k in d1 and isinstance(d1[k], dict) and isinstance(v, dict):
+            deep_update_dict(d1[k], v)
+        else:
+            d1[k] = v
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _file_key(path):
+    st = os.stat(path)
+    return (str(path), st.st_mtime_ns, st.st_size)
+
+
+class FleetConfig:
+    """ The drives (`drives`: name -> description with 'ip' and 'groups'), their `inventory`
+    and their resolved parameters (`params`: name -> {parameter: value}).
+    """
+
+    def __init__(self, drives_files, params_files):
+        self.drives_files = [str(f) for f in drives_files]
+        self.params_files = [str(f) for f in params_files]
+        self.drives = {}
+        for drives_file in self.drives_files:
+            with open(drives_file) as f:
+                for (name, d) in (yaml_load(f) or {}).items():
+                    if name in self.drives:
+                        raise Exception("Drive {} is defined twice, see {}".format(name, drives_file))
+                    self.drives[name] = d
+        self.inventory = Inventory(self.drives)
+        self.groups = sorted(self.inventory.index["group"])
+        self.paramtree = {}
+        for param_file in self.params_files:
+            with open(param_file) as f:
+                new_params = yaml_load(f) or {}
+                if not set(new_params.keys()).issubset({'drives', 'groups'}):
+                    raise Exception("Paramter file top level keys should be drives or group, see " + param_file)
+                deep_update_dict(self.paramtree, new_params)
+        self.params = self.resolve_params()
+
+    def resolve_params(self):
+        """ Resolve the parameters of all the drives in one walk of the group tree. """
+        params = {name: {'DRV.NAME': name} for name in self.drives}
+        members = {}
+        for (name, d) in self.drives.items():
+            for g in d.get("groups", []):
+                members.setdefault(g, set()).add(name)
+
+        def apply_group_parameters(subtree, names):
+            for p, v in subtree.get("parameters", {}).items():
+                for n in names:
+                    params[n][p] = v
+            for (group, subsubtree) in subtree.items():
+                if group in members and isinstance(subsubtree, dict):
+                    selected = names & members[group]
+                    if selected:
+                        apply_group_parameters(subsubtree, selected)
+        apply_group_parameters(self.paramtree.get("groups", {}), set(self.drives))
+
+        for (name, drive_params) in self.paramtree.get("drives", {}).items():
+            if name in params:
+                params[name].update(drive_params)
+        return params
+
+    def drive_params(self, name):
+        if name not in self.drives:
+            raise Exception("Name {} is not in the drive file".format(name))
+        return self.params[name]
+
+    def ip(self, name):
+        return self.drives[name]['ip']
+
+    @classmethod
+    def load(cls, drives_files, params_files=(), use_cache=True):
+        """ Load the configuration, from the on disk cache if the files didn't change. """
+        files = [str(Path(f).resolve()) for f in list(drives_files) + list(params_files)]
+        if not use_cache:
+            return cls(drives_files, params_files)
+        keys = [_file_key(f) for f in files]
+        cache_file = cache_folder() / ("fleet-" + hashlib.sha1("\n".join(files).encode()).hexdigest() + ".pickle")
+        try:
+            with open(cache_file, 'rb') as f:
+                (version, cached_keys, hashes, config) = pickle.load(f)
+            if version == CACHE_VERSION and len(cached_keys) == len(keys):
+                if cached_keys == keys:
+                    return config
+                # touched files, check the content
+                if all(_file_hash(f) == h for (f, h) in zip(files, hashes)):
+                    cls._save_cache(cache_file, keys, hashes, config)
+                    return config
+        except Exception:
+            pass  # No or bad cache
+        config = cls(drives_files, params_files)
+        cls._save_cache(cache_file, keys, [_file_hash(f) for f in files], config)
+        return config
+
+    @staticmethod
+    def _save_cache(cache_file, keys, hashes, config):
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cache_file.with_suffix(".tmp" + str(os.getpid()))
+            with open(tmp, 'wb') as f:
+                pickle.dump((CACHE_VERSION, keys, hashes, config), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, cache_file)
+        except OSError:
+            pass  # The cache is only an optimization
@@ -0,0 +1,178 @@
+""" Command rate governor: a budget of commands per second per drive, shared by priority classes.
+
+Polling a drive too fast disrupts its IO handling (see `record_on_fault`), and recording, setpoints,
+monitoring and ad-hoc commands on the same drive add up. A `CommandGovernor` given to an `AKD` makes
+every command take a token from a bucket refilled at `rate` [commands/s] (up to `burst` tokens).
+
+The governor also serializes the round trips on the connection: a thread sending a command holds the
+connection until all its commands are answered (a pipelined batch is one round trip), so several threads
+can share the `AKD`. The waiting thread of the highest priority class gets the connection next:
+SAFETY > SETPOINT > RECORDER > TELEMETRY > ADHOC. Safety commands still wait for the round trip in
+progress, but never for a token.
+
+The class of a command is the highest of its own (see `command_priority`) and the one of the
+context (`AKD.priority`).
+"""
+
+import heapq
+import itertools
+import threading
+
+from .clock import system_clock
+
+
+SAFETY, SETPOINT, RECORDER, TELEMETRY, ADHOC = range(5)
+PRIORITY_NAMES = ("safety", "setpoint", "recorder", "telemetry", "adhoc")
+
+SAFETY_COMMANDS = {"drv.dis", "drv.stop", "drv.clrfaults", "drv.faults", "drv.warnings", "ds402.statusword",
+                   *("drv.fault" + str(i) for i in range(1, 11)),
+                   *("drv.warning" + str(i) for i in range(1, 11))}
+
+
+def command_priority(cmd):
+    """ Priority class of a command by itself. """
+    name = cmd.split(None, 1)[0].lower() if cmd.strip() else ""
+    if name in SAFETY_COMMANDS:
+        return SAFETY
+    if name.startswith("rec."):
+        return RECORDER
+    return ADHOC
+
+
+class _ClassStats:
+
+    def __init__(self):
+        self.commands = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait = 0.0
+        self.max_wait = 0.0
+        self.answers = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+
+class CommandGovernor:
+    """ Token bucket of `rate` [commands/s] and `burst` tokens (`rate` / 10 by default, at least 1),
+    with the connection turns, priority queue and metrics described in the module documentation.
+    Thread safe, one per drive connection.
+    """
+
+    def __init__(self, rate, burst=None, clock=system_clock):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate / 10, 1)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock.monotonic()
+        self.cond = threading.Condition()
+        self.queue = []  # heap of (priority, sequence) of the waiting commands
+        self.sequence = itertools.count()
+        self.owner = None  # thread holding the connection
+        self.in_flight = 0  # commands of the owner not answered yet
+        self.classes = [_ClassStats() for p in PRIORITY_NAMES]
+
+    def refill(self):
+        now = self.clock.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.burst)
+        self.updated = now
+
+    def acquire(self, priority):
+        """ Wait for the connection and a token for a command of class `priority`, return the time
+        waited [s]. The connection is held until `release` is called for each acquired command.
+        """
+        start = self.clock.monotonic()
+        stats = self.classes[priority]
+        me = threading.get_ident()
+        with self.cond:
+            stats.commands += 1
+            entry = (priority, next(self.sequence))
+            queued = self.owner != me  # otherwise pipelined after the other commands of the thread
+            if queued:
+                heapq.heappush(self.queue, entry)
+                stats.waiting += 1
+                stats.max_waiting = max(stats.max_waiting, stats.waiting)
+            try:
+                while True:
+                    if self.owner != me and (self.owner is not None or self.queue[0] != entry):
+                        self.cond.wait()
+                        continue
+                    self.refill()
+                    if priority == SAFETY or self.tokens >= 1:
+                        self.tokens -= 1
+                        if self.owner != me:
+                            heapq.heappop(self.queue)
+                            self.owner = me
+                        self.in_flight += 1
+                        break
+                    delay = (1 - self.tokens) / self.rate
+                    self.cond.release()  # a command of higher priority can come first meanwhile
+                    try:
+                        self.clock.sleep(delay)
+                    finally:
+                        self.cond.acquire()
+            except BaseException:
+                if entry in self.queue:
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                    self.cond.notify_all()
+                raise
+            finally:
+                if queued:
+                    stats.waiting -= 1
+            waited = self.clock.monotonic() - start
+            stats.wait += waited
+            stats.max_wait = max(stats.max_wait, waited)
+            return waited
+
+    def release(self):
+        """ A command of the calling thread was answered (or failed), the connection goes to the next
+        waiting command once all of them are.
+        """
+        with self.cond:
+            if self.owner != threading.get_ident():
+                return
+            self.in_flight -= 1
+            if self.in_flight <= 0:
+                self._free()
+
+    def abandon(self):
+        """ The connection was closed, the answers the calling thread waits for will never come. """
+        with self.cond:
+            if self.owner == threading.get_ident():
+                self._free()
+
+    def _free(self):
+        self.owner = None
+        self.in_flight = 0
+        self.cond.notify_all()
+
+    def answered(self, priority, latency):
+        """ Account the round trip `latency` [s] of an answered command. """
+        with self.cond:
+            stats = self.classes[priority]
+            stats.answers += 1
+            stats.latency += latency
+            stats.max_latency = max(stats.max_latency, latency)
+
+    def queue_depth(self):
+        with self.cond:
+            return len(self.queue)
+
+    def stats(self):
+        """ {class name: metrics} of the classes which sent commands. Waits and latencies in [s]. """
+        with self.cond:
+            return {name: {"commands": s.commands,
+                           "waiting": s.waiting,
+                           "max_waiting": s.max_waiting,
+                           "mean_wait": s.wait / s.commands,
+                           "max_wait": s.max_wait,
+                           "mean_latency": s.latency / s.answers if s.answers else 0.0,
+                           "max_latency": s.max_latency}
+                    for (name, s) in zip(PRIORITY_NAMES, self.classes) if s.commands}
+
+    def summary(self):
+        return "\n".join(
+            "{:<10} {:>8} commands, wait mean {:.1f}ms max {:.1f}ms, latency mean {:.1f}ms max {:.1f}ms, "
+            "max queued {}".format(name, s["commands"], s["mean_wait"] * 1000, s["max_wait"] * 1000,
+                                   s["mean_latency"] * 1000, s["max_latency"] * 1000, s["max_waiting"])
+            for (name, s) in self.stats().items())
@@ -0,0 +1,153 @@
+""" Indexed drive inventory and drive selector expressions.
+
+Selectors combine atoms with `and`, `or`, `not` (or `&`, `|`, `!`) and parentheses, eg:
+    arm and not akdn
+    (name:arm_* or type:AKD-N*) and subnet:10.0.1.0/24
+An atom is `[key:]pattern` with key one of name, group, ip, subnet, type, firmware,
+without key the pattern matches groups and names. Patterns are globs (`*`, `?`, `[...]`),
+subnet also accepts any network containing the drive ip (`subnet:10.0.0.0/16`).
+"""
+
+import fnmatch
+import ipaddress
+import re
+
+from .fleet import subnet_of
+
+
+INDEXED_ATTRIBUTES = ("name", "group", "ip", "subnet", "type", "firmware")
+
+_TOKEN = re.compile(r"\s*(\(|\)|&|\||!|[^\s()&|!]+)")
+
+
+class Inventory:
+    """ Indexes of the drives of a fleet configuration (name -> description with 'ip', 'groups'...). """
+
+    def __init__(self, drives):
+        self.order = {name: i for i, name in enumerate(drives)}
+        self.index = {a: {} for a in INDEXED_ATTRIBUTES}
+        for (name, d) in drives.items():
+            ip = str(d.get('ip', ''))
+            self._add("name", name, name)
+            self._add("ip", ip.split(':')[0], name)
+            self._add("subnet", subnet_of(ip), name)
+            for g in d.get("groups", []):
+                self._add("group", g, name)
+            for a in ("type", "firmware"):
+                if d.get(a) is not None:
+                    self._add(a, str(d[a]), name)
+
+    def _add(self, attribute, value, name):
+        self.index[attribute].setdefault(value, set()).add(name)
+
+    def all(self):
+        return set(self.order)
+
+    def sorted(self, names):
+        """ Return the names in the inventory order. """
+        return sorted(names, key=self.order.__getitem__)
+
+    def lookup(self, attribute, pattern):
+        """ Return the set of drives with `attribute` matching the glob `pattern`. """
+        if attribute not in self.index:
+            raise Exception("Unknown selector key {}, expecting one of {}".format(
+                attribute, ", ".join(INDEXED_ATTRIBUTES)))
+        index = self.index[attribute]
+        if pattern in index:
+            return set(index[pattern])
+        result = set()
+        if attribute == "subnet" and '/' in pattern:
+            try:
+                network = ipaddress.ip_network(pattern, strict=False)
+                for (ip, names) in self.index["ip"].items():
+                    try:
+                        if ipaddress.ip_address(ip) in network:
+                            result |= names
+                    except ValueError:
+                        pass  # hostname
+                return result
+            except ValueError:
+                pass  # Not a network, try as a glob
+        for (value, names) in index.items():
+            if fnmatch.fnmatchcase(value, pattern):
+                result |= names
+        return result
+
+    def groups(self, groups):
+        """ Drives in all the `groups`. """
+        result = self.all()
+        for g in groups:
+            result &= self.index["group"].get(g, set())
+        return result
+
+    def select(self, expression):
+        """ Return the list of drives (in inventory order) matching the selector `expression`. """
+        return self.sorted(SelectorParser(self, expression).parse())
+
+
+class SelectorParser:
+    """ Recursive descent parser evaluating a selector with set operations. """
+
+    def __init__(self, inventory, expression):
+        self.inventory = inventory
+        self.expression = expression
+        self.tokens = _TOKEN.findall(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position].lower() if self.position < len(self.tokens) else None
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def error(self, msg):
+        return Exception("Invalid selector {}: {}".format(repr(self.expression), msg))
+
+    def parse(self):
+        if not self.tokens:
+            raise self.error("empty")
+        result = self.parse_or()
+        if self.peek() is not None:
+            raise self.error("unexpected " + repr(self.peek()))
+        return result
+
+    def parse_or(self):
+        result = self.parse_and()
+        while self.peek() in ("or", "|"):
+            self.next()
+            result = result | self.parse_and()
+        return result
+
+    def parse_and(self):
+        result = self.parse_not()
+        while self.peek() in ("and", "&"):
+            self.next()
+            result = result & self.parse_not()
+        return result
+
+    def parse_not(self):
+        if self.peek() in ("not", "!"):
+            self.next()
+            return self.inventory.all() - self.parse_not()
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.peek()
+        if token is None:
+            raise self.error("unexpected end")
+        if token == "(":
+            self.next()
+            result = self.parse_or()
+            if self.peek() != ")":
+                raise self.error("missing )")
+            self.next()
+            return result
+        if token in (")", "and", "or", "&", "|"):
+            raise self.error("unexpected " + repr(token))
+        atom = self.next()
+        if ':' in atom:
+            (key, pattern) = atom.split(':', 1)
+            return self.inventory.lookup(key.lower(), pattern)
+        return self.inventory.lookup("group", atom) | self.inventory.lookup("name", atom)
@@ -0,0 +1,257 @@
+""" Motion programs: tables of chained motion tasks described in YAML and uploaded to the drives.
+
+A program file looks like:
+
+    tasks:
+      1:
+        position: 90          # MT.P
+        velocity: 10          # MT.V
+        accel: 100            # MT.ACC
+        decel: 100            # MT.DEC
+        type: relative        # absolute (default), relative, relative_prev, relative_external, relative_feedback
+        next: 2               # chained task (MT.MTNEXT), none by default
+        dwell: 500            # [ms] before starting the next task (MT.TNEXT)
+      2:
+        position: 0
+        velocity: 10
+        accel: 100
+        decel: 100
+        profile: table        # trapezoidal (default), one_one or table (customer profile table)
+        table: 0              # MT.TNUM of the profile table
+
+The program is validated on the host, then the drives are read back and only the tasks which differ
+are written, their fields pipelined (see `AKD.command_batch`).
+"""
+
+from .akd_flags import MTCntl
+from .restore import same_value
+
+
+MT_TYPES = {
+    "absolute": MTCntl.MTTypeAbsolute,
+    "relative": MTCntl.MTTypeRelative,
+    "relative_prev": MTCntl.MTTypeRelativePrev,
+    "relative_external": MTCntl.MTTypeRelativeExternal,
+    "relative_feedback": MTCntl.MTTypeRelativeFeedback,
+}
+
+MT_PROFILES = {
+    "trapezoidal": MTCntl.MTAccelTrapezoidal,
+    "one_one": MTCntl.MTAccelOneOneProfile,
+    "table": MTCntl.MTAccelProfile,
+}
+
+MT_NEXT_MODES = {
+    "default": MTCntl.MTNextDefault,
+    "dwell": MTCntl.MTNextDwell,
+    "external": MTCntl.MTNextExternal,
+    "dwell_external": MTCntl.MTNextDwellExternal,
+    "dwell_or_external": MTCntl.MTNextDwellOrExternal,
+    "merge_speed": MTCntl.MTNextMergeSpeed,
+    "merge_accel": MTCntl.MTNextMergeAccel,
+}
+
+MT_NUM_MAX = 127
+MT_TABLE_MAX = 7
+
+_TASK_KEYS = ("position", "velocity", "accel", "decel", "type", "profile", "table", "next", "next_mode", "dwell")
+
+
+class MotionTask:
+    """ A motion task, see the module documentation for the meaning of the arguments. """
+
+    def __init__(self, num, position, velocity, accel, decel, type="absolute", profile="trapezoidal", table=None,
+                 next=None, next_mode=None, dwell=0):
+        self.num = num
+        self.position = position
+        self.velocity = velocity
+        self.accel = accel
+        self.decel = decel
+        self.type = type
+        self.profile = profile
+        self.table = table
+        self.next = next
+        self.next_mode = next_mode if next_mode is not None else ("dwell" if dwell else "default")
+        self.dwell = dwell
+
+    @classmethod
+    def from_dict(cls, num, d):
+        unknown = set(d) - set(_TASK_KEYS)
+        if unknown:
+            raise Exception("Motion task {}: unknown keys {}".format(num, ", ".join(sorted(unknown))))
+        missing = [k for k in ("position", "velocity", "accel", "decel") if k not in d]
+        if missing:
+            raise Exception("Motion task {}: missing {}".format(num, ", ".join(missing)))
+        return cls(num, **d)
+
+    def errors(self):
+        """ List of what is wrong with the task (empty when valid). """
+        e = []
+        if not isinstance(self.num, int) or not 0 <= self.num <= MT_NUM_MAX:
+            e.append("number must be an integer in 0..{}".format(MT_NUM_MAX))
+        for k in ("position", "velocity", "accel", "decel", "dwell"):
+            if not isinstance(getattr(self, k), (int, float)):
+                e.append("{} must be a number".format(k))
+        for k in ("velocity", "accel", "decel"):
+            if isinstance(getattr(self, k), (int, float)) and getattr(self, k) <= 0:
+                e.append("{} must be positive".format(k))
+        if isinstance(self.dwell, (int, float)) and self.dwell < 0:
+            e.append("dwell must not be negative")
+        if self.type not in MT_TYPES:
+            e.append("type must be one of " + ", ".join(MT_TYPES))
+        if self.profile not in MT_PROFILES:
+            e.append("profile must be one of " + ", ".join(MT_PROFILES))
+        if self.next_mode not in MT_NEXT_MODES:
+            e.append("next_mode must be one of " + ", ".join(MT_NEXT_MODES))
+        if self.profile == "table":
+            if not isinstance(self.table, int) or not 0 <= self.table <= MT_TABLE_MAX:
+                e.append("a table profile needs a table number in 0..{}".format(MT_TABLE_MAX))
+        elif self.table is not None:
+            e.append("table is only used with the table profile")
+        if self.next is None and (self.dwell or self.next_mode != "default"):
+            e.append("dwell and next_mode need a next task")
+        return e
+
+    def cntl(self):
+        mtcntl = MT_PROFILES[self.profile] | MT_TYPES[self.type]
+        if self.next is not None:
+            mtcntl |= MTCntl.MTExecuteNext | MT_NEXT_MODES[self.next_mode]
+        return mtcntl.value
+
+    def fields(self):
+        """ [(parameter, value)] of the task as set on the drive. """
+        f = [("mt.p", self.position), ("mt.v", self.velocity), ("mt.acc", self.accel), ("mt.dec", self.decel)]
+        if self.table is not None:
+            f.append(("mt.tnum", self.table))
+        if self.next is not None:
+            f.append(("mt.mtnext", self.next))
+            if self.dwell:
+                f.append(("mt.tnext", self.dwell))
+        f.append(("mt.cntl", self.cntl()))
+        return f
+
+    def commands(self):
+        """ The commands selecting the task and writing its fields, `mt.set` then commits it. """
+        # floats are rejected when they have more than 3 digits (see `AKD.cset`)
+        return (["mt.num {}".format(self.num)]
+                + ["{} {:.3f}".format(p, v) if isinstance(v, float) else "{} {}".format(p, v)
+                   for (p, v) in self.fields()])
+
+    def write(self, a, window=None):
+        """ Define the task on the drive `a`. The fields are written pipelined and the task is only
+        committed once all of them were accepted, a rejected field raises before `mt.set`.
+        """
+        a.command_batch(self.commands(), window=window)
+        a.command("mt.set")
+
+    def readback_commands(self):
+        return ["mt.load {}".format(self.num)] + [p for (p, v) in self.fields()]
+
+    def matches(self, answers):
+        """ Whether the answers of `readback_commands` match the task. """
+        if any(isinstance(a, Exception) for a in answers):
+            return False  # eg the task is not defined
+        return all(same_value(str(v), a.decode('latin-1')) for ((p, v), a) in zip(self.fields(), answers[1:]))
+
+
+class MotionProgram:
+    """ A table of motion tasks {number: `MotionTask`}. """
+
+    def __init__(self, tasks):
+        self.tasks = dict(sorted(tasks.items()))
+
+    @classmethod
+    def from_dict(cls, d):
+        if not isinstance(d, dict) or not isinstance(d.get('tasks'), dict):
+            raise Exception("A motion program needs a `tasks` mapping of task number to task")
+        program = cls({num: MotionTask.from_dict(num, t or {}) for (num, t) in d['tasks'].items()})
+        program.validate()
+        return program
+
+    @classmethod
+    def load(cls, filename):
+        from .fleet_config import yaml_load
+        with open(filename) as f:
+            try:
+                return cls.from_dict(yaml_load(f))
+            except Exception as e:
+                raise Exception("Invalid motion program {}: {}".format(filename, e))
+
+    def validate(self):
+        errors = []
+        for t in self.tasks.values():
+            errors += ["task {}: {}".format(t.num, e) for e in t.errors()]
+            if t.next is not None and t.next not in self.tasks:
+                errors.append("task {}: next task {} is not in the program".format(t.num, t.next))
+        if errors:
+            raise Exception("\n  " + "\n  ".join(errors))
+
+    def differing_tasks(self, a, window=32):
+        """ The tasks of the program which are not defined the same on the drive `a`.
+        All the tasks are read back in a single pipelined batch.
+        """
+        tasks = list(self.tasks.values())
+        answers = a.command_batch([c for t in tasks for c in t.readback_commands()],
+                                  return_exceptions=True, window=window)
+        differing = []
+        for t in tasks:
+            n = len(t.readback_commands())
+            (task_answers, answers) = (answers[:n], answers[n:])
+            if not t.matches(task_answers):
+                differing.append(t)
+        return differing
+
+    def upload(self, a, force=False, window=32):
+        """ Write the tasks of the program which differ on the drive `a` (all of them if `force`).
+        Return the list of the written task numbers.
+        """
+        tasks = list(self.tasks.values()) if force else self.differing_tasks(a, window)
+        for t in tasks:
+            t.write(a, window)
+        return [t.num for t in tasks]
+
+
+def velocity_profile_program(vtt, first_task=100, accel=1000, position_scale=1, repeat=False):
+    """ Compile the velocity time table `vtt` (like `record_velocity_profile`: [(end_time, velocity)])
+    into chained motion tasks numbered from `first_task`, so that the drive runs the profile itself.
+
+    Each segment is a move relative to the previous target of velocity * duration * `position_scale`
+    (position units per velocity unit and second, eg 360 for `AKD.set_std_units`), blended into the next
+    one at speed. Zero velocity segments are dwells. `accel` is the acceleration (and deceleration)
+    of the ramps between segments, which shift the profile by about velocity / accel.
+    With `repeat`, the last task chains back to the first. Otherwise a final dwell is dropped,
+    the drive stays at rest after the last task anyway.
+    """
+    tasks = {}
+    num = first_task
+    previous = None  # the task before the current segment
+    start = 0
+    for (end_time, velocity) in vtt:
+        duration = end_time - start
+        start = end_time
+        if duration <= 0:
+            continue
+        if velocity == 0:
+            if previous is None:  # starts with a dwell, needs a null move to dwell after
+                previous = MotionTask(num, 0, 1, accel, accel, type="relative_prev")
+                tasks[num] = previous
+                num += 1
+            previous.dwell += int(round(duration * 1000))
+            continue
+        task = MotionTask(num, velocity * duration * position_scale, abs(velocity), accel, accel,
+                          type="relative_prev")
+        if previous is not None:
+            previous.next = num
+        tasks[num] = task
+        previous = task
+        num += 1
+    for t in tasks.values():
+        if t.next is None and repeat:
+            t.next = first_task
+        if t.next is None:
+            t.dwell = 0
+        if t.next is not None:
+            t.next_mode = "dwell" if t.dwell else "merge_speed"
+    program = MotionProgram(tasks)
+    program.validate()
+    return program
@@ -0,0 +1,158 @@
+""" Calibration of the highest recording rate a drive link sustains without losing samples.
+
+The recorder of the drive samples at 16kHz / rec.gap into a ring buffer of rec.numpoints, the host
+must retrieve (and decode) the samples faster than they are produced or the oldest ones are overwritten.
+`calibrate` measures the retrieval throughput (link and decoding) for a set of channels and
+rec.retrievesize, then checks the fastest gap expected to keep up, slowing down until no sample is lost.
+The results are kept per drive in the user cache folder (see `load_calibration`).
+"""
+
+import json
+import os
+import time
+
+from .akd import akd_parse_internal
+from .fleet_config import cache_folder
+
+
+BASE_FREQUENCY = 16000
+# gaps with an integer frequency, as required by `record`
+GAPS = [g for g in range(1, 201) if BASE_FREQUENCY % g == 0]
+
+
+def calibration_file():
+    return cache_folder() / "rate-calibration.json"
+
+
+def calibration_key(channels, retrievesize):
+    return "{}@{}".format(",".join(c.lower() for c in channels), retrievesize)
+
+
+class Calibration:
+    """ Result of a calibration: `gap` and `frequency` the fastest rate without loss (None if none),
+    `throughput` [samples/s] when retrieving continuously, `link_time` and `decode_time` [s] per
+    retrieval, `trials` [(gap, produced, received)] of the verification runs.
+    """
+
+    def __init__(self, channels, retrievesize):
+        self.channels = list(channels)
+        self.retrievesize = retrievesize
+        self.gap = None
+        self.frequency = None
+        self.throughput = None
+        self.link_time = None
+        self.decode_time = None
+        self.trials = []
+        self.date = time.time()
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, d):
+        c = cls(d["channels"], d["retrievesize"])
+        c.__dict__.update(d)
+        return c
+
+    def summary(self):
+        if self.gap is None:
+            return "no rate without sample loss found"
+        return "gap {} ({:g}Hz), throughput {:.0f} samples/s, link {:.1f}ms and decoding {:.1f}ms per retrieval".format(
+            self.gap, self.frequency, self.throughput, self.link_time * 1000, self.decode_time * 1000)
+
+
+def _retrieve(a, timings):
+    """ Retrieve and decode the available samples, return their number. """
+    start = a.clock.monotonic()
+    lines = a.command("rec.retrievedata").splitlines()[1:]
+    decode = a.clock.monotonic()
+    for l in lines:
+        [akd_parse_internal(v) for v in l.split(b',')]
+    timings.append((decode - start, a.clock.monotonic() - decode, len(lines)))
+    return len(lines)
+
+
+def _run(a, gap, channels, retrievesize, duration):
+    """ Record continuously at `gap` for `duration`, return (produced, received, timings)
+    with the timings of the retrievals while recording only.
+    """
+    a.rec_setup(BASE_FREQUENCY / gap, channels, retrievesize=retrievesize)
+    timings = []
+    a.rec_start()
+    start = a.clock.monotonic()
+    received = 0
+    while a.clock.monotonic() - start < duration:
+        received += _retrieve(a, timings)
+    a.command("rec.off")
+    produced = int((a.clock.monotonic() - start) * BASE_FREQUENCY / gap)
+    while True:
+        n = _retrieve(a, [])
+        if not n:
+            break
+        received += n
+    return (produced, received, timings)
+
+
+def keeps_up(produced, received, timings, retrievesize, gap):
+    """ Whether a run lost no sample and the host was not still behind at its end
+    (retrievals returning full chunks), which would lose samples once the drive buffer is full.
+    """
+    # the produced count is only known to a few samples (link latency)
+    lost = produced - received > 0.01 * produced + 0.005 * BASE_FREQUENCY / gap
+    tail = timings[len(timings) // 2:]
+    behind = bool(tail) and all(t[2] >= retrievesize for t in tail)
+    return not lost and not behind
+
+
+def calibrate(a, channels, retrievesize=4800, duration=2.0, margin=0.8):
+    """ Calibrate the recording rate of the drive `a` for `channels`, return a `Calibration`.
+    The throughput is measured at the fastest gap, from the retrievals of full chunks (the host is behind),
+    then the verification starts at the fastest gap producing less than `margin` of it,
+    each run lasts `duration` [s].
+    """
+    c = Calibration(channels, retrievesize)
+    (produced, received, timings) = _run(a, GAPS[0], channels, retrievesize, duration / 2)
+    full = [t for t in timings if t[2] >= retrievesize]
+    measured = full or [t for t in timings if t[2]] or timings
+    c.link_time = sum(t[0] for t in measured) / len(measured)
+    c.decode_time = sum(t[1] for t in measured) / len(measured)
+    c.throughput = sum(t[2] for t in measured) / max(sum(t[0] + t[1] for t in measured), 1e-9)
+
+    if keeps_up(produced, received, timings, retrievesize, GAPS[0]):
+        candidates = GAPS
+    else:
+        candidates = [g for g in GAPS if BASE_FREQUENCY / g <= c.throughput * margin]
+    for gap in candidates:
+        (produced, received, timings) = _run(a, gap, channels, retrievesize, duration)
+        c.trials.append((gap, produced, received))
+        if keeps_up(produced, received, timings, retrievesize, gap):
+            c.gap = gap
+            c.frequency = BASE_FREQUENCY / gap
+            break
+    return c
+
+
+def load_calibrations():
+    try:
+        with open(calibration_file()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_calibration(drive_name, channels, retrievesize=4800):
+    """ The stored `Calibration` of the drive for these channels, or None. """
+    d = load_calibrations().get(drive_name, {}).get(calibration_key(channels, retrievesize))
+    return Calibration.from_dict(d) if d else None
+
+
+def save_calibration(drive_name, calibration):
+    calibrations = load_calibrations()
+    calibrations.setdefault(drive_name, {})[
+        calibration_key(calibration.channels, calibration.retrievesize)] = calibration.to_dict()
+    filename = calibration_file()
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    tmp = filename.with_suffix(".tmp" + str(os.getpid()))
+    with open(tmp, 'w') as f:
+        json.dump(calibrations, f, indent=1)
+    os.replace(tmp, filename)
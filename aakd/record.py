@@ -1,25 +1,57 @@
 
 import collections
 import threading
-import time
 
-from datetime import datetime
+from .akd import REC_MAX_NUMPOINTS, ConnectionLost, dump_failure_trace
+from .governor import SETPOINT
+from .setpoints import SetpointProfile, SetpointStreamer
 
 
 def record(akds, files, frequency, to_records, internal_trigger_akd_index=-1,
-           interact_callback=lambda akd: False):
+           interact_callback=lambda akd: False, clock=None, retrievesize=4800, transforms=None,
+           timeout=2, reconnect_timeout=60):
+    """ Record `to_records` (list of channels per drive) of the drives `akds` to the (csv) `files`.
+    `transforms` is an optional list of `transforms.Transform` (or None) per drive, applied to the data
+    before writing.
+    A drive not answering a retrieval in `timeout` [s] is reconnected (for up to `reconnect_timeout` [s],
+    None to fail instead) and its recording resumed, see `AKD.rec_resume`. So is a recording whose drive
+    was reconnected by a command of `interact_callback`.
+    """
+    if transforms is None:
+        transforms = [None] * len(akds)
+    if clock is None:
+        clock = akds[0].clock
     buffers = [collections.deque() for a in akds]
 
     for a, t in zip(akds, to_records):
-        a.rec_setup(frequency, t)
+        a.rec_setup(frequency, t, retrievesize=retrievesize)
 
     def worker(a, b, c):
         try:
             a.rec_start()
             b.append([a.rec_header()])
-            while not c(a):
-                a.rec_get(b)
+            while True:
+                reconnections = a.reconnections
+                try:
+                    if c(a):
+                        break
+                    if a.reconnections != reconnections:  # a command of the callback reconnected
+                        a.rec_resume(b)
+                    else:
+                        a.rec_get(b, timeout=timeout)
+                except ConnectionLost as e:
+                    if reconnect_timeout is None:
+                        raise
+                    print("{}, reconnecting".format(e))
+                    a.reconnect(reconnect_timeout)
+                    a.rec_resume(b)
+                    print("{} reconnected".format(a.nice_name()))
+        except Exception as e:
+            dump_failure_trace(e)
+            raise
         finally:
+            for (t, lost) in getattr(a, 'rec_gaps', []):
+                print("{} recording lost {} samples at {:.3f}s".format(a.nice_name(), lost, t))
             try:
                 a.rec_stop(b)
             except:
@@ -52,11 +84,13 @@ def record(akds, files, frequency, to_records, internal_trigger_akd_index=-1,
     for t in threads:
         t.start()
 
-    def empty_buffers():
-        for b, f in zip(buffers, files):
-            topop = len(b)
-            for _ in range(topop):
-                print(','.join(str(v) for v in b.popleft()), file=f)
+    def empty_buffers(last=False):
+        for b, f, tr in zip(buffers, files, transforms):
+            rows = [b.popleft() for _ in range(len(b))]
+            if tr is not None:
+                rows = tr.process(rows) + (tr.flush() if last else [])
+            for r in rows:
+                print(','.join(str(v) for v in r), file=f)
             f.flush()
 
     while not stop:
@@ -64,7 +98,7 @@ def record(akds, files, frequency, to_records, internal_trigger_akd_index=-1,
             empty_buffers()
             for t in threads:
                 stop = stop or not t.is_alive()
-            time.sleep(0.01)
+            clock.sleep(0.01)
         except KeyboardInterrupt:
             print("Stopping the recording")
             stop = True
@@ -75,14 +109,29 @@ def record(akds, files, frequency, to_records, internal_trigger_akd_index=-1,
             stop = True
             print("possible bad file")
             raise
+    # the data retrieved after the last write, and the last incomplete blocks
+    for t in threads:
+        t.join()
+    empty_buffers(last=True)
 
 
-def record_on_fault(a, frequency, duration, to_record, stop=lambda: False):
+def record_on_fault(a, frequency, duration, to_record, stop=lambda: False, pre_trigger=0.9):
+    """ Record `duration` [s] around the next fault of the drive, `pre_trigger` of it before the fault.
+    Captures longer than the recorder buffer (`REC_MAX_NUMPOINTS`) keep the recorder running after the
+    trigger and retrieve it while it records (see `rec_get_stitched`), their pre-trigger part is then
+    limited to half the buffer, which must be retrieved before being overwritten.
+    Return (fault, timestamp, data).
     """
-    """
-    numpoints = frequency * duration
+    numpoints = int(frequency * duration)
+    long_capture = numpoints > REC_MAX_NUMPOINTS
+    buffer_size = min(numpoints, REC_MAX_NUMPOINTS)
+    pre = int(numpoints * pre_trigger)
+    if long_capture:
+        pre = min(pre, REC_MAX_NUMPOINTS // 2)
     a.rec_setup(frequency, to_record, numpoints)
-    a.rec_setup_bitmask_trigger("DS402.STATUSWORD", 8, 8)
+    a.rec_setup_bitmask_trigger("DS402.STATUSWORD", 8, 8, trig_percent=int(100 * pre / buffer_size))
+    if long_capture:
+        a.cset("rec.stoptype", 1)  # keep recording once the buffer is full
     # wait for current state to be cleared of faults
     clear = 0
     while clear < 2 and not stop():
@@ -90,7 +139,7 @@ def record_on_fault(a, frequency, duration, to_record, stop=lambda: False):
             clear = 0
         else:
             clear = clear + 1
-        time.sleep(0.05)
+        a.clock.sleep(0.05)
     # start the trigger waiting for a fault
     a.rec_start()
     # wait for the trigger to be done
@@ -98,8 +147,17 @@ def record_on_fault(a, frequency, duration, to_record, stop=lambda: False):
     while not fault and not stop():
         fault = a.faults_short()
         # Polling too fast creates issues in the drive handling IO (esp DIN controlling brake release)
-        time.sleep(0.01)
-    timestamp = datetime.now()
+        if not fault:
+            a.clock.sleep(0.01)
+    seen = a.clock.monotonic()  # the recorder was triggered before
+    timestamp = a.clock.now()
+    if long_capture and fault:
+        # the index 0 is the start of the pre-trigger data, see below
+        (data, gaps) = rec_get_stitched(a, numpoints, seen, pre, buffer_size, stop)
+        a.command("rec.off")
+        for (index, lost) in gaps:
+            print("{} capture lost {} samples at {:.3f}s".format(a.nice_name(), lost, index * a.rec_time_incr))
+        return (fault, timestamp, data)
     while not a.commandI("rec.done"):
         if stop():
             a.command("rec.off")
@@ -112,58 +170,133 @@ def record_on_fault(a, frequency, duration, to_record, stop=lambda: False):
     return (fault, timestamp, data)
 
 
+def rec_get_stitched(a, count, seen_time, pre_trigger, buffer_size, stop=lambda: False):
+    """ Retrieve `count` samples of a recorder running continuously since its trigger, into one capture.
+
+    Each chunk is requested at the index following the previous one and checked (see `AKD.rec_get_from`):
+    the samples retrieved last must be served unchanged, and the index must not be behind the oldest
+    sample surely still in the ring buffer of `buffer_size`, estimated from the `pre_trigger` samples and
+    the time since `seen_time` (when the trigger was seen, it happened before). If the recorder overwrote
+    the next samples before they were retrieved, the capture ends there and the rest is a gap.
+    Return (data, gaps) with gaps a list of (index, number of lost samples).
+    """
+    data = []
+    gaps = []
+    a.rec_time = 0
+    a.rec_tail.clear()
+    while len(data) < count and not stop():
+        produced = pre_trigger + int((a.clock.monotonic() - seen_time) / a.rec_time_incr)
+        got = a.rec_get_from(data, len(data), oldest=produced - buffer_size)
+        if got is None:
+            gaps.append((len(data), count - len(data)))
+            break
+        if not got:
+            a.clock.sleep(0.005)  # faster than the recorder
+    del data[count:]
+    return (data, gaps)
+
 
 def current_profile_callback(a, prog_start_time, ctt):
     """ Apply the current time table `ctt` to the drive `a`.
     The table is supposed to be tuples (start_time, end_time, current)
     Like: [(0, 1, 5), (1, 2, -5)] to apply 5 Arms for 1 sec then -5 for another
     """
-    t = time.monotonic() - prog_start_time
+    t = a.clock.monotonic() - prog_start_time
     for (start_time, end_time, current) in ctt:
         if (start_time < t <= end_time):
-            a.cset("il.cmdu", current)
+            with a.priority(SETPOINT):
+                a.cset("il.cmdu", current)
             return False
     return True
 
 
-def record_current_profile(a, ctt, file, frequency=500,
-                           to_record=["IL.FB", "IL.CMD", "VL.FB"]):
+def record_setpoint_profile(a, parameter, profile, file, opmode, frequency=500, to_record=["IL.FB", "VL.FB"],
+                            repeat=False, final_value=0):
+    """ Stream the `SetpointProfile` `profile` to `parameter` (in service mode and `opmode`) while recording
+    to `file`. The timing of the setpoints is written to `file` + ".jitter.csv".
+    Return the `SetpointStreamer`.
+    """
     a.disable()
     a.cset("drv.cmdsource", 0)  # service mode
-    a.cset("drv.opmode", 0)  # torque mode
+    a.cset("drv.opmode", opmode)
     a.enable()
 
-    start_time = time.monotonic()
+    streamer = SetpointStreamer(parameter, profile, repeat=repeat, final_value=final_value)
+    try:
+        with open(file, mode='w') as f:
+            record([a], [f], frequency, [to_record], interact_callback=streamer)
+    finally:
+        streamer.write_jitter(str(file) + ".jitter.csv")
+    return streamer
 
-    def callback(a):
-        return current_profile_callback(a, start_time, ctt)
 
-    with open(file, mode='w') as f:
-        record([a], [f], frequency, [to_record], interact_callback=callback)
+def record_current_profile(a, ctt, file, frequency=500,
+                           to_record=["IL.FB", "IL.CMD", "VL.FB"], setpoint_rate=100):
+    """ Apply the current time table `ctt` to the drive `a` while recording (see `record_setpoint_profile`).
+    The table is supposed to be tuples (start_time, end_time, current)
+    Like: [(0, 1, 5), (1, 2, -5)] to apply 5 Arms for 1 sec then -5 for another.
+    The profile ends at the first time not covered by the table.
+    """
+    intervals = []
+    covered = 0
+    for (start_time, end_time, current) in sorted(ctt):
+        if start_time > covered:
+            break  # a gap
+        intervals.append((start_time, end_time, current))
+        covered = max(covered, end_time)
+    profile = SetpointProfile.from_intervals(intervals, setpoint_rate)
+    return record_setpoint_profile(a, "il.cmdu", profile, file, 0, frequency, to_record)  # torque mode
 
 
 def velocity_profile_callback(a, prog_start_time, vtt, repeat=False):
-    t = time.monotonic() - prog_start_time
+    t = a.clock.monotonic() - prog_start_time
     if repeat:
-        t = t % vtt[-1][1]
+        t = t % vtt[-1][0]
     for (end_time, velocity) in vtt:
         if t < end_time:
-            a.cset("vl.cmdu", velocity)
+            with a.priority(SETPOINT):
+                a.cset("vl.cmdu", velocity)
             return False
     return True
 
 
 def record_velocity_profile(a, vtt, file, frequency=500,
-                            to_record=["IL.FB", "VL.CMD", "VL.FB"], repeat=False):
+                            to_record=["IL.FB", "VL.CMD", "VL.FB"], repeat=False,
+                            drive_side=False, first_task=100, accel=1000, position_scale=1, setpoint_rate=100):
+    """ Apply the velocity time table `vtt` [(end_time, velocity)] to the drive `a` while recording.
+
+    By default the host streams vl.cmdu at `setpoint_rate` (see `record_setpoint_profile`), the profile
+    timing then depends on the host and the link. With `drive_side`, the table is compiled into chained
+    motion tasks (see `velocity_profile_program`, starting at task `first_task`, `accel` and
+    `position_scale`) which the drive runs in position mode, the host only records.
+    There is no drive side equivalent for current profiles (motion tasks are position mode only).
+    """
+    if not drive_side:
+        return record_setpoint_profile(a, "vl.cmdu", SetpointProfile.from_table(vtt, setpoint_rate), file, 1,
+                                       frequency, to_record, repeat=repeat)  # velocity mode
+
+    from .motion_program import velocity_profile_program
+    program = velocity_profile_program(vtt, first_task, accel, position_scale, repeat)
     a.disable()
-    a.cset("drv.cmdsource", 0)  # service mode
-    a.cset("drv.opmode", 1)  # velocity mode
+    program.upload(a)
+    a.service_mode()  # position mode
     a.enable()
 
-    start_time = time.monotonic()
+    # the ramps between segments delay the end of the profile
+    end_time = vtt[-1][0] + max(abs(v) for (t, v) in vtt) / accel * len(program.tasks)
+    start_time = None
 
     def callback(a):
-        return velocity_profile_callback(a, start_time, vtt, repeat=repeat)
+        nonlocal start_time
+        if start_time is None:  # the recording is started, start the profile
+            start_time = a.clock.monotonic()
+            with a.priority(SETPOINT):
+                a.cset("mt.move", first_task)
+            return False
+        return not repeat and a.clock.monotonic() - start_time > end_time
 
-    with open(file, mode='w') as f:
-        record([a], [f], frequency, [to_record], interact_callback=callback)
+    try:
+        with open(file, mode='w') as f:
+            record([a], [f], frequency, [to_record], interact_callback=callback)
+    finally:
+        a.command("drv.stop")
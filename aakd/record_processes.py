@@ -0,0 +1,132 @@
+""" Recording with worker processes, for high rates with many drives where decoding and writing
+in a single process is limited by the GIL.
+
+The drives are sharded across processes, each one connects to its drives and runs `record` on them,
+writing its files itself. The workers report the number of samples written per drive through shared
+memory, the coordinator prints the rates and stops the workers (Ctrl+c or `stop()`).
+"""
+
+import multiprocessing
+import signal
+import time
+
+from .record import record
+
+
+STARTING, RECORDING, DONE, FAILED = range(4)
+STATES = ("starting", "recording", "done", "failed")
+_FIELDS = 3  # per drive: state, samples, last update (time.time())
+
+
+class _CountingFile:
+    """ Count the lines written to the file and publish them to the shared metrics on flush. """
+
+    def __init__(self, f, metrics, offset):
+        self.f = f
+        self.metrics = metrics
+        self.offset = offset
+        self.lines = 0
+
+    def write(self, s):
+        self.lines += s.count('\n')
+        return self.f.write(s)
+
+    def flush(self):
+        self.f.flush()
+        self.metrics[self.offset + 1] = max(self.lines - 1, 0)  # without the header
+        self.metrics[self.offset + 2] = time.time()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def _worker(shard, connect, open_output, frequency, to_record, retrievesize, make_transform, metrics, stop_event,
+            reconnect_timeout=60):
+    """ Record the drives `shard` [(index, ip)] in this process. """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the coordinator stops the workers
+    akds = []
+    files = []
+    try:
+        for (i, ip) in shard:
+            akds.append(connect(ip))
+        files = [_CountingFile(open_output(a), metrics, i * _FIELDS) for ((i, ip), a) in zip(shard, akds)]
+        for (i, ip) in shard:
+            metrics[i * _FIELDS] = RECORDING
+        record(akds, files, frequency, [to_record] * len(akds),
+               interact_callback=lambda a: stop_event.is_set(), retrievesize=retrievesize,
+               reconnect_timeout=reconnect_timeout,
+               transforms=[make_transform() if make_transform else None for a in akds])
+        for (i, ip) in shard:
+            metrics[i * _FIELDS] = DONE
+    except BaseException:
+        for (i, ip) in shard:
+            metrics[i * _FIELDS] = FAILED
+        raise
+    finally:
+        for f in files:
+            f.close()
+
+
+class ProcessRecorder:
+    """ Record the drives `ips` in `processes` worker processes.
+
+    `connect(ip)` returns an `AKD`, `open_output(akd)` returns the file to write its recording to,
+    `make_transform()` returns its `transforms.Transform` (or None). They are called in the workers,
+    they must be picklable (module level functions or `functools.partial` of them).
+    """
+
+    def __init__(self, ips, connect, open_output, frequency, to_record, processes=None, make_transform=None,
+                 retrievesize=4800, reconnect_timeout=60):
+        processes = min(processes or multiprocessing.cpu_count(), len(ips))
+        self.ips = list(ips)
+        self.metrics = multiprocessing.Array('d', len(ips) * _FIELDS, lock=False)
+        self.stop_event = multiprocessing.Event()
+        shards = [[(i, ip) for (i, ip) in enumerate(self.ips) if i % processes == p] for p in range(processes)]
+        self.workers = [multiprocessing.Process(
+            target=_worker, name="aakd-record-{}".format(p),
+            args=(shard, connect, open_output, frequency, to_record, retrievesize, make_transform,
+                  self.metrics, self.stop_event, reconnect_timeout))
+            for (p, shard) in enumerate(shards)]
+
+    def start(self):
+        for w in self.workers:
+            w.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def alive(self):
+        return any(w.is_alive() for w in self.workers)
+
+    def status(self):
+        """ [(ip, state, samples, last update)] per drive. """
+        return [(ip, STATES[int(self.metrics[i * _FIELDS])], int(self.metrics[i * _FIELDS + 1]),
+                 self.metrics[i * _FIELDS + 2]) for (i, ip) in enumerate(self.ips)]
+
+    def run(self, status_period=10):
+        """ Start the workers, print the recording rates every `status_period` [s] until they are done
+        or interrupted (Ctrl+c).
+        """
+        self.start()
+        previous = {ip: (0, time.monotonic()) for ip in self.ips}
+        next_status = time.monotonic() + status_period
+        try:
+            while self.alive():
+                time.sleep(0.1)
+                if status_period and time.monotonic() >= next_status:
+                    next_status += status_period
+                    now = time.monotonic()
+                    for (ip, state, samples, update) in self.status():
+                        (n, t) = previous[ip]
+                        print("{:<24} {:<10} {:>12} samples {:>10.0f} samples/s".format(
+                            ip, state, samples, (samples - n) / (now - t)))
+                        previous[ip] = (samples, now)
+        except KeyboardInterrupt:
+            print("Stopping the recording")
+            self.stop()
+        for w in self.workers:
+            w.join()
+        failed = [ip for (ip, state, samples, update) in self.status() if state == "failed"]
+        if failed:
+            raise Exception("Recording failed for " + ", ".join(failed))
@@ -0,0 +1,140 @@
+""" Pipelined restore of the parameters of an .akd file.
+
+The restore goes through phases, each one timed:
+    parse    the .akd file (once, skipped for an already parsed `AkdFile`),
+    nvcheck  compare the drive DRV.NVCHECK with the one of the file, nothing to do when matching,
+    factory  optional factory reset,
+    write    the parameters, UNIT.* first since they change how the other values are interpreted,
+             pipelined with a bounded number of commands in flight,
+    verify   read back all the parameters with a single DRV.NVLIST and compare,
+    flash    save to the non volatile memory.
+"""
+
+import collections
+
+from .akd_file import AkdFile
+
+
+PHASES = ("parse", "nvcheck", "factory", "write", "verify", "flash")
+
+
+def write_order(lines):
+    """ The (parameter, value) lines in the order they must be written: UNIT.* first, then the file order. """
+    return sorted(lines, key=lambda l: not l[0].upper().startswith("UNIT."))
+
+
+def same_value(expected, actual):
+    """ Compare a value of the file with the one read back, floats with the drive storage accuracy. """
+    (expected, actual) = (expected.split(), actual.split())
+    if not expected or not actual:
+        return expected == actual
+    try:
+        return abs(float(expected[0]) - float(actual[0])) <= 0.003  # storage of float seems 0.003 accurate
+    except ValueError:
+        return expected[0].upper() == actual[0].upper()
+
+
+def parse_nvlist(s):
+    """ {PARAMETER: value} of a DRV.NVLIST answer. """
+    params = {}
+    for l in s.splitlines():
+        parts = l.strip().split(None, 1)
+        if parts:
+            params[parts[0].upper()] = parts[1] if len(parts) > 1 else ""
+    return params
+
+
+class RestoreReport:
+    """ Result of a restore: `timings` {phase: seconds}, `written` number of parameters written,
+    `skipped` when the drive DRV.NVCHECK already matched, `mismatches` {PARAMETER: (expected, actual)}.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.timings = collections.OrderedDict()
+        self.written = 0
+        self.skipped = False
+        self.mismatches = {}
+        self.nvcheck = None
+
+    def total(self):
+        return sum(self.timings.values())
+
+    def summary(self):
+        if self.skipped:
+            return "Matching nvcheck found, no need to restore"
+        return "Restored {} parameters in {:.2f}s ({})".format(
+            self.written, self.total(), ", ".join("{} {:.2f}s".format(p, t) for (p, t) in self.timings.items()))
+
+    def to_dict(self):
+        return {'filename': self.filename, 'skipped': self.skipped, 'written': self.written,
+                'timings': dict(self.timings), 'nvcheck': self.nvcheck,
+                'mismatches': {p: {'expected': e, 'actual': a} for (p, (e, a)) in self.mismatches.items()}}
+
+
+class _Timer:
+    def __init__(self, clock, timings):
+        self.clock = clock
+        self.timings = timings
+        self.start = clock.monotonic()
+
+    def phase(self, name):
+        now = self.clock.monotonic()
+        self.timings[name] = now - self.start
+        self.start = now
+
+
+def restore_params(a, akd_file, flash_afterward=True, factory_reset=False, trust_drv_nvcheck=True,
+                   verify=True, window=16):
+    """ Restore the parameters of `akd_file` (a filename or an `AkdFile`) to the drive `a`,
+    return a `RestoreReport`. Failed writes and values read back different from the file raise
+    an exception listing all of them (before flashing).
+    """
+    timer = _Timer(a.clock, collections.OrderedDict())
+    if not isinstance(akd_file, AkdFile):
+        akd_file = AkdFile.parse(akd_file)
+    report = RestoreReport(akd_file.filename)
+    report.timings = timer.timings
+    timer.phase("parse")
+
+    if trust_drv_nvcheck and akd_file.nvcheck is not None:
+        report.nvcheck = a.commandS("DRV.NVCHECK")
+        timer.phase("nvcheck")
+        if akd_file.nvcheck == report.nvcheck:
+            report.skipped = True
+            print("{}\t{}".format(a.nice_name(), report.summary()))
+            return report
+
+    print("{}\tRestoring parameters from {}".format(a.nice_name(), akd_file.filename))
+    if factory_reset:
+        a.factory_params()
+        timer.phase("factory")
+
+    lines = write_order(akd_file.lines)
+    cmds = ["{} {}".format(p, v) if v else p for (p, v) in lines]
+    answers = a.command_batch(cmds, return_exceptions=True, window=window)
+    errors = ["{}: {}".format(p, e) for ((p, v), e) in zip(lines, answers) if isinstance(e, Exception)]
+    report.written = len(cmds) - len(errors)
+    timer.phase("write")
+    if errors:
+        raise Exception("AKD {} failed to restore {} parameters:\n  {}".format(
+            a.nice_name(), len(errors), "\n  ".join(errors)))
+
+    if verify:
+        actual = parse_nvlist(a.commandS("drv.nvlist"))
+        for (p, v) in akd_file.upper_params().items():
+            if p in actual and not same_value(v, actual[p]):
+                report.mismatches[p] = (v, actual[p])
+        timer.phase("verify")
+        if report.mismatches:
+            raise Exception("AKD {} parameters differ after restore:\n  {}".format(
+                a.nice_name(), "\n  ".join("{} is {} expected {}".format(p, actual, expected)
+                                           for (p, (expected, actual)) in sorted(report.mismatches.items()))))
+
+    if flash_afterward:
+        a.flash_params()
+        report.nvcheck = a.commandS("DRV.NVCHECK")
+        timer.phase("flash")
+
+    print("{}\t{}".format(a.nice_name(), report.summary()))
+    return report
@@ -0,0 +1,168 @@
+""" Discovery of the drives of a network: probe the addresses of CIDR ranges concurrently and build
+a drives file.
+
+A host is an AKD when it answers `drv.name` on its telnet port with the `-->` prompt. Its model and
+firmware version are then read from `drv.info` (falling back to `drv.ver`), they are the `type` and
+`firmware` of the drives file (see `Inventory`). Unreachable addresses cost at most `timeout`,
+which is short since the drives are on the local network.
+"""
+
+import ipaddress
+import re
+import telnetlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .akd import set_max_window_size
+
+
+PROBE_COMMANDS = ("drv.name", "drv.info", "drv.ver")
+
+
+class ScanResult:
+    """ A drive found by `scan`: `address` (ip, or ip:port when not 23), `name`, `type`, `firmware`. """
+
+    def __init__(self, address, name, type=None, firmware=None):
+        self.address = address
+        self.name = name
+        self.type = type
+        self.firmware = firmware
+
+    def __repr__(self):
+        return "ScanResult({}, {}, {}, {})".format(self.address, self.name, self.type, self.firmware)
+
+
+def hosts(cidrs):
+    """ The addresses of the CIDR ranges (a single address is a /32). """
+    for cidr in cidrs:
+        network = ipaddress.ip_network(cidr, strict=False)
+        for ip in (network.hosts() if network.num_addresses > 2 else network):
+            yield str(ip)
+
+
+def parse_ports(ports):
+    """ Ports from "23", "23,24" or "23000-23003". """
+    result = []
+    for part in str(ports).split(','):
+        (first, sep, last) = part.partition('-')
+        result += list(range(int(first), int(last) + 1)) if sep else [int(first)]
+    return result
+
+
+def _info_field(text, pattern):
+    for l in text.splitlines():
+        (key, sep, value) = l.partition(':')
+        if sep and re.search(pattern, key, re.IGNORECASE) and value.strip():
+            return value.strip()
+    return None
+
+
+def identify(answers):
+    """ (type, firmware) from the answers of `PROBE_COMMANDS`. """
+    info = answers.get("drv.info", "")
+    ver = answers.get("drv.ver", "")
+    model = _info_field(info, "model")
+    firmware = _info_field(info, "firmware") or _info_field(ver, "version")
+    if firmware is None:
+        m = re.search(r"\bM_[0-9-]+", ver)
+        firmware = m.group(0) if m else None
+    return (model, firmware)
+
+
+def probe(ip, port=23, timeout=0.5):
+    """ Return a `ScanResult` if an AKD answers at `ip`:`port`, None otherwise. """
+    try:
+        t = telnetlib.Telnet(ip, port=port, timeout=timeout)
+    except OSError:  # refused, unreachable or timeout
+        return None
+    try:
+        t.set_option_negotiation_callback(set_max_window_size)
+        t.write("".join(c + "\r\n" for c in PROBE_COMMANDS).encode('ascii'))
+        answers = {}
+        for (i, c) in enumerate(PROBE_COMMANDS):
+            answer = t.read_until(b"-->", timeout * 4)
+            if i == 0 and answer.strip() == b"-->":  # prompt sent on connection
+                answer = t.read_until(b"-->", timeout * 4)
+            if not answer.endswith(b"-->"):
+                return None  # not a drive (or too slow to be one)
+            answer = answer[:-3].decode('latin-1').replace('\r\n', '\n').strip()
+            if not answer.startswith("Error:"):
+                answers[c] = answer
+        if not answers.get("drv.name"):
+            return None
+        (model, firmware) = identify(answers)
+        address = ip if port == 23 else "{}:{}".format(ip, port)
+        return ScanResult(address, answers["drv.name"], model, firmware)
+    except (EOFError, OSError):
+        return None
+    finally:
+        t.close()
+
+
+def scan(cidrs, ports=(23,), parallel=64, timeout=0.5, on_probe=None):
+    """ Probe all the addresses of `cidrs` on `ports` with `parallel` connections at a time,
+    return the `ScanResult`s in address order. `on_probe(address, result)` is called after each probe.
+    """
+    targets = [(ip, port) for ip in hosts(cidrs) for port in ports]
+
+    def run(target):
+        result = probe(target[0], target[1], timeout)
+        if on_probe is not None:
+            on_probe("{}:{}".format(*target), result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(targets)))) as executor:
+        return [r for r in executor.map(run, targets) if r is not None]
+
+
+def merge_drives(drives, results, groups=()):
+    """ Update the drives file content `drives` (name -> description) with the `results` of a scan,
+    adding `groups` to the found drives. Drives are matched by address, then by drv.name when the address
+    of the drive of that name was not found (it moved). New drives are named by their drv.name.
+    Drives not found are kept.
+    Return (drives, messages) with messages describing the changes.
+    """
+    drives = {name: dict(d) for (name, d) in (drives or {}).items()}
+    messages = []
+    by_address = {str(d.get('ip')): name for (name, d) in drives.items()}
+    addresses = {name: str(d.get('ip')) for (name, d) in drives.items()}
+    found = {r.address for r in results}
+    seen = set()
+    for r in results:
+        unique_name = "{}_{}".format(r.name, r.address.replace('.', '_').replace(':', '_'))
+        name = by_address.get(r.address, r.name)  # the file name of the address wins
+        if name != r.name:
+            messages.append("{} at {} has drv.name {}".format(name, r.address, r.name))
+        elif r.address not in by_address and name in addresses and addresses[name] in found:
+            # named like a drive still found at its address, not that drive moving
+            name = unique_name
+            messages.append("{} at {} has the name of the drive at {}, added as {}".format(
+                r.name, r.address, addresses[r.name], name))
+        if name in seen:  # same drv.name on several drives, eg factory default names
+            name = unique_name
+            messages.append("{} at {} has a duplicate name, added as {}".format(r.name, r.address, name))
+        seen.add(name)
+        d = drives.setdefault(name, {})
+        if not d:
+            messages.append("new drive {} at {}".format(name, r.address))
+        elif str(d.get('ip')) != r.address:
+            messages.append("{} moved from {} to {}".format(name, d.get('ip'), r.address))
+        d['ip'] = r.address
+        d['groups'] = list(d.get('groups', [])) + [g for g in groups if g not in d.get('groups', [])]
+        for (key, value) in (("type", r.type), ("firmware", r.firmware)):
+            if value is not None:
+                d[key] = value
+    for name in drives:
+        if name not in seen:
+            messages.append("{} at {} not found".format(name, drives[name].get('ip')))
+    return (drives, messages)
+
+
+def dump_drives(drives):
+    """ Drives file content, one line per drive (the style of the hand written files). """
+    import yaml
+    lines = []
+    for (name, d) in drives.items():
+        key = yaml.safe_dump(name, default_style=None).splitlines()[0]
+        value = yaml.safe_dump(d, default_flow_style=True, sort_keys=False, width=float('inf')).strip()
+        lines.append("{}: {}".format(key, value))
+    return "\n".join(lines) + "\n"
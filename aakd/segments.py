@@ -0,0 +1,355 @@
+""" Long term recording output: rotating, compressed csv segments with a disk budget.
+
+A `SegmentStore` is a folder of segments of the recordings of several drives. Each drive writes through
+a `SegmentWriter` (a file like object, see `record`) which starts a new segment after `rotate_seconds`
+or `rotate_bytes`. Every segment is a complete csv file (with the header). Closed segments are compressed
+by a background thread, then the oldest segments are deleted while the store is above its `budget_bytes`.
+
+The store keeps an index (index.json) of the segments: name, file, wall clock time range (`start`, `end`)
+and size, used to read back a time range (`SegmentStore.read`) without opening the other segments.
+Several stores (processes) can write in the same folder: the index is updated under a lock (index.lock),
+merging the entries of the others read again from the file.
+
+A segment being written has a lock file (its file name + ".lock") holding the pid of the writer. Opening
+a store recovers (closes) the segments left open by writers which are gone, never the ones of a running
+recording. Reading a store while it is written opens it with `read_only`, which changes nothing.
+"""
+
+import contextlib
+import gzip
+import json
+import lzma
+import os
+import queue
+import threading
+from pathlib import Path
+
+from .clock import system_clock
+
+
+def _zstd_open():
+    try:
+        from compression import zstd  # python >= 3.14
+        return zstd.open
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return None
+
+    def zstd_open(filename, mode="rb"):
+        if 'w' in mode:
+            return zstandard.open(filename, "wb")
+        return zstandard.open(filename, "rt" if 't' in mode else "rb")
+    return zstd_open
+
+
+COMPRESSIONS = {
+    "none": ("", open),
+    "gzip": (".gz", gzip.open),
+    "xz": (".xz", lzma.open),
+    "zstd": (".zst", None),  # when available, see `_zstd_open`
+}
+
+
+def compression_opener(compression):
+    """ Return (suffix, open function) of a compression. """
+    if compression not in COMPRESSIONS:
+        raise Exception("Unknown compression {}, expecting one of {}".format(compression, ", ".join(COMPRESSIONS)))
+    (suffix, opener) = COMPRESSIONS[compression]
+    if compression == "zstd":
+        opener = _zstd_open()
+        if opener is None:
+            raise Exception("zstd compression needs python 3.14 or the zstandard package")
+    return (suffix, opener)
+
+
+def writer_alive(lock_file):
+    """ Whether the writer process whose pid is in `lock_file` is still running. """
+    try:
+        pid = int(Path(lock_file).read_text())
+    except (OSError, ValueError):
+        return False  # no lock
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return True  # no portable check, the lock of a crashed writer has to be removed by hand
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # running as another user
+    return True
+
+
+@contextlib.contextmanager
+def locked(lock_file):
+    """ Hold an exclusive lock on `lock_file` (created if needed), between processes. """
+    with open(lock_file, 'a+') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield  # unlocked by closing
+
+
+def open_segment(filename):
+    """ Open a (possibly compressed) segment for reading text. """
+    filename = str(filename)
+    for (compression, (suffix, opener)) in COMPRESSIONS.items():
+        if suffix and filename.endswith(suffix):
+            return compression_opener(compression)[1](filename, "rt")
+    return open(filename)
+
+
+class SegmentStore:
+    """ A folder of recording segments, see the module documentation.
+    A `read_only` store is only for `select` and `read`: no compression nor recovery.
+    """
+
+    def __init__(self, folder, rotate_seconds=3600, rotate_bytes=None, compression="gzip", budget_bytes=None,
+                 clock=system_clock, read_only=False):
+        self.folder = Path(folder)
+        self.read_only = read_only
+        if not read_only:
+            self.folder.mkdir(parents=True, exist_ok=True)
+        self.rotate_seconds = rotate_seconds
+        self.rotate_bytes = rotate_bytes
+        (self.suffix, self.opener) = compression_opener(compression)
+        self.compression = compression
+        self.budget_bytes = budget_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.index_file = self.folder / "index.json"
+        self.segments = self.load_index(self.folder)
+        self.own = {}  # id: segment written, recovered or compressed by this store
+        self.saved = set()  # files of the own segments in the index file
+        self.compressor = None
+        if read_only:
+            return
+        self.queue = queue.Queue()
+        self.compressor = threading.Thread(target=self.compress_worker, daemon=True)
+        self.compressor.start()
+        for segment in self.segments:
+            if segment['end'] is None and not writer_alive(self.lock_file(segment)):  # interrupted recording
+                self.recover(segment)
+
+    def lock_file(self, segment):
+        return self.folder / (segment['file'] + ".lock")
+
+    def recover(self, segment):
+        try:
+            st = (self.folder / segment['file']).stat()
+        except OSError:
+            return
+        lock_file = self.lock_file(segment)  # before the compression renames the segment
+        (segment['end'], segment['bytes']) = (st.st_mtime, st.st_size)
+        self.closed(segment)
+        try:
+            lock_file.unlink()
+        except OSError:
+            pass
+
+    @staticmethod
+    def load_index(folder):
+        try:
+            with open(Path(folder) / "index.json") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    def index_locked(self):
+        return locked(self.folder / "index.lock")
+
+    def refresh(self, removed=()):
+        """ Merge the index file, updated by the other stores of the folder too, with the own segments
+        (by file, `removed` files are dropped). Called with `index_locked`.
+        """
+        own = {s['file']: s for s in self.own.values()}
+        segments = [own.pop(s['file'], s) for s in self.load_index(self.folder) if s['file'] not in removed]
+        for s in own.values():
+            if s['file'] in self.saved:  # deleted by another store (budget)
+                del self.own[id(s)]
+        self.segments = segments + [s for s in own.values() if s['file'] not in self.saved]
+
+    def write_index(self):
+        tmp = self.index_file.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.segments, f, indent=0)
+        os.replace(tmp, self.index_file)
+        self.saved = {s['file'] for s in self.own.values()}
+
+    def save_index(self, removed=()):
+        with self.index_locked():
+            self.refresh(removed)
+            self.write_index()
+
+    def writer(self, name):
+        if self.read_only:
+            raise Exception("Segment store {} is opened read only".format(self.folder))
+        return SegmentWriter(self, name)
+
+    def add(self, segment):
+        with self.lock:
+            self.own[id(segment)] = segment
+            self.save_index()
+
+    def closed(self, segment):
+        """ A segment was closed, compress it (in the background) and apply the budget. """
+        with self.lock:
+            self.own[id(segment)] = segment
+            self.save_index()
+        self.queue.put(segment)
+
+    def compress_worker(self):
+        while True:
+            segment = self.queue.get()
+            try:
+                if segment is None:
+                    return
+                self.compress(segment)
+                self.prune()
+            except Exception as e:
+                print("Segment {} compression failed: {}".format(segment['file'], e))
+            finally:
+                self.queue.task_done()
+
+    def compress(self, segment):
+        if not self.suffix:
+            return
+        source = self.folder / segment['file']
+        target = source.with_name(source.name + self.suffix)
+        with open(source, 'rb') as fin, self.opener(target, 'wb') as fout:
+            while True:
+                chunk = fin.read(1 << 20)
+                if not chunk:
+                    break
+                fout.write(chunk)
+        with self.lock:
+            segment['file'] = target.name
+            segment['bytes'] = target.stat().st_size
+            self.save_index(removed=[source.name])
+        source.unlink()
+
+    def prune(self):
+        """ Delete the oldest closed segments while above the budget. """
+        if self.budget_bytes is None:
+            return
+        with self.lock, self.index_locked():
+            self.refresh()
+            total = sum(s['bytes'] for s in self.segments)
+            removed = []
+            for s in sorted(self.segments, key=lambda s: s['start']):
+                if total <= self.budget_bytes:
+                    break
+                if s['end'] is None:  # being written
+                    continue
+                total -= s['bytes']
+                removed.append(s)
+            self.segments = [s for s in self.segments if s not in removed]
+            for s in removed:
+                self.own.pop(id(s), None)
+            self.write_index()
+        for s in removed:
+            try:
+                (self.folder / s['file']).unlink()
+            except OSError:
+                pass
+
+    def close(self):
+        """ Wait for the pending compressions. """
+        if self.compressor is None:
+            return
+        self.queue.put(None)
+        self.compressor.join()
+
+    def select(self, name=None, start=None, end=None):
+        """ The segments of `name` (all if None) overlapping the wall clock time range [start, end]. """
+        return [s for s in sorted(self.segments, key=lambda s: s['start'])
+                if (name is None or s['name'] == name)
+                and (end is None or s['start'] <= end)
+                and (start is None or s['end'] is None or s['end'] >= start)]
+
+    def read(self, name, start=None, end=None):
+        """ Yield the csv lines of the recording of `name` between the wall clock times `start` and `end`
+        (header first), from the segments of that time range only.
+        Rows are selected by segment: the first and last segments can extend out of the range.
+        """
+        header = None
+        for s in self.select(name, start, end):
+            with open_segment(self.folder / s['file']) as f:
+                h = f.readline()
+                if header is None:
+                    header = h
+                    yield h.rstrip('\n')
+                for l in f:
+                    yield l.rstrip('\n')
+
+
+class SegmentWriter:
+    """ File like object writing the recording `name` in rotating segments of a `SegmentStore`.
+    Rotations happen on `flush`, so that segments contain whole chunks.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.header = None
+        self.file = None
+        self.segment = None
+        self.partial = ""
+
+    def open_segment(self):
+        now = self.store.clock.time()
+        base = "{}_{}".format(self.name, int(now * 1000))
+        self.segment = {'name': self.name, 'file': base + ".csv", 'start': now, 'end': None, 'bytes': 0}
+        self.file = open(self.store.folder / self.segment['file'], 'w')
+        self.store.lock_file(self.segment).write_text(str(os.getpid()))
+        self.opened = self.store.clock.monotonic()
+        if self.header is not None:
+            self.file.write(self.header)
+        self.store.add(self.segment)
+
+    def close_segment(self):
+        if self.file is None:
+            return
+        self.file.close()
+        lock_file = self.store.lock_file(self.segment)  # before the compression renames the segment
+        self.segment['end'] = self.store.clock.time()
+        self.segment['bytes'] = (self.store.folder / self.segment['file']).stat().st_size
+        self.store.closed(self.segment)
+        lock_file.unlink()
+        self.file = None
+
+    def write(self, s):
+        if self.file is None:
+            self.open_segment()
+        if self.header is None:
+            # keep the header line to start every segment with it
+            self.partial += s
+            if '\n' not in self.partial:
+                return
+            (self.header, rest) = self.partial.split('\n', 1)
+            self.header += '\n'
+            self.partial = ""
+            self.file.write(self.header)
+            s = rest
+        self.file.write(s)
+
+    def flush(self):
+        if self.file is None:
+            return
+        self.file.flush()
+        rotate = (self.store.rotate_seconds is not None
+                  and self.store.clock.monotonic() - self.opened >= self.store.rotate_seconds)
+        rotate = rotate or (self.store.rotate_bytes is not None and self.file.tell() >= self.store.rotate_bytes)
+        if rotate:
+            self.close_segment()
+
+    def close(self):
+        self.close_segment()
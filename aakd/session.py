@@ -0,0 +1,194 @@
+""" Capture and replay of the byte stream of a drive session.
+
+A captured session can be served back by `ReplayTransport` in place of the telnet connection,
+which allows to reproduce real workloads (record, restore, monitor_faults...) offline.
+
+A session file holds all the connections of a process to a drive (reconnections, operations opening
+their own connection), each one starting with a `SESSION_CONNECT` record, they are replayed in order.
+"""
+
+import os
+import struct
+import threading
+import time
+
+from .clock import system_clock
+
+
+SESSION_MAGIC = b"AKDSESSION1\n"
+
+SESSION_WRITE = 0
+SESSION_READ = 1
+SESSION_EAGER = 2
+SESSION_CONNECT = 3
+
+KINDS = {SESSION_WRITE: '>', SESSION_READ: '<', SESSION_EAGER: '<<', SESSION_CONNECT: '=='}
+
+# record: time since the start of the connection [s], kind, data length
+_RECORD = struct.Struct("<dBI")
+
+# session files already written (appended to) and next connection to replay, in this process
+_captured = set()
+_replayed = {}
+_lock = threading.Lock()
+
+
+def session_filename(folder, ip):
+    from pathlib import Path
+    return Path(folder) / (ip.replace(':', '_') + ".akdsession")
+
+
+class CaptureTransport:
+    """ Wrap a telnet connection and save every byte exchanged with the drive in `filename`.
+    The first connection of the process to a file overwrites it, the next ones are appended.
+    """
+
+    def __init__(self, transport, filename):
+        self.transport = transport
+        key = os.path.abspath(filename)
+        with _lock:
+            first = key not in _captured
+            _captured.add(key)
+        self.f = open(filename, 'wb' if first else 'ab')
+        if first:
+            self.f.write(SESSION_MAGIC)
+        self.start = time.monotonic()
+        self._save(SESSION_CONNECT, b"")
+
+    def _save(self, kind, data):
+        self.f.write(_RECORD.pack(time.monotonic() - self.start, kind, len(data)))
+        self.f.write(data)
+
+    def write(self, data):
+        self._save(SESSION_WRITE, data)
+        self.transport.write(data)
+
+    def read_until(self, match, timeout=None):
+        data = self.transport.read_until(match, timeout)
+        self._save(SESSION_READ, data)
+        return data
+
+    def read_very_eager(self):
+        data = self.transport.read_very_eager()
+        self._save(SESSION_EAGER, data)
+        return data
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+        self.transport.close()
+
+
+def load_session(filename):
+    """ Return the list of (time [s], kind, data) records of a session file. """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(SESSION_MAGIC):
+        raise Exception("{} is not an aakd session file".format(filename))
+    offset = len(SESSION_MAGIC)
+    records = []
+    while offset + _RECORD.size <= len(data):
+        (t, kind, length) = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        records.append((t, kind, data[offset:offset + length]))
+        offset += length
+    return records
+
+
+def session_connections(records):
+    """ Split the records of a session into the list of its connections. """
+    connections = []
+    for record in records:
+        if record[1] == SESSION_CONNECT or not connections:
+            connections.append([])
+        if record[1] != SESSION_CONNECT:
+            connections[-1].append(record)
+    return connections
+
+
+class ReplayTransport:
+    """ Serve a captured session back, in place of the telnet connection.
+
+    Each use after a `close` (reconnection) and each new `ReplayTransport` of the same file
+    serve the next connection of the session.
+    Answers are delayed like in the capture, divided by `speed` (`speed=0` answers immediately).
+    Waits use `clock`.
+    Writes have to match the capture, if one doesn't we skip ahead to the next identical write
+    (polling loops may not run the same number of times), and fail if there is none.
+    """
+
+    def __init__(self, filename, speed=1.0, clock=None):
+        self.filename = filename
+        self.connections = session_connections(load_session(filename))
+        self.speed = speed
+        self.clock = clock if clock is not None else system_clock
+        self.open_connection()
+
+    def open_connection(self):
+        key = os.path.abspath(self.filename)
+        with _lock:
+            index = _replayed.get(key, 0)
+            _replayed[key] = index + 1
+        if index >= len(self.connections):
+            raise EOFError("No connection {} in replayed session {}".format(index + 1, self.filename))
+        self.records = self.connections[index]
+        self.closed = False
+        self.position = 0
+        self.last_record_time = 0
+        self.last_replay_time = self.clock.monotonic()
+
+    def _next(self, kinds):
+        while self.position < len(self.records):
+            record = self.records[self.position]
+            self.position += 1
+            if record[1] in kinds:
+                return record
+        raise EOFError("End of replayed session " + str(self.filename))
+
+    def _wait(self, t):
+        if self.speed:
+            delay = self.last_replay_time + (t - self.last_record_time) / self.speed - self.clock.monotonic()
+            if delay > 0:
+                self.clock.sleep(delay)
+        self.last_record_time = t
+        self.last_replay_time = self.clock.monotonic()
+
+    def write(self, data):
+        if self.closed:
+            self.open_connection()
+        start = self.position
+        while True:
+            try:
+                (t, kind, expected) = self._next({SESSION_WRITE})
+            except EOFError:
+                self.position = start
+                raise Exception("Replayed session diverged, unexpected write {}".format(repr(data)))
+            if expected == data:
+                break
+        # the time spent by the host before writing is not replayed
+        self.last_record_time = t
+        self.last_replay_time = self.clock.monotonic()
+
+    def _read(self, kinds):
+        if self.closed:
+            self.open_connection()
+        if self.position < len(self.records) and self.records[self.position][1] == SESSION_WRITE:
+            return b""  # Nothing was answered at this point in the capture
+        (t, kind, data) = self._next(kinds)
+        self._wait(t)
+        return data
+
+    def read_until(self, match, timeout=None):
+        return self._read({SESSION_READ})
+
+    def read_very_eager(self):
+        return self._read({SESSION_EAGER, SESSION_READ})
+
+    def close(self):
+        self.closed = True
+
+
+def format_session(records):
+    """ Yield human readable lines of a session. """
+    for (t, kind, data) in records:
+        yield "{:12.6f} {:2} {}".format(t, KINDS.get(kind, '?'), repr(data))
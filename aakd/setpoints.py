@@ -0,0 +1,159 @@
+""" Host streamed setpoints (eg il.cmdu, vl.cmdu), for profiles the drive can't run itself.
+
+Profiles are compiled beforehand into arrays of values at a fixed rate (`SetpointProfile`), the value
+to send at a time is then an index away. `SetpointStreamer` sends them on their deadlines from the
+recording worker (see `record`): it is its `interact_callback`, and only returns to let the worker
+retrieve recorded data when the retrieval fits before the next deadline. The achieved timing of every
+setpoint is kept and can be written next to the recorded data.
+"""
+
+import math
+from array import array
+
+from .governor import SETPOINT
+
+
+class SetpointProfile:
+    """ Setpoint values at a fixed `rate` [Hz], value i is applied from time i / rate. """
+
+    def __init__(self, values, rate):
+        self.values = array('d', values)
+        self.rate = rate
+
+    @property
+    def duration(self):
+        return len(self.values) / self.rate
+
+    def index_at(self, t):
+        return int(t * self.rate)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __add__(self, other):
+        if other.rate != self.rate:
+            raise Exception("Cannot concatenate profiles of different rates")
+        return SetpointProfile(self.values + other.values, self.rate)
+
+    @classmethod
+    def from_table(cls, table, rate):
+        """ Profile of a time table [(end_time, value)] like the velocity profiles. """
+        values = array('d')
+        for (end_time, value) in table:
+            values.extend([value] * (int(round(end_time * rate)) - len(values)))
+        return cls(values, rate)
+
+    @classmethod
+    def from_intervals(cls, intervals, rate, fill=0):
+        """ Profile of intervals [(start_time, end_time, value)] like the current profiles,
+        `fill` between the intervals.
+        """
+        values = array('d')
+        for (start_time, end_time, value) in sorted(intervals):
+            values.extend([fill] * (int(round(start_time * rate)) - len(values)))
+            values.extend([value] * (int(round(end_time * rate)) - len(values)))
+        return cls(values, rate)
+
+    @classmethod
+    def constant(cls, value, duration, rate):
+        return cls([value] * int(round(duration * rate)), rate)
+
+    @classmethod
+    def scurve(cls, start, end, duration, rate):
+        """ Smooth transition from `start` to `end`, with a null slope at both ends (sine jerk S-curve). """
+        n = max(int(round(duration * rate)), 1)
+        return cls([start + (end - start) * (x - math.sin(2 * math.pi * x) / (2 * math.pi))
+                    for x in (i / n for i in range(1, n + 1))], rate)
+
+    @classmethod
+    def sinusoid(cls, amplitude, frequency, duration, rate, offset=0, phase=0):
+        return cls([offset + amplitude * math.sin(2 * math.pi * frequency * i / rate + phase)
+                    for i in range(int(round(duration * rate)))], rate)
+
+
+class SetpointStreamer:
+    """ Send the values of `profile` to `parameter` of a drive on their deadlines.
+
+    Use it as the `interact_callback` of `record` (or call it in a loop), after `start`.
+    Each call sends the setpoints which are due, waiting for them while the time left before
+    the next deadline is shorter than a recorder retrieval (measured between calls).
+    Setpoints more than a period late are skipped to catch up. Recorder retrievals are still let
+    through after `max_retrieval_delay` [s] to avoid losing recorded data.
+    """
+
+    def __init__(self, parameter, profile, repeat=False, final_value=None, max_retrieval_delay=0.2):
+        self.parameter = parameter
+        self.profile = profile
+        self.repeat = repeat
+        self.final_value = final_value
+        self.max_retrieval_delay = max_retrieval_delay
+        self.period = 1 / profile.rate
+        self.start_time = None
+        self.next_index = 0
+        self.sent = []  # (index, deadline, lateness) of the sent setpoints, relative to start_time
+        self.skipped = 0
+        self.retrieval_time = 0
+        self.last_return = None
+
+    def start(self, a):
+        self.clock = a.clock
+        self.start_time = self.clock.monotonic()
+        self.next_index = 0
+        self.last_return = None
+
+    def done(self):
+        return not self.repeat and self.next_index >= len(self.profile)
+
+    def send(self, a, index, deadline, now):
+        with a.priority(SETPOINT):
+            a.cset(self.parameter, self.profile.values[index % len(self.profile)])
+        self.sent.append((index, deadline, now - deadline))
+
+    def __call__(self, a):
+        if self.start_time is None:
+            self.start(a)
+        now = self.clock.monotonic()
+        if self.last_return is not None:
+            # what happened since the last call: mostly a recorder retrieval
+            self.retrieval_time = max(now - self.last_return, 0.8 * self.retrieval_time)
+        last_retrieval = now
+        while not self.done():
+            deadline = self.next_index * self.period
+            t = now - self.start_time
+            if t >= deadline:
+                due = self.profile.index_at(t)
+                if due > self.next_index:  # more than a period late, catch up
+                    self.skipped += due - self.next_index
+                    self.next_index = due
+                    if self.done():
+                        break
+                    deadline = self.next_index * self.period
+                self.send(a, self.next_index, deadline, t)
+                self.next_index += 1
+                now = self.clock.monotonic()
+                continue
+            slack = deadline - t
+            if slack > self.retrieval_time or now - last_retrieval > self.max_retrieval_delay:
+                break
+            self.clock.sleep(slack)
+            now = self.clock.monotonic()
+        if self.done():
+            if self.final_value is not None:
+                with a.priority(SETPOINT):
+                    a.cset(self.parameter, self.final_value)
+            return True
+        self.last_return = self.clock.monotonic()
+        return False
+
+    def jitter_stats(self):
+        """ (mean, max, 99th percentile) lateness of the sent setpoints [s]. """
+        if not self.sent:
+            return (0, 0, 0)
+        lateness = sorted(late for (i, d, late) in self.sent)
+        return (sum(lateness) / len(lateness), lateness[-1], lateness[int(0.99 * (len(lateness) - 1))])
+
+    def write_jitter(self, filename):
+        with open(filename, 'w') as f:
+            print("index,deadline [s],lateness [s]", file=f)
+            for (i, deadline, late) in self.sent:
+                print("{},{:.6f},{:.6f}".format(i, deadline, late), file=f)
@@ -0,0 +1,124 @@
+""" In-memory trace of the commands exchanged with the drives """
+
+import collections
+import itertools
+import os
+import signal
+import struct
+import time
+import weakref
+
+
+TRACE_SEND = 0
+TRACE_RECV = 1
+TRACE_ERROR = 2
+
+DIRECTIONS = {TRACE_SEND: '>', TRACE_RECV: '<', TRACE_ERROR: '!'}
+
+TRACE_MAGIC = b"AKDTRACE1\n"
+# header: monotonic_ns and time_ns at dump time (to recover wall clock), name length
+_HEADER = struct.Struct("<qqH")
+# event: monotonic_ns, direction, latency_ns, payload length
+_EVENT = struct.Struct("<qBqH")
+
+# All live trace buffers, so that a signal can dump all of them
+_buffers = weakref.WeakSet()
+# makes the dump file names unique
+_dump_counter = itertools.count()
+
+
+class TraceBuffer:
+    """ Ring buffer keeping the last `size` command events of a drive connection.
+
+    Recording an event is a single deque append of a tuple, so it can stay on all the time.
+    Events are only formatted when dumped, see `dump` and `load_trace`.
+    """
+
+    def __init__(self, name, size=4096, payload_size=96):
+        self.name = name
+        self.payload_size = payload_size
+        self.events = collections.deque(maxlen=size)
+        _buffers.add(self)
+
+    def record(self, direction, payload, latency=0):
+        """ Record an event and return its monotonic timestamp [ns]. """
+        t = time.monotonic_ns()
+        self.events.append((t, direction, payload[:self.payload_size], latency))
+        return t
+
+    def clear(self):
+        self.events.clear()
+
+    def dump(self, filename):
+        """ Write the buffer content in the binary trace format. """
+        events = list(self.events)  # snapshot, the deque may be appended to concurrently
+        name = self.name.encode('utf-8')
+        with open(filename, 'wb') as f:
+            f.write(TRACE_MAGIC)
+            f.write(_HEADER.pack(time.monotonic_ns(), time.time_ns(), len(name)))
+            f.write(name)
+            for (t, direction, payload, latency) in events:
+                f.write(_EVENT.pack(t, direction, latency, len(payload)))
+                f.write(payload)
+        return filename
+
+    def dump_to_folder(self, folder, reason):
+        t = time.time()
+        filename = "{}.{:03d}_{}_{}_{}.akdtrace".format(
+            time.strftime("%Y%m%dT%H%M%S", time.localtime(t)), int(t * 1000) % 1000, next(_dump_counter),
+            self.name.replace('/', '_'), reason)
+        return self.dump(os.path.join(folder, filename))
+
+
+def dump_all(folder, reason="signal"):
+    """ Dump all live trace buffers to `folder`, return the list of written files. """
+    return [b.dump_to_folder(folder, reason) for b in list(_buffers)]
+
+
+def install_dump_signal(folder, signum=getattr(signal, "SIGUSR1", None)):
+    """ Dump all the trace buffers when receiving `signum` (SIGUSR1 by default). """
+    if signum is None:  # No SIGUSR1 on windows
+        return
+
+    def handler(signum, frame):
+        for filename in dump_all(folder):
+            print("Trace dumped to", filename, flush=True)
+
+    signal.signal(signum, handler)
+
+
+def load_trace(filename):
+    """ Read a binary trace file.
+    Return (name, events) where events is a list of (wall_time [s], direction, payload, latency [s]).
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise Exception("{} is not an aakd trace file".format(filename))
+    offset = len(TRACE_MAGIC)
+    (dump_monotonic, dump_time, name_len) = _HEADER.unpack_from(data, offset)
+    offset += _HEADER.size
+    name = data[offset:offset + name_len].decode('utf-8')
+    offset += name_len
+    events = []
+    while offset < len(data):
+        (t, direction, latency, payload_len) = _EVENT.unpack_from(data, offset)
+        offset += _EVENT.size
+        payload = data[offset:offset + payload_len]
+        offset += payload_len
+        events.append(((dump_time - dump_monotonic + t) / 1e9, direction, payload, latency / 1e9))
+    return (name, events)
+
+
+def format_trace(name, events):
+    """ Yield human readable lines of a decoded trace. """
+    from datetime import datetime
+    yield "# " + name
+    previous = None
+    for (t, direction, payload, latency) in events:
+        delta = t - previous if previous is not None else 0
+        previous = t
+        latency_s = "{:8.2f}ms".format(latency * 1000) if direction != TRACE_SEND else " " * 10
+        yield "{} +{:9.3f}ms {} {} {}".format(
+            datetime.fromtimestamp(t).isoformat(timespec='microseconds'),
+            delta * 1000, DIRECTIONS.get(direction, '?'), latency_s, repr(payload))
@@ -0,0 +1,152 @@
+""" Streaming transforms of the recorded data, applied by `record` to each retrieved chunk before writing.
+
+Derived channels are expressions of the recorded channels, named like the channels in lower case with
+the dots replaced by underscores (`il_fb`, `vl_fb`...), eg `power=il_fb*vl_fb` or `i2=il_fb**2`.
+Decimation replaces each block of `factor` samples by statistics of each channel (mean, min, max),
+so that peaks are kept. Both are vectorized with numpy when it is installed.
+"""
+
+import math
+
+
+STATS = ("mean", "min", "max")
+
+_MATH_NAMES = ("sqrt", "exp", "log", "sin", "cos", "tan", "pi")
+
+
+def column_name(header):
+    """ Identifier of a channel in the expressions, eg `IL.FB [A]` -> `il_fb`. """
+    name = header.split()[0].lower() if header.split() else header
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+class DerivedChannel:
+    """ A channel computed by the (python) `expression` of the other channels. """
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        self.code = compile(expression, "<derived channel {}>".format(name), "eval")
+
+    @classmethod
+    def parse(cls, definition):
+        """ From `name=expression`. """
+        (name, sep, expression) = definition.partition('=')
+        if not sep or not name.strip() or not expression.strip():
+            raise Exception("Invalid derived channel {}, expecting name=expression".format(repr(definition)))
+        return cls(name.strip(), expression.strip())
+
+    def evaluate(self, columns, np=None):
+        """ Values of the channel for `columns` ({name: values}). """
+        names = {'abs': abs, 'min': min, 'max': max}
+        if np is not None:
+            names.update({n: getattr(np, n) for n in _MATH_NAMES})
+            names.update({'abs': np.abs, 'min': np.minimum, 'max': np.maximum})
+            return np.broadcast_to(eval(self.code, {'__builtins__': {}}, {**names, **columns}),
+                                   len(next(iter(columns.values()))))
+        names.update({n: getattr(math, n) for n in _MATH_NAMES})
+        keys = list(columns)
+        return [eval(self.code, {'__builtins__': {}}, {**names, **dict(zip(keys, row))})
+                for row in zip(*columns.values())]
+
+
+class Transform:
+    """ Derived channels then decimation of the rows [time, channel values...] of one recording.
+
+    `derived`: list of `DerivedChannel`, `factor`: decimation factor (1 for none),
+    `stats`: statistics of the decimated channels, `channel_stats`: {channel: stats} overriding them.
+    """
+
+    def __init__(self, derived=(), factor=1, stats=STATS, channel_stats=None):
+        self.derived = list(derived)
+        self.factor = int(factor)
+        self.stats = list(stats)
+        self.channel_stats = {column_name(c): list(s) for (c, s) in (channel_stats or {}).items()}
+        for s in self.stats + [s for v in self.channel_stats.values() for s in v]:
+            if s not in STATS:
+                raise Exception("Unknown statistic {}, expecting one of {}".format(s, ", ".join(STATS)))
+        self.np = _numpy()
+        self.names = None
+        self.pending = []  # rows of the incomplete block
+
+    def header(self, columns):
+        """ Output header of the input header `columns` (the first one being the time). """
+        self.columns = list(columns) + [d.name for d in self.derived]
+        self.names = [column_name(c) for c in self.columns]
+        if self.factor <= 1:
+            return self.columns
+        out = [self.columns[0]]
+        for (c, n) in zip(self.columns[1:], self.names[1:]):
+            out += ["{} {}".format(s, c) for s in self.channel_stats.get(n, self.stats)]
+        return out
+
+    def process(self, rows):
+        """ Transform the rows of a chunk (a header row [header string] resets the transform). """
+        out = []
+        for (i, r) in enumerate(rows):
+            if r and isinstance(r[0], str):
+                out += self.process_data(rows[:i]) + self.flush()
+                out.append([",".join(self.header(r[0].split(',')))])
+                return out + self.process(rows[i + 1:])
+        return self.process_data(rows)
+
+    def process_data(self, rows):
+        if not rows:
+            return []
+        if self.names is None:
+            raise Exception("Transform needs the header first")
+        if self.derived:
+            rows = self.derive(rows)
+        if self.factor <= 1:
+            return rows
+        rows = self.pending + rows
+        n = len(rows) - len(rows) % self.factor
+        self.pending = rows[n:]
+        return self.decimate(rows[:n])
+
+    def flush(self):
+        """ The last (incomplete) block. """
+        (rows, self.pending) = (self.pending, [])
+        return self.decimate(rows) if rows else []
+
+    def derive(self, rows):
+        columns = self.names[:len(rows[0])]
+        if self.np is not None:
+            values = self.np.asarray(rows, dtype=float)
+            data = {n: values[:, i] for (i, n) in enumerate(columns)}
+            derived = [d.evaluate(data, self.np) for d in self.derived]
+            # the raw values are kept as read (integers stay integers), only the derived ones are floats
+            return [list(r) + v for (r, v) in zip(rows, self.np.column_stack(derived).tolist())]
+        data = {n: [r[i] for r in rows] for (i, n) in enumerate(columns)}
+        derived = [d.evaluate(data) for d in self.derived]
+        return [list(r) + list(v) for (r, v) in zip(rows, zip(*derived))]
+
+    def decimate(self, rows):
+        """ One row per block of `factor` rows: the block start time and the statistics of each channel. """
+        blocks = [rows[i:i + self.factor] for i in range(0, len(rows), self.factor)]
+        stats_of = [self.channel_stats.get(n, self.stats) for n in self.names[1:]]
+        if self.np is not None and blocks and len(blocks[-1]) == self.factor:
+            np = self.np
+            values = np.asarray(rows, dtype=float).reshape(len(blocks), self.factor, -1)
+            computed = {'mean': values.mean(axis=1), 'min': values.min(axis=1), 'max': values.max(axis=1)}
+            out = [values[:, 0, :1]]
+            for (i, stats) in enumerate(stats_of, 1):
+                out += [computed[s][:, i:i + 1] for s in stats]
+            return np.hstack(out).tolist()
+        functions = {'mean': lambda v: sum(v) / len(v), 'min': min, 'max': max}
+        out = []
+        for b in blocks:
+            row = [b[0][0]]
+            for (i, stats) in enumerate(stats_of, 1):
+                v = [r[i] for r in b]
+                row += [functions[s](v) for s in stats]
+            out.append(row)
+        return out